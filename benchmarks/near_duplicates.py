@@ -0,0 +1,36 @@
+"""Times `MinHashLSH.cluster` on families of point mutants, e.g. `python benchmarks/near_duplicates.py 10000 100000`.
+
+Each family is a random 120 nt sequence and 9 point mutants of it (10 sequences per family), clustered with a 0.5
+similarity threshold on a single core.
+"""
+
+import sys
+import time
+import numpy as np
+
+from rouskinhf.near_duplicates import MinHashLSH
+
+
+def families(n, length=120, family_size=10, seed=0):
+    rng = np.random.default_rng(seed)
+    bases = np.array(list("ACGU"))
+    sequences = []
+    for _ in range(n // family_size):
+        parent = rng.integers(0, 4, size=length)
+        sequences.append("".join(bases[parent]))
+        for _ in range(family_size - 1):
+            mutant = parent.copy()
+            mutant[rng.integers(0, length)] = rng.integers(0, 4)
+            sequences.append("".join(bases[mutant]))
+    return sequences
+
+
+if __name__ == "__main__":
+    for n in [int(n) for n in sys.argv[1:]] or [10_000, 100_000]:
+        sequences = families(n)
+        start = time.perf_counter()
+        clusters = MinHashLSH().cluster(sequences, threshold=0.5)
+        print(
+            f"{n:>10,} sequences {time.perf_counter() - start:>6.1f} s "
+            f"({len(np.unique(clusters)):,} clusters)"
+        )
@@ -1,3 +1,70 @@
-from .conversion import convert
-from .hf import upload_dataset, download_dataset, get_dataset
-from .util import int2dot, dot2int, int2seq, seq2int, UKN, dump_json
+"""The submodules are only imported when one of their attributes is first accessed (PEP 562), so that `import rouskinhf`
+doesn't pay for pandas, scikit-learn or huggingface_hub unless they are needed.
+
+Example:
+    >>> import subprocess, sys
+    >>> code = "import time; t = time.perf_counter(); import rouskinhf; rouskinhf.seq2int; print(time.perf_counter() - t)"
+    >>> float(subprocess.check_output([sys.executable, "-c", code])) < 1.0
+    True
+    >>> code = "import sys, rouskinhf; rouskinhf.get_dataset; print(sorted(m for m in ['pandas', 'sklearn', 'huggingface_hub', 'tqdm'] if m in sys.modules))"
+    >>> subprocess.check_output([sys.executable, "-c", code], text=True).strip()
+    '[]'
+
+The submodules are named apart from the attributes, since importing a submodule binds it on the package over the lazy
+attribute of the same name:
+    >>> import pkgutil
+    >>> [module.name for module in pkgutil.iter_modules(__path__) if module.name in _LAZY_ATTRIBUTES]
+    []
+    >>> code = "import rouskinhf.merging, rouskinhf.exporting, rouskinhf; from rouskinhf import merge; print(type(merge).__name__, type(rouskinhf.export).__name__)"
+    >>> subprocess.check_output([sys.executable, "-c", code], text=True).strip()
+    'function function'
+"""
+
+import importlib
+
+_LAZY_ATTRIBUTES = {
+    "convert": ".conversion",
+    "merge": ".merging",
+    "reservoir_sample": ".sampling",
+    "stratified_sample": ".sampling",
+    "split_dataset": ".sampling",
+    "WorkQueue": ".distributed",
+    "FilterPipeline": ".filter",
+    "refilter": ".filter",
+    "upload_dataset": ".hf",
+    "download_dataset": ".hf",
+    "get_dataset": ".hf",
+    "get_datasets": ".hf",
+    "DatasetCache": ".cache",
+    "SharedDataset": ".shared",
+    "export": ".exporting",
+    "Metrics": ".metrics",
+    "MetricsExporter": ".metrics",
+    "int2dot": ".util",
+    "dot2int": ".util",
+    "int2seq": ".util",
+    "seq2int": ".util",
+    "UKN": ".util",
+    "dump_json": ".util",
+    "SequenceIndex": ".sequence_index",
+    "MotifIndex": ".motif_index",
+    "RecordLog": ".record_log",
+    "diff_datasets": ".content_hashes",
+    "FoldingBackend": ".folding",
+    "register_backend": ".folding",
+    "get_backend": ".folding",
+}
+
+__all__ = list(_LAZY_ATTRIBUTES)
+
+
+def __getattr__(name):
+    if name not in _LAZY_ATTRIBUTES:
+        raise AttributeError(f"module {__name__!r} has no attribute {name!r}")
+    value = getattr(importlib.import_module(_LAZY_ATTRIBUTES[name], __name__), name)
+    globals()[name] = value
+    return value
+
+
+def __dir__():
+    return sorted(list(globals()) + __all__)
@@ -0,0 +1,148 @@
+import os
+import json
+import time
+import multiprocessing
+from concurrent.futures import ProcessPoolExecutor, as_completed
+
+
+def read_manifest(manifest: str) -> list:
+    """Reads a batch manifest: a json list of jobs, each job being the keyword arguments of `convert`.
+
+    Example:
+        >>> import tempfile
+        >>> path = os.path.join(tempfile.mkdtemp(), 'manifest.json')
+        >>> json.dump([{'format': 'ct', 'file_or_folder': 'path/to/ct', 'name': 'my_ct', 'predict_structure': False, 'min_AUROC': 0.8}], open(path, 'w'))
+        >>> read_manifest(path)
+        [{'format': 'ct', 'file_or_folder': 'path/to/ct', 'name': 'my_ct', 'predict_structure': False, 'min_AUROC': 0.8}]
+        >>> json.dump([{'format': 'ct', 'file_or_folder': 'path/to/ct', 'verbose': True}], open(path, 'w'))
+        >>> try:
+        ...     read_manifest(path)
+        ... except AssertionError as e:
+        ...     print(str(e).splitlines()[0])
+        Job {'format': 'ct', 'file_or_folder': 'path/to/ct', 'verbose': True} has arguments that `convert` doesn't take in a batch: ['verbose']
+    """
+    import inspect
+    from .conversion import convert
+
+    with open(manifest, "r") as f:
+        jobs = json.load(f)
+    assert isinstance(jobs, list), "The manifest should be a json list of jobs"
+    # `verbose` is set by the batch, which prints a summary instead of the reports
+    arguments = set(inspect.signature(convert).parameters) - {"verbose"}
+    for job in jobs:
+        for key in ["format", "file_or_folder"]:
+            assert key in job, f"Job {job} has no `{key}`"
+        unknown = set(job) - arguments
+        assert not unknown, f"Job {job} has arguments that `convert` doesn't take in a batch: {sorted(unknown)}"
+    return jobs
+
+
+def _input_size(file_or_folder):
+    if os.path.isfile(file_or_folder):
+        return os.path.getsize(file_or_folder)
+    return sum(
+        os.path.getsize(os.path.join(root, f))
+        for root, _, files in os.walk(file_or_folder)
+        for f in files
+    )
+
+
+def _job_name(job):
+    if job.get("name") is not None:
+        return job["name"]
+    return job["file_or_folder"].split("/")[-1].split(".")[0]
+
+
+def _run_job(job, n_threads, slots):
+    from .conversion import convert
+    from .rnastructure import FoldPool
+
+    FoldPool.configure(n_threads, slots)
+    start = time.time()
+    try:
+        datapoints = convert(**job, verbose=False)
+        return {
+            "status": "done",
+            "n_datapoints": len(datapoints),
+            "seconds": round(time.time() - start, 2),
+        }
+    except Exception as e:
+        return {
+            "status": "failed",
+            "error": f"{e.__class__.__name__}: {e}",
+            "seconds": round(time.time() - start, 2),
+        }
+    finally:
+        FoldPool.shutdown()
+
+
+def convert_batch(
+    jobs: list,
+    path_out: str = "data",
+    cpus: int = None,
+    summary: str = None,
+    verbose: bool = True,
+) -> dict:
+    """Runs several `convert` jobs concurrently over a process pool, with a global CPU budget.
+
+    The jobs are started largest input first. Each job parses its input in its own process, and the RNAstructure predictions
+    of all the jobs share `cpus` slots, so a job with `predict_structure` uses the CPUs left idle by the other jobs.
+
+    Args:
+        jobs (list): Keyword arguments of `convert`, one dict per job. See `read_manifest`.
+        path_out (str, optional): Default output folder of the jobs. Defaults to 'data'.
+        cpus (int, optional): CPU budget. Defaults to the number of CPUs.
+        summary (str, optional): Path of the json summary of the jobs. Defaults to `<path_out>/batch_summary.json`.
+        verbose (bool, optional): Whether to print the summary or not. Defaults to True.
+
+    Returns:
+        dict: {name: {"status", "seconds", "n_datapoints" or "error"}} for each job, in the manifest order.
+    """
+    if cpus is None:
+        cpus = os.cpu_count()
+    if summary is None:
+        summary = os.path.join(path_out, "batch_summary.json")
+    jobs = [{"path_out": path_out, **job} for job in jobs]
+    names = [_job_name(job) for job in jobs]
+    assert len(set(names)) == len(names), "Two jobs have the same name"
+
+    order = sorted(
+        range(len(jobs)), key=lambda i: -_input_size(jobs[i]["file_or_folder"])
+    )
+    results = {}
+    start = time.time()
+    with multiprocessing.Manager() as manager:
+        slots = manager.BoundedSemaphore(cpus)
+        with ProcessPoolExecutor(max_workers=max(1, min(cpus, len(jobs)))) as executor:
+            futures = {
+                executor.submit(_run_job, jobs[i], cpus, slots): names[i]
+                for i in order
+            }
+            for future in as_completed(futures):
+                results[futures[future]] = future.result()
+                if verbose:
+                    print(f"{futures[future]}: {results[futures[future]]}")
+
+    results = {name: results[name] for name in names}
+    os.makedirs(os.path.dirname(os.path.abspath(summary)), exist_ok=True)
+    with open(summary, "w") as f:
+        json.dump(
+            {
+                "cpus": cpus,
+                "seconds": round(time.time() - start, 2),
+                "jobs": results,
+            },
+            f,
+            indent=2,
+        )
+
+    if verbose:
+        print(
+            "Converted {}/{} datasets in {:.1f}s. Summary saved at {}".format(
+                sum([r["status"] == "done" for r in results.values()]),
+                len(results),
+                time.time() - start,
+                summary,
+            )
+        )
+    return results
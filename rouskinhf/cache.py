@@ -0,0 +1,259 @@
+import os
+import json
+import fcntl
+import shutil
+import hashlib
+import datetime
+from contextlib import contextmanager
+
+from .env import Env
+from .path import Path
+
+SIZE_UNITS = {"": 1, "K": 2**10, "M": 2**20, "G": 2**30, "T": 2**40}
+
+
+def parse_size(size) -> int:
+    """Returns a size in bytes, from a number of bytes or a string like '500M' or '20GB'.
+
+    Example:
+        >>> parse_size('20GB'), parse_size('1.5k'), parse_size(1000)
+        (21474836480, 1536, 1000)
+    """
+    if isinstance(size, (int, float)):
+        return int(size)
+    size = size.strip().upper().removesuffix("B").removesuffix("I")
+    unit = size[-1] if size and size[-1] in SIZE_UNITS else ""
+    return int(float(size[: len(size) - len(unit)]) * SIZE_UNITS[unit])
+
+
+def file_checksum(path: str) -> str:
+    """Returns the blake2b checksum of a file, read by chunks."""
+    checksum = hashlib.blake2b()
+    with open(path, "rb") as f:
+        for chunk in iter(lambda: f.read(1 << 20), b""):
+            checksum.update(chunk)
+    return checksum.hexdigest()
+
+
+def _folder_size(folder):
+    return sum(
+        os.path.getsize(os.path.join(root, name))
+        for root, _, names in os.walk(folder)
+        for name in names
+    )
+
+
+class DatasetCache:
+    """Manager of the datasets downloaded to a data folder by `get_dataset`.
+
+    Each download records a `cache_entry.json` in its dataset folder (see `Path.get_cache_entry`): the revision and the
+    size, modification time and checksum of each downloaded file. The modification time of the entry is the last access
+    to the dataset.
+        - `check` is run on each cache hit. It only stats the files, and computes the checksum of a file only if its
+          modification time changed. A dataset that fails is downloaded again.
+        - `verify` computes the checksums of all the files.
+        - `prune` evicts the least recently used datasets until the cache fits in `max_size`. It is run after each download.
+          The datasets being read (see `reading`) or downloaded are skipped.
+
+    Only downloaded datasets are managed. A dataset written locally (`convert`, `merge`, ...) has no entry, and a dataset
+    with a `RecordLog` has local changes: they are never checked against their download nor evicted.
+
+    Args:
+        root (str, optional): Path to the data folder. Defaults to 'data'.
+        max_size (int or str, optional): Size budget of the cache, e.g. '200GB'. Defaults to the environment variable
+            `ROUSKINHF_CACHE_MAX_SIZE`, or no limit.
+
+    Example:
+        >>> import tempfile, time
+        >>> from .util import dump_json
+        >>> cache = DatasetCache(tempfile.mkdtemp(), max_size='3k')
+        >>> for name in ['ds1', 'ds2', 'ds3']:
+        ...     dump_json({'ref': {'sequence': 'A' * 1000}}, os.path.join(cache.root, name, 'data.json'))
+        ...     cache.record(name, ['data.json'], revision='v1')
+        ...     time.sleep(0.01)
+        >>> cache.touch('ds1')
+        >>> [entry['name'] for entry in cache.list()]  # least recently used first
+        ['ds2', 'ds3', 'ds1']
+        >>> cache.prune()
+        ['ds2']
+        >>> with open(os.path.join(cache.root, 'ds3', 'data.json'), 'r+') as f:
+        ...     _ = f.write('{"ref": {"sequence": "C')  # corrupted on disk
+        >>> cache.check('ds1'), cache.check('ds3'), cache.check('ds1', revision='v2')
+        (True, False, False)
+        >>> cache.verify()
+        {'ds1': True, 'ds3': False}
+        >>> with cache.reading('ds1'):
+        ...     cache.prune(max_size=0)
+        ['ds3']
+    """
+
+    def __init__(self, root: str = "data", max_size=None):
+        self.root = root
+        if max_size is None:
+            max_size = Env.get_cache_max_size()
+        self.max_size = parse_size(max_size) if max_size is not None else None
+
+    def _path(self, name) -> Path:
+        return Path(name=name, root=self.root)
+
+    def _read_entry(self, name):
+        try:
+            with open(self._path(name).get_cache_entry(), "r") as f:
+                return json.load(f)
+        except (FileNotFoundError, json.JSONDecodeError):
+            return None
+
+    def _write_entry(self, name, entry):
+        path = self._path(name).get_cache_entry()
+        with open(path + ".tmp", "w") as f:
+            json.dump(entry, f, indent=2)
+        os.replace(path + ".tmp", path)
+
+    def _is_managed(self, name) -> bool:
+        path = self._path(name)
+        return os.path.exists(path.get_cache_entry()) and not os.path.exists(
+            path.get_record_log()
+        )
+
+    def names(self) -> list:
+        """Returns the names of the managed datasets."""
+        if not os.path.isdir(self.root):
+            return []
+        return sorted(
+            name
+            for name in os.listdir(self.root)
+            if not name.startswith(".") and self._is_managed(name)
+        )
+
+    def record(self, name: str, files: list, revision: str = None) -> None:
+        """Records the download of `files` (relative to the dataset folder) at `revision`."""
+        folder = self._path(name).get_main_folder()
+        entry = {
+            "revision": revision,
+            "downloaded_at": datetime.datetime.now().isoformat(),
+            "files": {},
+        }
+        for file in files:
+            stat = os.stat(os.path.join(folder, file))
+            entry["files"][file] = {
+                "size": stat.st_size,
+                "mtime_ns": stat.st_mtime_ns,
+                "blake2b": file_checksum(os.path.join(folder, file)),
+            }
+        self._write_entry(name, entry)
+
+    def touch(self, name: str) -> None:
+        """Marks a dataset as accessed now."""
+        try:
+            os.utime(self._path(name).get_cache_entry())
+        except FileNotFoundError:
+            pass
+
+    def check(self, name: str, revision: str = None, full: bool = False) -> bool:
+        """Whether the downloaded files of a dataset are intact, and at `revision` if given.
+
+        The checksum of a file is only computed if its size matches and its modification time changed, or with `full`.
+        Datasets that aren't managed (see the class) pass.
+        """
+        if not self._is_managed(name):
+            return True
+        entry = self._read_entry(name)
+        if entry is None:
+            return False
+        if revision is not None and entry["revision"] != revision:
+            return False
+        folder = self._path(name).get_main_folder()
+        updated = False
+        for file, expected in entry["files"].items():
+            try:
+                stat = os.stat(os.path.join(folder, file))
+            except FileNotFoundError:
+                return False
+            if stat.st_size != expected["size"]:
+                return False
+            if full or stat.st_mtime_ns != expected["mtime_ns"]:
+                if file_checksum(os.path.join(folder, file)) != expected["blake2b"]:
+                    return False
+                if stat.st_mtime_ns != expected["mtime_ns"]:
+                    expected["mtime_ns"], updated = stat.st_mtime_ns, True
+        if updated:  # e.g. copied without preserving the times, skip the checksum next time
+            self._write_entry(name, entry)
+        return True
+
+    def verify(self, names: list = None) -> dict:
+        """Computes the checksums of the downloaded files. Returns {name: whether the files are intact}."""
+        return {
+            name: self.check(name, full=True) for name in (names or self.names())
+        }
+
+    def list(self) -> list:
+        """Returns the managed datasets, least recently used first, as dicts with the name, size, last access and revision."""
+        entries = []
+        for name in self.names():
+            entry = self._read_entry(name) or {}
+            path = self._path(name)
+            entries.append(
+                {
+                    "name": name,
+                    "size": _folder_size(path.get_main_folder()),
+                    "last_access": datetime.datetime.fromtimestamp(
+                        os.path.getmtime(path.get_cache_entry())
+                    ).isoformat(),
+                    "revision": entry.get("revision"),
+                }
+            )
+        return sorted(entries, key=lambda e: e["last_access"])
+
+    def size(self) -> int:
+        """Returns the size in bytes of the managed datasets."""
+        return sum(entry["size"] for entry in self.list())
+
+    @contextmanager
+    def reading(self, name: str):
+        """Holds a shared lock on the download lock of a dataset while it is read, so that it isn't evicted or
+        downloaded again mid-read. Downloads and evictions take the lock exclusively."""
+        os.makedirs(self.root, exist_ok=True)
+        with open(self._path(name).get_download_lock(), "a") as lock:
+            fcntl.flock(lock, fcntl.LOCK_SH)
+            try:
+                yield
+            finally:
+                fcntl.flock(lock, fcntl.LOCK_UN)
+
+    def remove(self, name: str, blocking: bool = True) -> bool:
+        """Deletes a dataset folder under its download lock. Returns False if `blocking` is False and the dataset is being downloaded or read."""
+        path = self._path(name)
+        os.makedirs(self.root, exist_ok=True)
+        with open(path.get_download_lock(), "a") as lock:
+            try:
+                fcntl.flock(lock, fcntl.LOCK_EX | (0 if blocking else fcntl.LOCK_NB))
+            except BlockingIOError:
+                return False
+            try:
+                shutil.rmtree(path.get_main_folder(), ignore_errors=True)
+            finally:
+                fcntl.flock(lock, fcntl.LOCK_UN)
+        return True
+
+    def prune(self, max_size=None, exclude: list = ()) -> list:
+        """Evicts the least recently used datasets until the cache fits in `max_size`. Returns the names of the evicted datasets.
+
+        Args:
+            max_size (int or str, optional): Size budget. Defaults to the budget of the cache. Nothing is evicted without budget.
+            exclude (list, optional): Names of datasets to keep, e.g. the one just downloaded.
+        """
+        max_size = parse_size(max_size) if max_size is not None else self.max_size
+        if max_size is None:
+            return []
+        entries = self.list()
+        total = sum(entry["size"] for entry in entries)
+        evicted = []
+        for entry in entries:
+            if total <= max_size:
+                break
+            if entry["name"] in exclude:
+                continue
+            if self.remove(entry["name"], blocking=False):
+                total -= entry["size"]
+                evicted.append(entry["name"])
+        return evicted
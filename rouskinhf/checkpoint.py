@@ -0,0 +1,101 @@
+import os
+import json
+
+from .datapoint import Datapoint
+
+
+class Checkpoint:
+    """Append-only journal of the datapoints created by a conversion, to resume it after a crash.
+
+    The first line identifies the input, and each following line is `[index of the record in the input, datapoint]`.
+    The journal is fsync'd every `fsync_every` records, so at most `fsync_every` records are lost in a crash.
+    A truncated last line is ignored, and a journal written for another input is discarded.
+
+    Args:
+        path (str): Path to the journal, see `Path.get_checkpoint`.
+        source (str): Identifier of the input, e.g. the path of the input file and the conversion options.
+        fsync_every (int, optional): Number of records between two fsync. Defaults to 100.
+
+    Example:
+        >>> import tempfile
+        >>> path = os.path.join(tempfile.mkdtemp(), 'checkpoint.jsonl')
+        >>> with Checkpoint(path, 'my_file.fasta') as checkpoint:
+        ...     checkpoint.write(0, Datapoint(reference='ref1', sequence='AACCGG', structure=[[0, 5], [1, 4]]))
+        ...     checkpoint.write(1, None)
+        >>> Checkpoint(path, 'my_file.fasta').load()
+        {0: Datapoint('ref1', sequence='AACCGG', structure=[[0, 5], [1, 4]]), 1: None}
+        >>> Checkpoint(path, 'another_file.fasta').load()
+        {}
+    """
+
+    def __init__(self, path: str, source: str, fsync_every: int = 100):
+        self.path = path
+        self.source = source
+        self.fsync_every = fsync_every
+        self._file = None
+        self._n_unsynced = 0
+
+    def load(self) -> dict:
+        """Returns the datapoints of the journal as {index: datapoint}. Invalid datapoints are None."""
+        if not os.path.exists(self.path):
+            return {}
+        done = {}
+        with open(self.path, "r") as f:
+            for n, line in enumerate(f):
+                if not line.endswith("\n"):
+                    break  # the last line was being written when the process stopped
+                record = json.loads(line)
+                if n == 0:
+                    if record != {"source": self.source}:
+                        return {}
+                    continue
+                idx, datapoint = record
+                done[idx] = (
+                    None
+                    if datapoint is None
+                    else Datapoint.from_flat_dict(
+                        {k: v for k, v in datapoint.items() if v is not None}
+                    )
+                )
+        return done
+
+    def __enter__(self):
+        if self.load():
+            # drop a truncated last line before appending
+            with open(self.path, "rb+") as f:
+                valid = 0
+                for line in f:
+                    if not line.endswith(b"\n"):
+                        break
+                    valid += len(line)
+                f.truncate(valid)
+            self._file = open(self.path, "a")
+        else:
+            self._file = open(self.path, "w")
+            self._file.write(json.dumps({"source": self.source}) + "\n")
+        return self
+
+    def write(self, idx: int, datapoint: Datapoint) -> None:
+        """Append a datapoint to the journal. `datapoint` is None for an invalid record."""
+        if datapoint is not None:
+            datapoint.convert_arrays_to_list()
+            datapoint = datapoint.to_flat_dict()
+        self._file.write(json.dumps([idx, datapoint], default=float) + "\n")
+        self._n_unsynced += 1
+        if self._n_unsynced >= self.fsync_every:
+            self.sync()
+
+    def sync(self) -> None:
+        self._file.flush()
+        os.fsync(self._file.fileno())
+        self._n_unsynced = 0
+
+    def __exit__(self, *args):
+        self.sync()
+        self._file.close()
+        self._file = None
+
+    def clear(self) -> None:
+        """Remove the journal, once the conversion is saved."""
+        if os.path.exists(self.path):
+            os.remove(self.path)
@@ -0,0 +1,252 @@
+import argparse
+import sys
+
+
+def main(argv=None):
+    """Entry point of the `rouskinhf` command."""
+    parser = argparse.ArgumentParser(
+        prog="rouskinhf", description="Manipulate RNA datasets for eFold."
+    )
+    commands = parser.add_subparsers(dest="command", required=True)
+
+    batch = commands.add_parser(
+        "convert-batch",
+        help="Convert the datasets of a manifest concurrently.",
+        description='Convert the datasets of a manifest concurrently. The manifest is a json list of `convert` arguments, e.g. [{"format": "ct", "file_or_folder": "path/to/ct", "name": "my_ct", "predict_structure": false, "min_AUROC": 0.8}].',
+    )
+    batch.add_argument("manifest", help="Path to the json manifest.")
+    batch.add_argument(
+        "--path-out", default="data", help="Output folder. Defaults to 'data'."
+    )
+    batch.add_argument(
+        "--cpus", type=int, default=None, help="CPU budget. Defaults to all CPUs."
+    )
+    batch.add_argument(
+        "--summary",
+        default=None,
+        help="Path of the json summary. Defaults to <path-out>/batch_summary.json.",
+    )
+
+    diff = commands.add_parser(
+        "diff",
+        help="List the datapoints added, removed, changed or renamed between two versions of a dataset.",
+        description="Compare two versions of a dataset by the content hashes of their datapoints. OLD and NEW are dataset folders, data.json files or content_hashes.json files. The change set is printed as json.",
+    )
+    diff.add_argument("old", help="Old version, e.g. the cached download.")
+    diff.add_argument("new", help="New version, e.g. the local conversion.")
+    diff.add_argument(
+        "--output", default=None, help="Write the change set to this file."
+    )
+
+    distribute = commands.add_parser(
+        "distribute",
+        help="Split a conversion in work units, for `rouskinhf work` on several hosts.",
+        description="Split a conversion in work units on a shared filesystem. Run `rouskinhf work QUEUE` on any number of hosts, then `rouskinhf finalize QUEUE`. Prints the path of the queue.",
+    )
+    distribute.add_argument("format", help="ct, seismic, json, bpseq or fasta.")
+    distribute.add_argument("file_or_folder", help="Input file or folder.")
+    distribute.add_argument("--name", default=None, help="Name of the dataset.")
+    distribute.add_argument(
+        "--path-out", default="data", help="Output folder. Defaults to 'data'."
+    )
+    distribute.add_argument(
+        "--units", type=int, default=64, help="Number of work units. Defaults to 64."
+    )
+    distribute.add_argument(
+        "--predict-structure", action="store_true", help="Predict the structures."
+    )
+    distribute.add_argument(
+        "--predict-pairing-probability",
+        action="store_true",
+        help="Predict the pairing probabilities, from the same partition function as the structures.",
+    )
+    distribute.add_argument(
+        "--options",
+        default="{}",
+        help='Other arguments of `convert` as json, e.g. \'{"min_AUROC": 0.8, "compression": "gzip"}\'.',
+    )
+
+    work = commands.add_parser(
+        "work", help="Process the work units of a queue until it is empty."
+    )
+    work.add_argument("queue", help="Path to the queue.")
+    work.add_argument(
+        "--heartbeat",
+        type=float,
+        default=30,
+        help="Seconds between two touches of the claimed unit. Defaults to 30.",
+    )
+
+    finalize = commands.add_parser(
+        "finalize",
+        help="Wait for the work units of a queue, then merge, filter and write the dataset.",
+    )
+    finalize.add_argument("queue", help="Path to the queue.")
+    finalize.add_argument(
+        "--stale-after",
+        type=float,
+        default=600,
+        help="Requeue the units whose worker didn't touch them for this many seconds. Defaults to 600.",
+    )
+    finalize.add_argument(
+        "--poll", type=float, default=5, help="Seconds between two checks of the queue. Defaults to 5."
+    )
+
+    cache = commands.add_parser(
+        "cache",
+        help="List, prune or verify the downloaded datasets.",
+        description="Manage the datasets downloaded by `get_dataset`. `list` prints them as json, least recently used first. `prune` evicts the least recently used ones until the cache fits in --max-size. `verify` checks the checksums of their files, and exits with 1 if one is corrupted.",
+    )
+    cache.add_argument("action", choices=["list", "prune", "verify"])
+    cache.add_argument(
+        "--path", default="data", help="Data folder. Defaults to 'data'."
+    )
+    cache.add_argument(
+        "--max-size",
+        default=None,
+        help="Size budget for `prune`, e.g. 200GB. Defaults to $ROUSKINHF_CACHE_MAX_SIZE.",
+    )
+
+    serve = commands.add_parser(
+        "serve",
+        help="Run the local prediction service, shared by the processes of the host.",
+        description="Serve the structure predictions over a Unix socket. The processes of the host use it with FOLDING_BACKEND=service. Identical requests in flight are folded once. The cache hits are exported as configured by $ROUSKINHF_METRICS_FILE and $ROUSKINHF_METRICS_PORT.",
+    )
+    serve.add_argument(
+        "--socket",
+        default=None,
+        help="Path of the Unix socket. Defaults to $ROUSKINHF_PREDICTION_SOCKET.",
+    )
+    serve.add_argument(
+        "--threads",
+        type=int,
+        default=None,
+        help="Number of predictions running at the same time. Defaults to the number of CPUs.",
+    )
+    serve.add_argument(
+        "--backend",
+        default=None,
+        help="Folding backend of the server. Defaults to $FOLDING_BACKEND, or rnastructure.",
+    )
+
+    export = commands.add_parser(
+        "export",
+        help="Write the datapoints of a dataset as ct, bpseq or fasta files.",
+        description="Write the datapoints of a dataset as ct, bpseq or fasta files, in an archive (.tar, .tar.gz, .tgz, .tar.zst, .zip), a single fasta file (.fasta, .fa, .fna, optionally .gz or .zst) or a folder, depending on the extension of OUTPUT. INPUT is a dataset folder or a data.json file. The counts of datapoints written and skipped are printed as json.",
+    )
+    export.add_argument("input", help="Dataset folder or data.json file.")
+    export.add_argument("format", choices=["ct", "bpseq", "fasta"])
+    export.add_argument("output", help="Archive, fasta file or folder to write.")
+    export.add_argument(
+        "--workers", type=int, default=1, help="Number of formatting processes. Defaults to 1."
+    )
+    export.add_argument(
+        "--chunk-size",
+        type=int,
+        default=1000,
+        help="Number of records sent to a worker at once. Defaults to 1000.",
+    )
+
+    args = parser.parse_args(argv)
+
+    if args.command == "convert-batch":
+        from .batch import read_manifest, convert_batch
+
+        results = convert_batch(
+            read_manifest(args.manifest),
+            path_out=args.path_out,
+            cpus=args.cpus,
+            summary=args.summary,
+        )
+        return int(any(r["status"] != "done" for r in results.values()))
+
+    if args.command in ["distribute", "work", "finalize"]:
+        import json
+        from .distributed import WorkQueue
+
+        if args.command == "distribute":
+            queue = WorkQueue.submit(
+                args.format,
+                args.file_or_folder,
+                name=args.name,
+                path_out=args.path_out,
+                predict_structure=args.predict_structure,
+                predict_pairing_probability=args.predict_pairing_probability,
+                n_units=args.units,
+                **json.loads(args.options),
+            )
+            print(queue.folder)
+        elif args.command == "work":
+            WorkQueue(args.queue).work(heartbeat=args.heartbeat)
+        else:
+            WorkQueue(args.queue).finalize(stale_after=args.stale_after, poll=args.poll)
+        return 0
+
+    if args.command == "serve":
+        from .rnastructure import PredictionServer
+        from .metrics import MetricsExporter
+
+        server = PredictionServer(
+            args.socket, n_threads=args.threads, backend=args.backend
+        )
+        print(f"Serving predictions on {server.socket_path}")
+        with MetricsExporter.from_env(job="serve"):
+            server.serve_forever()
+        return 0
+
+    if args.command == "cache":
+        import json
+        from .cache import DatasetCache
+
+        manager = DatasetCache(args.path, max_size=args.max_size)
+        if args.action == "list":
+            print(json.dumps(manager.list(), indent=2))
+        elif args.action == "prune":
+            for name in manager.prune():
+                print(f"Evicted {name}")
+        else:
+            results = manager.verify()
+            print(json.dumps(results, indent=2))
+            return int(not all(results.values()))
+        return 0
+
+    if args.command == "diff":
+        import json
+        from .content_hashes import diff_datasets
+
+        changes = diff_datasets(args.old, args.new)
+        if args.output is not None:
+            with open(args.output, "w") as f:
+                json.dump(changes, f, indent=2)
+        else:
+            print(json.dumps(changes, indent=2))
+        return 0
+
+    if args.command == "export":
+        import os
+        import json
+        from .path import Path
+        from .exporting import export
+
+        data_json = args.input
+        if os.path.isdir(data_json):
+            folder = os.path.abspath(data_json)
+            data_json = Path(
+                name=os.path.basename(folder), root=os.path.dirname(folder)
+            ).get_data_json()
+        print(
+            json.dumps(
+                export(
+                    data_json,
+                    args.format,
+                    args.output,
+                    n_workers=args.workers,
+                    chunk_size=args.chunk_size,
+                )
+            )
+        )
+        return 0
+
+
+if __name__ == "__main__":
+    sys.exit(main())
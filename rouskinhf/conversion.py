@@ -1,6 +1,15 @@
 from .list_datapoints import ListofDatapoints
 from .path import Path
-from .filter import filter as filter_datapoints
+from .filter import FilterPipeline
+from .sequence_index import SequenceIndex
+from .motif_index import MotifIndex
+from .content_hashes import write_content_hashes
+from .checkpoint import Checkpoint
+from .util import DATA_JSON_EXTENSIONS
+from .metrics import Metrics, MetricsExporter
+from .env import Env
+import json
+import os
 
 
 def convert(
@@ -9,61 +18,240 @@ def convert(
     name: str = None,
     path_out: str = "data",
     predict_structure: bool = False,
-    filter: bool = True,
+    predict_pairing_probability: bool = False,
+    filter=True,
     min_AUROC=0.8,
+    near_duplicates: float = None,
+    drop_near_duplicates: bool = False,
+    motif_index: bool = False,
+    checkpoint_every: int = 100,
+    compression: str = None,
+    quantize: bool = False,
     verbose: bool = True,
+    metrics: str = None,
+    metrics_port: int = None,
 ):
     """Converts a file or folder into a json file. Different formats are supported.
 
     Args:
         format (str): Format of the input file. Can be 'ct', 'seismic', 'json', 'bpseq' or 'fasta'.
-        file_or_folder (str): Path to the file or folder to convert.
+        file_or_folder (str): Path to the file or folder to convert. ct and bpseq files can also be read from a .tar, .tar.gz or .zip archive.
         name (str, optional): Name of the dataset. Defaults to None, in which case the name of the file or folder will be used.
         path_out (str, optional): Path to the output folder. Defaults to 'data'.
         predict_structure (bool, optional): Whether to predict the structure or not using RNAstructure. Defaults to False.
-        filter (bool, optional): Whether to filter the datapoints or not. Defaults to True. Datapoints with no sequence or reference will be dropped anyways.
-        min_AUROC (float, optional): Minimum AUROC to keep a datapoint. Defaults to 0.8.
+        predict_pairing_probability (bool, optional): Whether to predict the probability of each base to be paired, stored as `pairing_probability`. With `predict_structure`, both come from a single partition function run, and the structure is the maximum expected accuracy structure. Defaults to False.
+        filter (bool, dict or FilterPipeline, optional): Whether to filter the datapoints or not. Defaults to True. Datapoints with no sequence or reference will be dropped anyways. True applies `FilterPipeline.default`, a dict is passed to `FilterPipeline.from_config`, e.g. {'length': [10, 1000], 'max_mutation_rate': 0.3, 'min_coverage': 0.5, 'gc_content': [0.2, 0.8], 'min_AUROC': 0.8, 'deduplicate': 'structure'}.
+        min_AUROC (float, optional): Minimum AUROC to keep a datapoint, with `filter=True`. Defaults to 0.8.
+        near_duplicates (float, optional): If not None, cluster near-identical sequences with MinHash/LSH using this similarity threshold and write the clusters to `near_duplicates.json`. Defaults to None.
+        drop_near_duplicates (bool, optional): Whether to keep only one datapoint per near-duplicate cluster. Defaults to False.
+        motif_index (bool, optional): Whether to build a k-mer search index of the sequences and save it to `motif_index.npz`. Load it with `MotifIndex.load` to find the datapoints containing a motif. Defaults to False.
+        checkpoint_every (int, optional): With `predict_structure` or `predict_pairing_probability`, the datapoints are journaled to `checkpoint.jsonl`, which is fsync'd every `checkpoint_every` records. A conversion restarted after a crash skips the records already in the journal. None disables the journal. Defaults to 100.
+        compression (str, optional): Compress the output with 'gzip' (data.json.gz) or 'zstd' (data.json.zst, needs the zstandard package). Defaults to None.
+        quantize (bool, optional): Whether to store the dms and shape signals as uint16 fixed-point instead of decimal text. The 4 decimals are kept. Defaults to False.
         verbose (bool, optional): Whether to print the conversion report or not. Defaults to True.
+        metrics (str, optional): Path of a Prometheus text file of the progress of the conversion (records/s, bases/s, folds/s, queue depth, cache hits, memory per stage), rewritten every 15 seconds. `{job}` is replaced by the name of the dataset. Defaults to `ROUSKINHF_METRICS_FILE`, or no file. See `MetricsExporter`.
+        metrics_port (int, optional): Local port of an HTTP endpoint serving the same metrics. Defaults to `ROUSKINHF_METRICS_PORT`, or no endpoint.
+
+    Example:
+        >>> import tempfile
+        >>> from .util import iter_json
+        >>> root = tempfile.mkdtemp()
+        >>> data = convert('seismic', 'data/input_files_for_testing/test_dreem_output.json', path_out=root, verbose=False)
+        >>> len(data)
+        12
+        >>> written = dict(iter_json(os.path.join(root, 'test_dreem_output', 'data.json')))
+        >>> list(written) == list(data), all(isinstance(v, float) for v in written[next(iter(written))]['dms'])
+        (True, True)
+        >>> _ = convert('seismic', 'data/input_files_for_testing/test_dreem_output.json', name='no_rules', path_out=root, filter={}, verbose=False)
+        >>> os.path.exists(Path(name='no_rules', root=root).get_quality_scores())  # {} is a pipeline without rules, not filter=False
+        True
     """
     assert format in ["ct", "seismic", "json", "bpseq", "fasta"], "Format not supported"
+    assert compression in DATA_JSON_EXTENSIONS, "Compression not supported"
 
     if name is None:
         name = file_or_folder.split("/")[-1].split(".")[0]
     path = Path(name=name, root=path_out)
     path.make()
 
+    checkpoint = None
+    if (predict_structure or predict_pairing_probability) and checkpoint_every is not None:
+        checkpoint = Checkpoint(
+            path.get_checkpoint(),
+            source=_checkpoint_source(
+                format, file_or_folder, predict_structure, predict_pairing_probability
+            ),
+            fsync_every=checkpoint_every,
+        )
+
+    exporter = MetricsExporter(
+        metrics or Env.get_metrics_file(),
+        metrics_port if metrics_port is not None else Env.get_metrics_port(),
+        job=name,
+    )
+    with exporter:
+        with Metrics.stage("read"):
+            datapoints = _read_datapoints(
+                format,
+                file_or_folder,
+                predict_structure,
+                verbose=verbose,
+                checkpoint=checkpoint,
+                predict_pairing_probability=predict_pairing_probability,
+            )
+
+        return _write_dataset(
+            datapoints,
+            name,
+            path_out,
+            filter=filter,
+            min_AUROC=min_AUROC,
+            near_duplicates=near_duplicates,
+            drop_near_duplicates=drop_near_duplicates,
+            motif_index=motif_index,
+            compression=compression,
+            quantize=quantize,
+            verbose=verbose,
+            checkpoint=checkpoint,
+        )
+
+
+def _checkpoint_source(
+    format, file_or_folder, predict_structure=False, predict_pairing_probability=False
+):
+    """Identifies the input and the predictions of a journal, so that a conversion only resumes its own journal: the
+    journal is started over if the input was edited in place (size, mtime), if the predictions or the folding backend
+    changed.
+
+    Example:
+        >>> import tempfile
+        >>> fasta = os.path.join(tempfile.mkdtemp(), 'sequences.fasta')
+        >>> _ = open(fasta, 'w').write('>ref1\\nACGU\\n')
+        >>> source = _checkpoint_source('fasta', fasta)
+        >>> _ = open(fasta, 'a').write('>ref2\\nGGCC\\n')
+        >>> _checkpoint_source('fasta', fasta) == source
+        False
+        >>> _checkpoint_source('fasta', fasta, predict_structure=True) == _checkpoint_source('fasta', fasta, predict_structure=True, predict_pairing_probability=True)
+        False
+    """
+    stat = os.stat(file_or_folder)
+    return json.dumps(
+        [
+            format,
+            os.path.abspath(file_or_folder),
+            stat.st_size,
+            stat.st_mtime_ns,
+            Env.get_folding_backend(),
+        ]
+        + (["structure"] if predict_structure else [])
+        + (["pairing_probability"] if predict_pairing_probability else [])
+    )
+
+
+def _read_datapoints(
+    format,
+    file_or_folder,
+    predict_structure=False,
+    verbose=True,
+    checkpoint=None,
+    subset=None,
+    tqdm=True,
+    predict_pairing_probability=False,
+):
+    """Reads the datapoints of a file or folder, see `convert`. `subset` selects a part of the input, see `ListofDatapoints.from_fasta`."""
     if format == "ct":
         datapoints = ListofDatapoints.from_ct(
-            file_or_folder, tqdm=True, verbose=verbose
+            file_or_folder, tqdm=tqdm, verbose=verbose, subset=subset
         )
 
     elif format == "seismic":
         datapoints = ListofDatapoints.from_dreem_output(
-            file_or_folder, predict_structure, tqdm=True, verbose=verbose
+            file_or_folder,
+            predict_structure,
+            tqdm=tqdm,
+            verbose=verbose,
+            subset=subset,
+            checkpoint=checkpoint,
+            predict_pairing_probability=predict_pairing_probability,
         )
 
     elif format == "json":
         datapoints = ListofDatapoints.from_json(
-            file_or_folder, predict_structure, tqdm=True, verbose=verbose
+            file_or_folder,
+            predict_structure,
+            tqdm=tqdm,
+            verbose=verbose,
+            subset=subset,
+            checkpoint=checkpoint,
+            predict_pairing_probability=predict_pairing_probability,
         )
 
     elif format == "bpseq":
         datapoints = ListofDatapoints.from_bpseq(
-            file_or_folder, tqdm=True, verbose=verbose
+            file_or_folder, tqdm=tqdm, verbose=verbose, subset=subset
         )
 
     elif format == "fasta":
         datapoints = ListofDatapoints.from_fasta(
-            file_or_folder, predict_structure, tqdm=True, verbose=verbose
+            file_or_folder,
+            predict_structure,
+            tqdm=tqdm,
+            verbose=verbose,
+            subset=subset,
+            checkpoint=checkpoint,
+            predict_pairing_probability=predict_pairing_probability,
         )
 
-    if filter:
-        report = filter_datapoints(datapoints, min_AUROC=min_AUROC)
-    else:
-        _, report = datapoints.drop_none_dp()
-        report = (
-            f"Drop {report} datapoints with None values (null sequence or reference)"
-        )
+    return datapoints
+
+
+def _write_dataset(
+    datapoints,
+    name,
+    path_out,
+    filter=True,
+    min_AUROC=0.8,
+    near_duplicates=None,
+    drop_near_duplicates=False,
+    motif_index=False,
+    compression=None,
+    quantize=False,
+    verbose=True,
+    checkpoint=None,
+):
+    """Filters the datapoints, writes the dataset and its report, and returns the datapoints as a dict, see `convert`."""
+    path = Path(name=name, root=path_out)
+    filtered = filter is not False and filter is not None  # an empty dict of rules still validates the structures
+    with Metrics.stage("filter"):
+        if filtered:
+            if isinstance(filter, dict):
+                pipeline = FilterPipeline.from_config(
+                    filter,
+                    near_duplicates=near_duplicates,
+                    drop_near_duplicates=drop_near_duplicates,
+                )
+            elif isinstance(filter, FilterPipeline):
+                pipeline = filter
+            else:
+                pipeline = FilterPipeline.default(
+                    min_AUROC,
+                    near_duplicates=near_duplicates,
+                    drop_near_duplicates=drop_near_duplicates,
+                )
+            report = pipeline.apply(datapoints)
+            if pipeline.near_duplicates is not None:
+                with open(path.get_near_duplicates(), "w") as f:
+                    json.dump(datapoints.near_duplicate_clusters, f, indent=2)
+        else:
+            _, report = datapoints.drop_none_dp()
+            report = (
+                f"Drop {report} datapoints with None values (null sequence or reference)"
+            )
+
+    if datapoints.fold_timeouts:
+        report += f"""
+### STRUCTURE PREDICTION TIMED OUT
+- {len(datapoints.fold_timeouts)} datapoints dropped: {', '.join(datapoints.fold_timeouts)}"""
 
     if verbose:
         print(report)
@@ -73,6 +261,35 @@ def convert(
         f.write(report)
 
     if path_out is not None:
-        datapoints.to_json(path.get_data_json())
+        with Metrics.stage("write"):
+            # remove the data.json files written with another compression
+            for other in DATA_JSON_EXTENSIONS:
+                if other != compression and os.path.exists(path.get_data_json(other)):
+                    os.remove(path.get_data_json(other))
+            datapoints.to_json(path.get_data_json(compression), quantize=quantize)
+            write_content_hashes(path.get_data_json(compression))
+            # the quality scores and the dropped datapoints, to filter again with `refilter`
+            for other in DATA_JSON_EXTENSIONS:
+                if (other != compression or not filtered) and os.path.exists(
+                    path.get_filtered_out(other)
+                ):
+                    os.remove(path.get_filtered_out(other))
+            if filtered:
+                datapoints.quality_scores.save(path.get_quality_scores())
+                ListofDatapoints(datapoints.filtered_out, verbose=False).to_json(
+                    path.get_filtered_out(compression), quantize=quantize
+                )
+            elif os.path.exists(path.get_quality_scores()):
+                os.remove(path.get_quality_scores())
+            if checkpoint is not None:
+                checkpoint.clear()
+            SequenceIndex(path_out).add(
+                name, [datapoint.sequence for datapoint in datapoints.datapoints]
+            )
+            if motif_index:
+                MotifIndex(
+                    [datapoint.reference for datapoint in datapoints.datapoints],
+                    [datapoint.sequence for datapoint in datapoints.datapoints],
+                ).save(path.get_motif_index())
 
     return datapoints.to_dict()
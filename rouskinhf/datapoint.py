@@ -3,8 +3,11 @@ from .util import (
     standardize_sequence,
     sequence_has_regular_characters,
 )
+import time
 import numpy as np
-from .rnastructure import RNAstructure_singleton
+from .folding import get_backend
+from .rnastructure import FoldTimeoutError
+from .metrics import Metrics
 
 
 class Datapoint:
@@ -43,6 +46,7 @@ class Datapoint:
         dms=None,
         shape=None,
         structure=None,
+        pairing_probability=None,
     ):
         for attr in [sequence, reference]:
             assert isinstance(
@@ -68,11 +72,13 @@ class Datapoint:
             self.dms = self._format_signal(dms)
         if shape is not None:
             self.shape = self._format_signal(shape)
+        if pairing_probability is not None:
+            self.pairing_probability = self._format_signal(pairing_probability)
 
     def get_opt_dict(self):
         return {
             attr: eval(f"self.{attr}")
-            for attr in ["structure", "dms", "shape"]
+            for attr in ["structure", "dms", "shape", "pairing_probability"]
             if hasattr(self, attr)
         }
 
@@ -131,6 +137,8 @@ class Datapoint:
             self.dms = tuple(self.dms)
         if self._assert_exists("shape"):
             self.shape = tuple(self.shape)
+        if self._assert_exists("pairing_probability"):
+            self.pairing_probability = tuple(self.pairing_probability)
         if self._assert_exists("structure"):
             self.structure = tuple([tuple(pair) for pair in self.structure])
 
@@ -139,6 +147,8 @@ class Datapoint:
             self.dms = list(self.dms)
         if self._assert_exists("shape"):
             self.shape = list(self.shape)
+        if self._assert_exists("pairing_probability"):
+            self.pairing_probability = list(self.pairing_probability)
         if self._assert_exists("structure"):
             self.structure = [list(pair) for pair in self.structure]
 
@@ -188,6 +198,8 @@ class Datapoint:
             out += f", structure={self.structure}"
         if hasattr(self, "dms"):
             out += f", dms={self.dms}"
+        if hasattr(self, "pairing_probability"):
+            out += f", pairing_probability={self.pairing_probability}"
         return out + ")"
 
     def dotbracket_to_structure(self, dotbracket):
@@ -202,12 +214,54 @@ class Datapoint:
         return structure
 
 
+def _predict(sequence, predict_structure, predict_pairing_probability, dms=None, shape=None):
+    """Returns the predicted (dotbracket, pairing probability) of a sequence, None for what isn't requested.
+    When both are requested, they come from a single partition function, see `FoldingBackend.predict_structure_and_pairing_probability`.
+    Only the actual predictions are counted in the fold metrics.
+
+    Example:
+        >>> Metrics.reset()
+        >>> _predict("GGGAAACCC", predict_structure=False, predict_pairing_probability=False), Metrics.total("folds_total")
+        ((None, None), 0)
+    """
+    if not predict_structure and not predict_pairing_probability:
+        return None, None
+    backend = get_backend()
+    start = time.time()
+    try:
+        if predict_structure and predict_pairing_probability:
+            return backend.predict_structure_and_pairing_probability(
+                sequence, dms=dms, shape=shape
+            )
+        return (
+            backend.predict_structure(sequence, dms=dms, shape=shape)
+            if predict_structure
+            else None,
+            backend.predict_pairing_probability(
+                sequence, dms=dms if dms is not None else shape
+            )
+            if predict_pairing_probability
+            else None,
+        )
+    except FoldTimeoutError:
+        Metrics.inc("fold_timeouts_total")
+        raise
+    finally:
+        Metrics.inc("folds_total")
+        Metrics.inc("fold_seconds_total", time.time() - start)
+
+
 class DatapointFactory:
-    """Factory class to create datapoints from different formats."""
+    """Factory class to create datapoints from different formats.
+
+    The factories that take `predict_structure` also take `predict_pairing_probability`, to predict the probability of
+    each base to be paired. With both, the structure and the probabilities come from a single partition function run,
+    and the structure is the maximum expected accuracy structure.
+    """
 
-    def from_bpseq(bpseq_file):
+    def from_bpseq(bpseq_file, lines=None):
         """Create a datapoint from a bpseq file. If predict_dms is True, the dms will be predicted using RNAstructure"""
-        reference, sequence, structure = BPseq.parse(bpseq_file)
+        reference, sequence, structure = BPseq.parse(bpseq_file, lines)
         sequence = standardize_sequence(sequence)
 
         if sequence_has_regular_characters(sequence):
@@ -217,9 +271,9 @@ class DatapointFactory:
                 structure=structure,
             )
 
-    def from_ct(ct_file):
+    def from_ct(ct_file, lines=None):
         """Create a datapoint from a ct file. If predict_dms is True, the dms will be predicted using RNAstructure"""
-        reference, sequence, structure = Ct.parse(ct_file)
+        reference, sequence, structure = Ct.parse(ct_file, lines)
         sequence = standardize_sequence(sequence)
 
         if sequence_has_regular_characters(sequence):
@@ -229,33 +283,49 @@ class DatapointFactory:
                 structure=structure,
             )
 
-    def from_fasta(sequence, reference, predict_structure):
+    def from_fasta(
+        sequence, reference, predict_structure, predict_pairing_probability=False
+    ):
         """Create a datapoint from a fasta file. The structure and dms will be None."""
         sequence = standardize_sequence(sequence)
 
         if sequence_has_regular_characters(sequence):
-            dotbracket, dms = None, None
-            if predict_structure:
-                dotbracket = Fasta.predict_structure(sequence)
-            return Datapoint(sequence, reference, dotbracket=dotbracket, dms=dms)
+            dotbracket, pairing_probability = _predict(
+                sequence, predict_structure, predict_pairing_probability
+            )
+            return Datapoint(
+                sequence,
+                reference,
+                dotbracket=dotbracket,
+                pairing_probability=pairing_probability,
+            )
 
-    def from_dreem_output(reference, sequence, mutation_rate, predict_structure):
+    def from_dreem_output(
+        reference,
+        sequence,
+        mutation_rate,
+        predict_structure,
+        predict_pairing_probability=False,
+    ):
         """Create a datapoint from a dreem output file. The structure and dms will be predicted if predict_structure and predict_dms are True."""
         sequence = standardize_sequence(sequence)
         mutation_rate = np.array([float(m) for m in mutation_rate], dtype=np.float32)
         if sequence_has_regular_characters(sequence):
+            dotbracket, pairing_probability = _predict(
+                sequence,
+                predict_structure,
+                predict_pairing_probability,
+                dms=mutation_rate,
+            )
             return Datapoint(
                 sequence=sequence,
                 reference=reference,
-                dotbracket=RNAstructure_singleton.predictStructure(
-                    sequence, dms=mutation_rate
-                )
-                if predict_structure
-                else None,
+                dotbracket=dotbracket,
                 dms=mutation_rate,
+                pairing_probability=pairing_probability,
             )
 
-    def from_json_line(ref, d, predict_structure=False):
+    def from_json_line(ref, d, predict_structure=False, predict_pairing_probability=False):
         """Create a datapoint from a json line. The json line should have the following format:
         "reference": {"sequence": "sequence", "structure": [[1, 2], [3,4]], "dms": [1.0, 2.0, 3.0]}
 
@@ -271,14 +341,20 @@ class DatapointFactory:
         sequence = d["sequence"]
         sequence = standardize_sequence(sequence)
 
-        if predict_structure:
-            d["dotbracket"] = RNAstructure_singleton.predictStructure(
+        if predict_structure or predict_pairing_probability:
+            dotbracket, pairing_probability = _predict(
                 sequence,
+                predict_structure,
+                predict_pairing_probability,
                 dms=d["dms"] if "dms" in d else None,
                 shape=d["shape"] if "shape" in d and "dms" not in d else None,
             )
-            if "structure" in d:
-                del d["structure"]  # otherwise the dotbracket won't be used
+            if predict_structure:
+                d["dotbracket"] = dotbracket
+                if "structure" in d:
+                    del d["structure"]  # otherwise the dotbracket won't be used
+            if predict_pairing_probability:
+                d["pairing_probability"] = pairing_probability
 
         if sequence_has_regular_characters(sequence):
             return Datapoint(
@@ -288,4 +364,5 @@ class DatapointFactory:
                 dotbracket=d["dotbracket"] if "dotbracket" in d else None,
                 dms=d["dms"] if "dms" in d else None,
                 shape=d["shape"] if "shape" in d else None,
+                pairing_probability=d.get("pairing_probability"),
             )
@@ -0,0 +1,338 @@
+import os
+import json
+import time
+import shutil
+import socket
+import threading
+
+from .path import Path
+from .checkpoint import Checkpoint
+from .metrics import Metrics, MetricsExporter
+from .list_datapoints import ListofDatapoints
+from .parsers import Fasta, DreemOutput, list_files
+from .util import is_compressed, iter_json
+
+
+def _ranges(n, n_units):
+    """Splits range(n) into `n_units` (or fewer) contiguous (start, end) ranges."""
+    n_units = max(1, min(n_units, n))
+    bounds = [round(i * n / n_units) for i in range(n_units + 1)]
+    return [[start, end] for start, end in zip(bounds[:-1], bounds[1:]) if end > start]
+
+
+def _split(format, file_or_folder, n_units):
+    """Returns the work units of an input, as `{'input': file, folder or list of files, 'subset': subset or None}`."""
+    if format == "fasta":
+        if is_compressed(file_or_folder):
+            return [{"input": file_or_folder, "subset": None}]
+        return [
+            {"input": file_or_folder, "subset": list(bounds)}
+            for bounds in Fasta.split(file_or_folder, n_units)
+        ]
+    if format in ["ct", "bpseq"]:
+        # split by file, so that each unit only reads its own files (the members of an archive are listed once, here)
+        paths = list_files(file_or_folder, "." + format)
+        if os.path.isdir(file_or_folder):
+            return [
+                {"input": paths[start:end], "subset": None}
+                for start, end in _ranges(len(paths), n_units)
+            ]
+        return [
+            {"input": file_or_folder, "subset": paths[start:end]}
+            for start, end in _ranges(len(paths), n_units)
+        ]
+    if format == "seismic":
+        n = sum(1 for _ in DreemOutput.parse(file_or_folder))
+    else:
+        n = sum(1 for _ in iter_json(file_or_folder))
+    return [
+        {"input": file_or_folder, "subset": subset} for subset in _ranges(n, n_units)
+    ]
+
+
+class WorkQueue:
+    """Work queue of a conversion on a shared filesystem, to convert a dataset with workers on several hosts.
+
+    The coordinator (`submit`) splits the input in work units: byte ranges of a fasta file, lists of ct / bpseq files of a
+    folder or of an archive, or ranges of records of a seismic or a json file. The queue is a folder of the dataset:
+        - `job.json`: the arguments of the conversion
+        - `todo/`, `claimed/`, `done/`: one file per unit, moved from a folder to the next with atomic renames
+        - `shards/`: the datapoints of each unit, journaled by a `Checkpoint`
+
+    A worker (`work`) claims a unit by renaming it from `todo/` to `claimed/`, and touches the claim while it works on it.
+    Claims that aren't touched for `stale_after` seconds, e.g. of a crashed host, are put back in `todo/`, and the next
+    worker resumes the unit from its shard. A unit is done when its marker is created in `done/`, with `os.link` so that
+    only the first of two workers of a unit commits its shard. `finalize` merges the shards in input order, then filters
+    and writes the dataset like `convert`.
+
+    Args:
+        folder (str): Path to the queue, see `Path.get_work_queue`.
+
+    Example:
+        >>> import tempfile
+        >>> root = tempfile.mkdtemp()
+        >>> queue = WorkQueue.submit('ct', 'data/input_files_for_testing/test_ct_files', name='my_ct', path_out=root, n_units=3, verbose=False)
+        >>> queue.status()
+        {'todo': 3, 'claimed': 0, 'done': 0}
+        >>> queue.work(tqdm=False)
+        3
+        >>> data = queue.finalize()
+        >>> from .conversion import convert
+        >>> data == convert('ct', 'data/input_files_for_testing/test_ct_files', name='my_ct', path_out=tempfile.mkdtemp(), verbose=False)
+        True
+        >>> os.path.exists(queue.folder)
+        False
+        >>> try:
+        ...     WorkQueue.submit('ct', 'data/input_files_for_testing/test_ct_files', name='my_ct', path_out=root, metrics='my_ct.prom')
+        ... except AssertionError as e:
+        ...     print(str(e).splitlines()[0])
+        Arguments ['metrics'] can't be applied by `finalize`
+    """
+
+    def __init__(self, folder: str):
+        self.folder = folder
+        self.worker_id = f"{socket.gethostname()}-{os.getpid()}-{threading.get_ident()}"
+
+    def _get(self, *names):
+        return os.path.join(self.folder, *names)
+
+    def _units(self, state):
+        if not os.path.exists(self._get(state)):
+            return []
+        return sorted(u for u in os.listdir(self._get(state)) if not u.startswith("."))
+
+    @property
+    def job(self) -> dict:
+        with open(self._get("job.json"), "r") as f:
+            return json.load(f)
+
+    @classmethod
+    def submit(
+        cls,
+        format: str,
+        file_or_folder: str,
+        name: str = None,
+        path_out: str = "data",
+        predict_structure: bool = False,
+        predict_pairing_probability: bool = False,
+        n_units: int = 64,
+        checkpoint_every: int = 100,
+        **kwargs,
+    ) -> "WorkQueue":
+        """Splits an input in `n_units` work units (or fewer) and writes the queue to the dataset folder.
+
+        Args:
+            format, file_or_folder, name, path_out, predict_structure, predict_pairing_probability: see `convert`.
+            n_units (int, optional): Number of work units. Defaults to 64.
+            checkpoint_every (int, optional): The shards of the workers are fsync'd every `checkpoint_every` records. Defaults to 100.
+            **kwargs: The filter and write arguments of `convert` (filter, min_AUROC, compression, ...), applied by `finalize`. `filter` must be a bool or a dict.
+        """
+        import inspect
+        from .conversion import _write_dataset
+
+        assert format in ["ct", "seismic", "json", "bpseq", "fasta"], "Format not supported"
+        unknown = set(kwargs) - (
+            set(inspect.signature(_write_dataset).parameters)
+            - {"datapoints", "name", "path_out", "checkpoint"}
+        )
+        assert not unknown, f"Arguments {sorted(unknown)} can't be applied by `finalize`"
+        assert checkpoint_every is not None, "The shards of the work queue are always journaled"
+        assert not callable(
+            getattr(kwargs.get("filter"), "apply", None)
+        ), "Use a dict of rules for `filter`, a FilterPipeline can't be shared with the workers"
+        if name is None:
+            name = file_or_folder.split("/")[-1].split(".")[0]
+        queue = cls(Path(name=name, root=path_out).get_work_queue())
+        if os.path.exists(queue.folder):
+            shutil.rmtree(queue.folder)
+        for folder in [".todo", "claimed", "done", "shards"]:
+            os.makedirs(queue._get(folder))
+        file_or_folder = os.path.abspath(file_or_folder)
+        units = _split(format, file_or_folder, n_units)
+        with open(queue._get("job.json"), "w") as f:
+            json.dump(
+                {
+                    "format": format,
+                    "file_or_folder": file_or_folder,
+                    "name": name,
+                    "path_out": os.path.abspath(path_out),
+                    "predict_structure": predict_structure,
+                    "predict_pairing_probability": predict_pairing_probability,
+                    "n_units": len(units),
+                    "checkpoint_every": checkpoint_every,
+                    "convert": kwargs,
+                },
+                f,
+                indent=2,
+            )
+        # the units are written to a temporary folder first, so that workers don't start on a partial queue
+        for idx, unit in enumerate(units):
+            with open(queue._get(".todo", f"unit_{idx:06d}.json"), "w") as f:
+                json.dump(unit, f)
+        os.rename(queue._get(".todo"), queue._get("todo"))
+        return queue
+
+    def status(self) -> dict:
+        """Number of units in each state."""
+        return {state: len(self._units(state)) for state in ["todo", "claimed", "done"]}
+
+    def requeue_stale(self, stale_after: float = 600) -> list:
+        """Puts the claims that weren't touched for `stale_after` seconds back in the queue, and returns their units."""
+        requeued = []
+        for unit in self._units("claimed"):
+            try:
+                if time.time() - os.path.getmtime(self._get("claimed", unit)) > stale_after:
+                    os.rename(self._get("claimed", unit), self._get("todo", unit))
+                    requeued.append(unit)
+            except FileNotFoundError:
+                pass  # done or requeued by someone else meanwhile
+        return requeued
+
+    def _claim(self):
+        for unit in self._units("todo"):
+            try:
+                os.rename(self._get("todo", unit), self._get("claimed", unit))
+            except FileNotFoundError:
+                continue  # claimed by another worker
+            if os.path.exists(self._get("done", unit)):
+                # requeued while its first worker was committing it
+                os.remove(self._get("claimed", unit))
+                continue
+            os.utime(self._get("claimed", unit))
+            return unit
+        return None
+
+    def _shard(self, unit, worker_id=None):
+        return self._get(
+            "shards", f"{unit[:-len('.json')]}.{worker_id or self.worker_id}.jsonl"
+        )
+
+    def _process(self, unit, tqdm):
+        job = self.job
+        with open(self._get("claimed", unit), "r") as f:
+            spec = json.load(f)
+        shard = self._shard(unit)
+        if not os.path.exists(shard):
+            # resume from the shard of a previous worker of this unit, if any
+            previous = [
+                s
+                for s in os.listdir(self._get("shards"))
+                if s.startswith(unit[: -len(".json")] + ".")
+            ]
+            if previous:
+                largest = max(
+                    previous, key=lambda s: os.path.getsize(self._get("shards", s))
+                )
+                shutil.copy(self._get("shards", largest), shard)
+        checkpoint = Checkpoint(
+            shard,
+            source=json.dumps([job["format"], unit]),
+            fsync_every=job.get("checkpoint_every", 100),
+        )
+        from .conversion import _read_datapoints
+
+        datapoints = _read_datapoints(
+            job["format"],
+            spec["input"],
+            job["predict_structure"],
+            verbose=False,
+            checkpoint=checkpoint if job["format"] in ["fasta", "seismic", "json"] else None,
+            subset=spec["subset"],
+            tqdm=tqdm,
+            predict_pairing_probability=job.get("predict_pairing_probability", False),
+        )
+        if job["format"] in ["ct", "bpseq"]:
+            with checkpoint:
+                for idx, datapoint in enumerate(datapoints.datapoints):
+                    checkpoint.write(idx, datapoint)
+        return {"shard": os.path.basename(shard), "fold_timeouts": datapoints.fold_timeouts}
+
+    def _commit(self, unit, result):
+        marker = self._get("claimed", f".{unit}.{self.worker_id}")
+        with open(marker, "w") as f:
+            json.dump(result, f)
+        try:
+            os.link(marker, self._get("done", unit))
+            committed = True
+        except FileExistsError:
+            committed = False  # another worker of this unit committed first
+        os.remove(marker)
+        try:
+            os.remove(self._get("claimed", unit))
+        except FileNotFoundError:
+            pass
+        return committed
+
+    def work(self, heartbeat: float = 30, tqdm: bool = True) -> int:
+        """Claims and processes units until the queue is empty, and returns the number of units committed by this worker.
+        The progress of the worker is exported as configured by `ROUSKINHF_METRICS_FILE` and `ROUSKINHF_METRICS_PORT`, see `MetricsExporter`.
+
+        Args:
+            heartbeat (float, optional): Interval in seconds between two touches of the claim. Must be well below the `stale_after` of `requeue_stale`. Defaults to 30.
+            tqdm (bool, optional): Whether to display a progress bar for each unit. Defaults to True.
+        """
+        n_committed = 0
+        with MetricsExporter.from_env(job=self.job["name"]), Metrics.stage("read"):
+            while True:
+                for state, n_units in self.status().items():
+                    Metrics.set("work_queue_units", n_units, state=state)
+                unit = self._claim()
+                if unit is None:
+                    return n_committed
+                stop = threading.Event()
+
+                def touch():
+                    while not stop.wait(heartbeat):
+                        try:
+                            os.utime(self._get("claimed", unit))
+                        except FileNotFoundError:
+                            return
+
+                toucher = threading.Thread(target=touch, daemon=True)
+                toucher.start()
+                try:
+                    result = self._process(unit, tqdm)
+                finally:
+                    stop.set()
+                    toucher.join()
+                n_committed += self._commit(unit, result)
+
+    def finalize(self, wait: bool = True, poll: float = 5, stale_after: float = None, keep: bool = False) -> dict:
+        """Merges the shards in input order, filters them and writes the dataset like `convert`. Returns the datapoints as a dict.
+
+        Args:
+            wait (bool, optional): Whether to wait for the units in progress. Otherwise all the units must be done. Defaults to True.
+            poll (float, optional): Interval in seconds between two checks of the queue. Defaults to 5.
+            stale_after (float, optional): If not None, requeue the stale claims while waiting, see `requeue_stale`. Defaults to None.
+            keep (bool, optional): Whether to keep the queue folder. Defaults to False.
+        """
+        n_units = self.job["n_units"]
+        while self.status()["done"] < n_units:
+            assert wait, f"{n_units - self.status()['done']} units are not done"
+            if stale_after is not None:
+                self.requeue_stale(stale_after)
+            time.sleep(poll)
+
+        job = self.job
+        datapoints, fold_timeouts = [], []
+        for unit in self._units("done"):
+            with open(self._get("done", unit), "r") as f:
+                result = json.load(f)
+            shard = Checkpoint(
+                self._get("shards", result["shard"]),
+                source=json.dumps([job["format"], unit]),
+            ).load()
+            datapoints += [shard[idx] for idx in sorted(shard)]
+            fold_timeouts += result["fold_timeouts"]
+
+        from .conversion import _write_dataset
+
+        data = _write_dataset(
+            ListofDatapoints(datapoints, fold_timeouts=fold_timeouts),
+            job["name"],
+            job["path_out"],
+            **job["convert"],
+        )
+        if not keep:
+            shutil.rmtree(self.folder)
+        return data
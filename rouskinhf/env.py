@@ -14,6 +14,40 @@ class Env:
             return os.environ["RNASTRUCTURE_PATH"]
         return ""
 
+    def get_folding_backend() -> str:
+        """Name of the structure prediction backend, see `folding.get_backend`. Defaults to 'rnastructure'."""
+        if "FOLDING_BACKEND" in os.environ:
+            return os.environ["FOLDING_BACKEND"]
+        return "rnastructure"
+
+    def get_cache_max_size() -> str:
+        """Size budget of the downloaded datasets, e.g. '200GB', see `DatasetCache`. Defaults to no limit."""
+        if "ROUSKINHF_CACHE_MAX_SIZE" in os.environ:
+            return os.environ["ROUSKINHF_CACHE_MAX_SIZE"]
+        return None
+
+    def get_prediction_socket() -> str:
+        """Unix socket of the local prediction service, see `PredictionServer`."""
+        if "ROUSKINHF_PREDICTION_SOCKET" in os.environ:
+            return os.environ["ROUSKINHF_PREDICTION_SOCKET"]
+        import tempfile
+
+        return os.path.join(
+            tempfile.gettempdir(), f"rouskinhf-prediction-{os.getuid()}.sock"
+        )
+
+    def get_metrics_file() -> str:
+        """Path of the Prometheus text file of the metrics of the long jobs, `{job}` being replaced by the job name, see `MetricsExporter`. Defaults to no file."""
+        if "ROUSKINHF_METRICS_FILE" in os.environ:
+            return os.environ["ROUSKINHF_METRICS_FILE"]
+        return None
+
+    def get_metrics_port() -> int:
+        """Local port of the HTTP endpoint of the metrics, see `MetricsExporter`. Defaults to no endpoint."""
+        if "ROUSKINHF_METRICS_PORT" in os.environ:
+            return int(os.environ["ROUSKINHF_METRICS_PORT"])
+        return None
+
     def get_rnastructure_temp_path() -> str:
         if "RNASTRUCTURE_TEMP_PATH" in os.environ:
             return os.environ["RNASTRUCTURE_TEMP_PATH"]
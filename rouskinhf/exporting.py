@@ -0,0 +1,202 @@
+import os
+import time
+import itertools
+from collections import deque
+from functools import partial
+
+from .parsers import Ct, BPseq, Fasta
+from .util import iter_json, open_dataset, DATA_JSON_EXTENSIONS
+
+WRITERS = {"ct": Ct, "bpseq": BPseq, "fasta": Fasta}
+ARCHIVE_EXTENSIONS = [".tar", ".tar.gz", ".tgz", ".tar.zst", ".zip"]
+
+
+def _file_name(reference, format):
+    return reference.replace("/", "_") + "." + format
+
+
+def _format_chunk(format, chunk):
+    """Formats a chunk of (reference, attr) records. Returns their [(file name, bytes)], with None as bytes for the records
+    without a structure, which can't be written as ct or bpseq."""
+    writer = WRITERS[format]
+    formatted = []
+    for reference, attr in chunk:
+        structure = attr.get("structure")
+        if format != "fasta" and structure is None:
+            formatted.append((reference, None))
+            continue
+        formatted.append(
+            (
+                _file_name(reference, format),
+                writer.format(reference, attr["sequence"], structure).encode(),
+            )
+        )
+    return formatted
+
+
+def _chunks(records, chunk_size):
+    records = iter(records)
+    while chunk := list(itertools.islice(records, chunk_size)):
+        yield chunk
+
+
+def _imap(func, chunks, n_workers):
+    """`map` over a process pool, in order, with at most 2 chunks per worker in flight so the input is streamed."""
+    if n_workers <= 1:
+        yield from map(func, chunks)
+        return
+    from concurrent.futures import ProcessPoolExecutor
+
+    with ProcessPoolExecutor(max_workers=n_workers) as executor:
+        pending = deque()
+        for chunk in chunks:
+            pending.append(executor.submit(func, chunk))
+            if len(pending) >= 2 * n_workers:
+                yield pending.popleft().result()
+        while pending:
+            yield pending.popleft().result()
+
+
+class _TarSink:
+    def __init__(self, output):
+        import tarfile
+
+        if output.endswith(".tar.zst"):
+            self._file = open_dataset(output, "w")  # written through its binary buffer
+            self._tar = tarfile.open(fileobj=self._file.buffer, mode="w|")
+        elif output.endswith((".tar.gz", ".tgz")):
+            import gzip
+
+            # the level of the data.json files: tarfile's streams compress at 9, 3x slower for archives a quarter smaller
+            self._file = gzip.open(output, "wb", compresslevel=6)
+            self._tar = tarfile.open(fileobj=self._file, mode="w|")
+        else:
+            self._file = None
+            self._tar = tarfile.open(output, "w|")
+        self._mtime = time.time()
+
+    def write(self, name, data):
+        import io, tarfile
+
+        info = tarfile.TarInfo(name)
+        info.size, info.mtime, info.mode = len(data), self._mtime, 0o644
+        self._tar.addfile(info, io.BytesIO(data))
+
+    def close(self):
+        self._tar.close()
+        if self._file is not None:
+            self._file.close()
+
+
+class _ZipSink:
+    def __init__(self, output):
+        import zipfile
+
+        self._zip = zipfile.ZipFile(output, "w", compression=zipfile.ZIP_DEFLATED)
+
+    def write(self, name, data):
+        self._zip.writestr(name, data)
+
+    def close(self):
+        self._zip.close()
+
+
+class _FileSink:
+    def __init__(self, output):
+        self._file = open_dataset(output, "w")  # written through its binary buffer
+
+    def write(self, name, data):
+        self._file.buffer.write(data)
+
+    def close(self):
+        self._file.close()
+
+
+class _FolderSink:
+    def __init__(self, output):
+        self.output = output
+        os.makedirs(output, exist_ok=True)
+
+    def write(self, name, data):
+        with open(os.path.join(self.output, name), "wb") as f:
+            f.write(data)
+
+    def close(self):
+        pass
+
+
+def _sink(output, format):
+    if output.endswith(".zip"):
+        return _ZipSink(output)
+    if output.endswith(tuple(ARCHIVE_EXTENSIONS)):
+        return _TarSink(output)
+    stem = output
+    for extension in DATA_JSON_EXTENSIONS.values():
+        if extension and stem.endswith(extension):
+            stem = stem[: -len(extension)]
+    if stem.endswith((".fasta", ".fa", ".fna")):
+        assert format == "fasta", f"Only the fasta format can be written to a single file, use an archive for {format}"
+        return _FileSink(output)
+    return _FolderSink(output)
+
+
+def export(
+    data,
+    format: str,
+    output: str,
+    n_workers: int = 1,
+    chunk_size: int = 1000,
+) -> dict:
+    """Writes the datapoints of a dataset as ct, bpseq or fasta files, the inverse of `convert`.
+
+    The records are streamed from the dataset, formatted by chunks (in `n_workers` processes if > 1) with `Ct.format`,
+    `BPseq.format` or `Fasta.format`, and written in input order to `output`, depending on its extension:
+        - `.tar`, `.tar.gz`, `.tgz`, `.tar.zst` or `.zip`: an archive with one file per datapoint, written in a single
+          streaming pass without temporary files. `convert` reads these archives back.
+        - `.fasta`, `.fa` or `.fna`, optionally with `.gz` or `.zst`: a single multi-record fasta file.
+        - anything else: a folder with one file per datapoint.
+    The files are named `<reference>.<format>`. The datapoints without a structure are skipped for ct and bpseq.
+
+    Args:
+        data (dict or str): The datapoints as returned by `get_dataset`, or the path to a `data.json` file, which is streamed.
+        format (str): 'ct', 'bpseq' or 'fasta'.
+        output (str): Path of the archive, file or folder to write.
+        n_workers (int, optional): Number of processes formatting the records. Defaults to 1, in this process.
+        chunk_size (int, optional): Number of records sent to a worker at once. Defaults to 1000.
+
+    Returns:
+        dict: {'written': number of datapoints written, 'skipped': number of datapoints without a structure}.
+
+    Example:
+        >>> import tempfile
+        >>> from .conversion import convert
+        >>> root = tempfile.mkdtemp()
+        >>> data = convert('ct', 'data/input_files_for_testing/test_ct_files', name='my_ct', path_out=root, filter=False, verbose=False)
+        >>> export(data, 'ct', os.path.join(root, 'my_ct.tar.gz'), n_workers=2, chunk_size=2)
+        {'written': 4, 'skipped': 0}
+        >>> convert('ct', os.path.join(root, 'my_ct.tar.gz'), name='my_ct_again', path_out=root, filter=False, verbose=False) == data
+        True
+        >>> export(data, 'fasta', os.path.join(root, 'my_ct.fasta'))
+        {'written': 4, 'skipped': 0}
+        >>> from .parsers import Fasta
+        >>> [reference for reference, _ in Fasta.parse(os.path.join(root, 'my_ct.fasta'))] == list(data)
+        True
+    """
+    assert format in WRITERS, f"Format {format} not supported, use one of {list(WRITERS)}"
+    records = iter_json(data) if isinstance(data, str) else data.items()
+    sink = _sink(output, format)
+    written = skipped = 0
+    try:
+        for formatted in _imap(
+            partial(_format_chunk, format), _chunks(records, chunk_size), n_workers
+        ):
+            for name, content in formatted:
+                if content is None:
+                    skipped += 1
+                    continue
+                sink.write(name, content)
+                written += 1
+    finally:
+        sink.close()
+    return {"written": written, "skipped": skipped}
+
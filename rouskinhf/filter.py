@@ -1,16 +1,555 @@
+import os
+import heapq
+import hashlib
 import numpy as np
-from .util import UKN
+from functools import cached_property
+from .util import UKN, DATA_JSON_EXTENSIONS, JsonWriter, iter_json
 
-import pandas as pd
-from sklearn.metrics import roc_auc_score
 from .list_datapoints import ListofDatapoints
 from .datapoint import Datapoint
+from .near_duplicates import near_duplicate_clusters
+from .path import Path
+from .sequence_index import SequenceIndex
+from .motif_index import MotifIndex
+from .content_hashes import write_content_hashes
 
 
-def filter(listofdatapoints: ListofDatapoints, min_AUROC: int = 0.8):
+def _hash64(data: bytes) -> int:
+    return int.from_bytes(hashlib.blake2b(data, digest_size=8).digest(), "little")
+
+
+class DatapointColumns:
+    """Columnar view of a list of datapoints, built in one pass, on which the filter rules are vectorized.
+
+    The per-base arrays (`signal`, `probed`, `unpaired`) are the concatenation of the datapoints, the base `i` of the
+    datapoint `r` being at `offsets[r] + i`. The signal is the dms, or the shape if there is no dms. For the dms, only the
+    A and C bases are probed. Missing values (None, NaN or UKN) are NaN.
+
+    Example:
+        >>> columns = DatapointColumns([Datapoint(reference='ref1', sequence='AACCGG', structure=[[0, 5], [1, 4]], dms=[0.9, 0.1, UKN, 0.8, 0.0, 0.0]), Datapoint(reference='ref2', sequence='GGAUCC')])
+        >>> columns.length.tolist(), columns.gc_content.round(2).tolist()
+        ([6, 6], [0.67, 0.67])
+        >>> columns.max_mutation_rate.tolist(), columns.coverage.tolist()
+        ([0.9, nan], [0.75, nan])
+        >>> columns.auroc.tolist()
+        [0.5, 1.0]
+    """
+
+    def __init__(self, datapoints: list):
+        self.datapoints = datapoints
+        self.n = n = len(datapoints)
+        self.length = np.array([len(dp.sequence) for dp in datapoints], dtype=np.int64)
+        self.offsets = np.concatenate([[0], np.cumsum(self.length)[:-1]]).astype(
+            np.int64
+        )
+        self.row = np.repeat(np.arange(n), self.length)  # datapoint of each base
+        bases = np.frombuffer(
+            "".join(dp.sequence for dp in datapoints).encode(), dtype=np.uint8
+        )
+
+        # one pass over the datapoints to gather the structures and the signals
+        pair_rows, pairs = [], []
+        signal = np.full(len(bases), np.nan)
+        self.signal_name = np.full(n, None, dtype=object)
+        for r, dp in enumerate(datapoints):
+            if dp.structure is not None:
+                structure = np.asarray(list(dp.structure), dtype=np.int64).reshape(
+                    -1, 2
+                )
+                pairs.append(structure)
+                pair_rows.append(np.full(len(structure), r))
+            for name in ["dms", "shape"]:
+                values = getattr(dp, name, None)
+                if (
+                    values is not None
+                    and hasattr(values, "__len__")
+                    and len(values) == self.length[r]
+                ):
+                    start = self.offsets[r]
+                    signal[start : start + self.length[r]] = np.asarray(
+                        [np.nan if v is None else v for v in values], dtype=np.float64
+                    )
+                    self.signal_name[r] = name
+                    break
+
+        # signal
+        self.has_signal = self.signal_name != None
+        is_dms = (self.signal_name == "dms")[self.row]
+        self.probed = self.has_signal[self.row] & (
+            ~is_dms | (bases == ord("A")) | (bases == ord("C"))
+        )
+        signal[(signal == UKN) | ~self.probed] = np.nan
+        self.signal = signal
+
+        # structure
+        pair_rows = np.concatenate(pair_rows) if pairs else np.zeros(0, np.int64)
+        pairs = np.concatenate(pairs) if pairs else np.zeros((0, 2), np.int64)
+        length = self.length[pair_rows][:, None]
+        in_bounds = ((pairs >= 0) & (pairs < length)).all(axis=1) & (
+            pairs[:, 0] != pairs[:, 1]
+        )
+        positions = (self.offsets[pair_rows][:, None] + pairs)[in_bounds].ravel()
+        paired_twice = np.bincount(positions, minlength=len(bases)) > 1
+        self.valid_structure = ~(
+            np.bincount(pair_rows[~in_bounds], minlength=n).astype(bool)
+            | np.bincount(self.row[paired_twice], minlength=n).astype(bool)
+        )
+        self.has_structure = np.bincount(pair_rows, minlength=n) > 0
+        self.unpaired = np.ones(len(bases), dtype=np.int64)
+        self.unpaired[positions] = 0
+
+        self._keys = {}
+
+    def _per_datapoint(self, ufunc, values, empty=np.nan):
+        if not self.n:
+            return np.zeros(0)
+        return np.where(self.length > 0, ufunc.reduceat(values, self.offsets), empty)
+
+    @cached_property
+    def gc_content(self) -> np.ndarray:
+        bases = np.frombuffer(
+            "".join(dp.sequence for dp in self.datapoints).encode(), dtype=np.uint8
+        )
+        gc = np.bincount(
+            self.row, weights=(bases == ord("G")) | (bases == ord("C")), minlength=self.n
+        )
+        return gc / np.maximum(self.length, 1)
+
+    @cached_property
+    def max_mutation_rate(self) -> np.ndarray:
+        """Maximum of the signal of each datapoint, NaN without signal."""
+        with np.errstate(invalid="ignore"):
+            return self._per_datapoint(np.fmax, self.signal)
+
+    @cached_property
+    def coverage(self) -> np.ndarray:
+        """Fraction of the probed bases with a signal value, NaN without signal."""
+        probed = np.bincount(self.row, weights=self.probed, minlength=self.n)
+        covered = np.bincount(self.row, weights=~np.isnan(self.signal), minlength=self.n)
+        with np.errstate(invalid="ignore", divide="ignore"):
+            return np.where(probed > 0, covered / probed, np.nan)
+
+    @cached_property
+    def auroc(self) -> np.ndarray:
+        """AUROC of the signal as a predictor of the unpaired bases, for all the datapoints at once with the Mann-Whitney
+        rank sum. It is 1 for the datapoints without a structure or a signal, and 0 if the probed bases are all paired
+        or all unpaired."""
+        eligible = self.has_structure & self.valid_structure & self.has_signal
+        base = eligible[self.row] & ~np.isnan(self.signal)
+        row, value, label = self.row[base], self.signal[base], self.unpaired[base]
+
+        # tie-averaged ranks of the values within each datapoint
+        order = np.lexsort((value, row))
+        row, value, label = row[order], value[order], label[order]
+        position = np.arange(len(row))
+        rank = position - np.searchsorted(row, row, side="left") + 1.0
+        first = np.ones(len(row), dtype=bool)
+        first[1:] = (row[1:] != row[:-1]) | (value[1:] != value[:-1])
+        group = np.cumsum(first) - 1
+        last = np.ones(len(row), dtype=bool)
+        last[:-1] = first[1:]
+        rank = ((rank[first] + rank[last]) / 2)[group]
+
+        rank_sum = np.bincount(row, weights=rank * label, minlength=self.n)
+        n_unpaired = np.bincount(row, weights=label, minlength=self.n)
+        n_paired = np.bincount(row, weights=1 - label, minlength=self.n)
+        with np.errstate(invalid="ignore", divide="ignore"):
+            auroc = (rank_sum - n_unpaired * (n_unpaired + 1) / 2) / (
+                n_unpaired * n_paired
+            )
+        auroc = np.where((n_unpaired > 0) & (n_paired > 0), auroc, 0.0)
+        return np.where(eligible, auroc, 1.0)
+
+    def keys(self, attribute: str) -> np.ndarray:
+        """64-bit hash of (sequence, attribute) for each datapoint. `attribute` is None for the sequence only."""
+        if attribute not in self._keys:
+            keys = []
+            for dp in self.datapoints:
+                value = getattr(dp, attribute, None) if attribute else None
+                if attribute == "structure" and value is not None:
+                    value = np.asarray(sorted(map(tuple, value)), dtype=np.float64)
+                elif value is not None and hasattr(value, "__len__"):
+                    value = np.asarray(value, dtype=np.float64)
+                else:
+                    value = np.zeros(0)
+                keys.append(_hash64(dp.sequence.encode() + b"|" + value.tobytes()))
+            self._keys[attribute] = np.array(keys, dtype=np.uint64)
+        return self._keys[attribute]
+
+    def has(self, attribute: str) -> bool:
+        """Whether at least one datapoint has `attribute`."""
+        return any(getattr(dp, attribute, None) is not None for dp in self.datapoints)
+
+
+def _first_of_group(keys: np.ndarray) -> np.ndarray:
+    """Index of the first datapoint with the same key, for each datapoint."""
+    _, first, inverse = np.unique(keys, return_index=True, return_inverse=True)
+    return first[inverse.ravel()].astype(np.int32)
+
+
+class QualityScores:
+    """Per-datapoint quality scores of a filtering, stored next to the dataset (see `Path.get_quality_scores`) so that other
+    thresholds or rules can be applied as a mask over the scores, without reading the datapoints again, see `refilter`.
+
+    The scores cover all the valid datapoints of the conversion, kept or not, in input order:
+        - `reference`: the reference before renaming
+        - `length`, `gc_content`, `max_mutation_rate`, `coverage`, `auroc`, `valid_structure`: see `DatapointColumns`
+        - `sequence_group`, and `structure_group`, `dms_group`, `shape_group` if the dataset has these attributes: the
+          index of the first datapoint with the same sequence, and structure / dms / shape
+        - `near_duplicate`: whether the datapoint was dropped by `drop_near_duplicates`, which `refilter` keeps dropped
+        - `kept`: whether the datapoint is in data.json
+    The rules compute their masks on the scores like on a `DatapointColumns`, except custom rules using the per-base arrays.
+
+    Example:
+        >>> datapoints = [Datapoint(reference='ref1', sequence='GGGAAACCC', structure=[[0, 8], [1, 7], [2, 6]], shape=[0, 0, 0, 1, 1, 1, 0, 0, 0]),\
+                          Datapoint(reference='ref2', sequence='GGGAAACCC', structure=[[0, 8], [1, 7], [2, 6]], shape=[0, 0, 0.5, 1, 0, 0, 0, 0, 0]),\
+                          Datapoint(reference='ref3', sequence='GGGAAACCC', structure=[[0, 8], [1, 7], [2, 6]], shape=[0, 0, 0, 1, 1, 1, 0, 0, 0])]
+        >>> scores = QualityScores.from_columns(DatapointColumns(datapoints), kept=np.ones(3, dtype=bool))
+        >>> scores.auroc.round(2).tolist(), scores.sequence_group.tolist(), scores.shape_group.tolist()
+        ([1.0, 0.61, 1.0], [0, 0, 0], [0, 1, 0])
+        >>> scores.mask({'min_AUROC': 0.8}).tolist(), scores.mask({'deduplicate': 'structure', 'min_AUROC': 0.5}).tolist()
+        ([True, False, True], [True, False, False])
+    """
+
+    GROUPS = {None: "sequence_group", "structure": "structure_group", "dms": "dms_group", "shape": "shape_group"}
+
+    def __init__(self, arrays: dict):
+        self.arrays = arrays
+        self.n = len(arrays["reference"])
+        for key, value in arrays.items():
+            setattr(self, key, value)
+
+    @classmethod
+    def from_columns(cls, columns: DatapointColumns, kept: np.ndarray) -> "QualityScores":
+        arrays = {
+            "reference": np.array([dp.reference for dp in columns.datapoints], dtype=str),
+            "length": columns.length.astype(np.int32),
+            "gc_content": columns.gc_content,
+            "max_mutation_rate": columns.max_mutation_rate,
+            "coverage": columns.coverage,
+            "auroc": columns.auroc,
+            "valid_structure": columns.valid_structure,
+            "near_duplicate": np.zeros(columns.n, dtype=bool),
+            "kept": np.asarray(kept, dtype=bool),
+        }
+        for attribute, group in cls.GROUPS.items():
+            if attribute is None or columns.has(attribute):
+                arrays[group] = _first_of_group(columns.keys(attribute))
+        return cls(arrays)
+
+    def keys(self, attribute: str) -> np.ndarray:
+        """The duplicate group of each datapoint, which `Deduplicate` uses like the keys of `DatapointColumns`."""
+        return self.arrays[self.GROUPS[attribute]]
+
+    def has(self, attribute: str) -> bool:
+        return self.GROUPS[attribute] in self.arrays
+
+    def mask(self, filter) -> np.ndarray:
+        """Which datapoints pass `filter`, a `FilterPipeline` or a dict of rules (see `FilterPipeline.from_config`)."""
+        return _as_pipeline(filter).mask(self)[0]
+
+    def save(self, path: str) -> None:
+        with open(path + ".tmp", "wb") as f:
+            np.savez_compressed(f, **self.arrays)
+        os.replace(path + ".tmp", path)
+
+    @classmethod
+    def load(cls, path: str) -> "QualityScores":
+        with np.load(path) as f:
+            return cls({key: f[key] for key in f.files})
+
+
+class Rule:
+    """A filter rule. `mask` returns which datapoints pass the rule, given which ones passed the previous rules.
+    `description` completes the line of the report: "- {number of datapoints filtered out} {description}"."""
+
+    description = ""
+
+    def mask(self, columns: DatapointColumns, keep: np.ndarray) -> np.ndarray:
+        raise NotImplementedError
+
+
+class ValidStructure(Rule):
+    """Drops the structures with bases out of the sequence, or paired twice."""
+
+    description = "datapoints with bad structures"
+
+    def mask(self, columns, keep):
+        return columns.valid_structure
+
+
+class Length(Rule):
+    """Keeps the sequences with min_length <= length <= max_length."""
+
+    def __init__(self, min_length: int = None, max_length: int = None):
+        self.min_length = 0 if min_length is None else min_length
+        self.max_length = np.inf if max_length is None else max_length
+        self.description = f"datapoints with a length out of [{self.min_length}, {self.max_length}]"
+
+    def mask(self, columns, keep):
+        return (columns.length >= self.min_length) & (columns.length <= self.max_length)
+
+
+class GCContent(Rule):
+    """Keeps the sequences with min_gc <= GC content <= max_gc."""
+
+    def __init__(self, min_gc: float = 0.0, max_gc: float = 1.0):
+        self.min_gc, self.max_gc = min_gc, max_gc
+        self.description = f"datapoints with a GC content out of [{min_gc}, {max_gc}]"
+
+    def mask(self, columns, keep):
+        gc_content = columns.gc_content
+        return (gc_content >= self.min_gc) & (gc_content <= self.max_gc)
+
+
+class MaxMutationRate(Rule):
+    """Drops the datapoints with at least one signal value above `max_mutation_rate`. The datapoints without signal pass."""
+
+    def __init__(self, max_mutation_rate: float):
+        self.max_mutation_rate = max_mutation_rate
+        self.description = (
+            f"datapoints with a mutation rate above {max_mutation_rate}"
+        )
+
+    def mask(self, columns, keep):
+        return ~(columns.max_mutation_rate > self.max_mutation_rate)
+
+
+class SignalCoverage(Rule):
+    """Drops the datapoints with a signal on less than `min_coverage` of the probed bases. The datapoints without signal pass."""
+
+    def __init__(self, min_coverage: float):
+        self.min_coverage = min_coverage
+        self.description = f"datapoints with a signal coverage below {min_coverage}"
+
+    def mask(self, columns, keep):
+        return ~(columns.coverage < self.min_coverage)
+
+
+class MinAUROC(Rule):
+    """Drops the datapoints whose signal predicts their structure with an AUROC below `min_AUROC`, see `DatapointColumns.auroc`."""
+
+    def __init__(self, min_AUROC: float = 0.8):
+        self.min_AUROC = min_AUROC
+        self.description = f"datapoints removed because of low AUROC (<{min_AUROC})"
+
+    def mask(self, columns, keep):
+        return columns.auroc >= self.min_AUROC
+
+
+class Deduplicate(Rule):
+    """Keeps the first datapoint of each duplicate.
+
+    Args:
+        policy (str, optional): 'structure' to keep the first datapoint of each (sequence, structure), (sequence, dms) and
+            (sequence, shape) in turn, or 'sequence' to keep one datapoint per sequence. Defaults to 'structure'.
+    """
+
+    def __init__(self, policy: str = "structure"):
+        assert policy in ["structure", "sequence"], f"Unknown dedup policy {policy}"
+        self.policy = policy
+        self.description = (
+            "duplicate sequences with the same structure / dms / shape"
+            if policy == "structure"
+            else "duplicate sequences"
+        )
+
+    def mask(self, columns, keep):
+        keep = keep.copy()
+        attributes = (
+            [a for a in ["structure", "dms", "shape"] if columns.has(a)]
+            if self.policy == "structure"
+            else [None]
+        )
+        for attribute in attributes:
+            kept = np.flatnonzero(keep)
+            _, first = np.unique(columns.keys(attribute)[kept], return_index=True)
+            keep[:] = False
+            keep[kept[first]] = True
+        return keep
+
+
+class FilterPipeline:
+    """Filters a list of datapoints with a sequence of rules, in a single pass.
+
+    The datapoints are gathered once into a `DatapointColumns`, on which each rule computes a vectorized mask. A datapoint
+    is dropped by the first rule it fails, which is counted in the report. The structures are always validated first, and
+    the references of the remaining datapoints are renamed `reference_1`, `reference_2`, ... when they are not unique.
+
+    Args:
+        rules (list): The `Rule`s, applied in order.
+        near_duplicates (float, optional): If not None, cluster near-identical sequences with MinHash/LSH using this similarity threshold. The clusters are stored in `listofdatapoints.near_duplicate_clusters` as {representative reference: [other references]}. Defaults to None.
+        drop_near_duplicates (bool, optional): Whether to keep only the first datapoint of each near-duplicate cluster. Defaults to False.
+
+    Example:
+        >>> datapoints = ListofDatapoints([Datapoint(reference='ref1', sequence='AACCGGUU', dms=[0.9, 0.8, 0.7, 0.6, 0.0, 0.0, 0.0, 0.0]),\
+                                           Datapoint(reference='ref2', sequence='GGGGCCCC', dms=[0.0, 0.0, 0.0, 0.0, 0.1, 0.96, 0.1, 0.1]),\
+                                           Datapoint(reference='ref3', sequence='AAAAAAAAAAAAAAAAAAAA', dms=[0.01] * 20),\
+                                           Datapoint(reference='ref4', sequence='AACCGGUU', dms=[0.9, 0.8, 0.7, 0.6, 0.0, 0.0, 0.0, 0.0])], verbose=False)
+        >>> pipeline = FilterPipeline.from_config({'length': [1, 10], 'max_mutation_rate': 0.95, 'gc_content': [0.2, 0.8], 'deduplicate': 'sequence'})
+        >>> print(pipeline.apply(datapoints))
+        Over a total of 4 datapoints, there are:
+        ### OUTPUT
+        - ALL: 1 valid datapoints
+        - INCLUDED: 0 duplicate sequences with different structure / dms / shape
+        ### MODIFIED
+        - 0 multiple sequences with the same reference (renamed reference)
+        ### FILTERED OUT
+        - 0 invalid datapoints (ex: sequence with non-regular characters)
+        - 0 datapoints with bad structures
+        - 1 datapoints with a length out of [1, 10]
+        - 1 datapoints with a mutation rate above 0.95
+        - 0 datapoints with a GC content out of [0.2, 0.8]
+        - 1 duplicate sequences
+        >>> [datapoint.reference for datapoint in datapoints.datapoints]
+        ['ref1']
+    """
+
+    def __init__(
+        self,
+        rules: list,
+        near_duplicates: float = None,
+        drop_near_duplicates: bool = False,
+    ):
+        self.rules = [ValidStructure()] + [
+            rule for rule in rules if not isinstance(rule, ValidStructure)
+        ]
+        self.near_duplicates = near_duplicates
+        self.drop_near_duplicates = drop_near_duplicates
+
+    @classmethod
+    def from_config(cls, config: dict, **kwargs):
+        """Builds a pipeline from a declarative dict, e.g. `{'length': [10, 1000], 'max_mutation_rate': 0.3, 'min_coverage': 0.5,
+        'gc_content': [0.2, 0.8], 'min_AUROC': 0.8, 'deduplicate': 'structure'}`. The rules are applied in the order of
+        the keys. `deduplicate` can be 'structure', 'sequence' or None. The kwargs are passed to the constructor."""
+        builders = {
+            "length": lambda v: Length(*v),
+            "max_mutation_rate": MaxMutationRate,
+            "min_coverage": SignalCoverage,
+            "gc_content": lambda v: GCContent(*v),
+            "min_AUROC": MinAUROC,
+            "deduplicate": lambda v: Deduplicate(v) if v is not None else None,
+        }
+        for key in config:
+            assert key in builders, f"Unknown filter rule {key}. Available rules: {list(builders)}"
+        rules = [builders[key](value) for key, value in config.items()]
+        return cls([rule for rule in rules if rule is not None], **kwargs)
+
+    @classmethod
+    def default(cls, min_AUROC: float = 0.8, **kwargs):
+        """The default pipeline of `convert`: drop the duplicates with the same structure / dms / shape, then the datapoints with a low AUROC."""
+        return cls([Deduplicate("structure"), MinAUROC(min_AUROC)], **kwargs)
+
+    def mask(self, columns) -> tuple:
+        """Applies the rules to a `DatapointColumns` or `QualityScores`. Returns which datapoints pass, and the number of
+        datapoints dropped by each rule."""
+        keep = np.ones(columns.n, dtype=bool)
+        n_filtered = []
+        for rule in self.rules:
+            passed = keep & rule.mask(columns, keep)
+            n_filtered.append(int(np.sum(keep & ~passed)))
+            keep = passed
+        return keep, n_filtered
+
+    def apply(self, listofdatapoints: ListofDatapoints) -> str:
+        """Filters `listofdatapoints` in place and returns the report.
+
+        The scores of the valid datapoints are stored in `listofdatapoints.quality_scores` (see `QualityScores`), and the
+        valid datapoints that were dropped in `listofdatapoints.filtered_out`.
+        """
+        n_input_datapoints = len(listofdatapoints)
+        datapoints, n_unvalid_datapoints = listofdatapoints.drop_none_dp()
+
+        columns = DatapointColumns(datapoints)
+        keep, n_filtered = self.mask(columns)
+        scores = QualityScores.from_columns(columns, keep)
+        all_datapoints = datapoints
+
+        # Count how many multiple structures / dms with the same sequence
+        kept = np.flatnonzero(keep)
+        n_same_seq_datapoints = len(kept) - len(np.unique(columns.keys(None)[kept]))
+        datapoints = [datapoints[idx] for idx in kept]
+
+        # If multiple sequences with the same reference, rename the reference
+        refs = dict()
+        n_same_ref_datapoints = 0
+        for datapoint in datapoints:
+            datapoint.convert_arrays_to_list()
+            if datapoint.reference in refs:
+                refs[datapoint.reference] += 1
+                datapoint.reference = (
+                    f"{datapoint.reference}_{refs[datapoint.reference]}"
+                )
+                n_same_ref_datapoints += 1
+            else:
+                refs[datapoint.reference] = 0
+
+        ## Cluster near-identical sequences
+        listofdatapoints.near_duplicate_clusters = {}
+        n_near_duplicates_datapoints = 0
+        if self.near_duplicates is not None and len(datapoints):
+            clusters = near_duplicate_clusters(
+                [dp.reference for dp in datapoints],
+                [dp.sequence for dp in datapoints],
+                threshold=self.near_duplicates,
+            )
+            listofdatapoints.near_duplicate_clusters = clusters
+            n_near_duplicates_datapoints = sum([len(v) for v in clusters.values()])
+            if self.drop_near_duplicates:
+                to_drop = set([ref for refs in clusters.values() for ref in refs])
+                dropped = [
+                    idx for idx, dp in zip(kept, datapoints) if dp.reference in to_drop
+                ]
+                scores.kept[dropped] = False
+                scores.near_duplicate[dropped] = True
+                datapoints = [dp for dp in datapoints if dp.reference not in to_drop]
+
+        listofdatapoints.datapoints = datapoints
+        listofdatapoints.quality_scores = scores
+        listofdatapoints.filtered_out = [
+            dp for dp, k in zip(all_datapoints, scores.kept) if not k
+        ]
+        for datapoint in listofdatapoints.filtered_out:
+            datapoint.convert_arrays_to_list()
+
+        # Write report
+        report = f"""Over a total of {n_input_datapoints} datapoints, there are:
+### OUTPUT
+- ALL: {len(listofdatapoints)} valid datapoints
+- INCLUDED: {n_same_seq_datapoints} duplicate sequences with different structure / dms / shape"""
+        if self.near_duplicates is not None and not self.drop_near_duplicates:
+            report += f"""
+- INCLUDED: {n_near_duplicates_datapoints} near-duplicate sequences in {len(listofdatapoints.near_duplicate_clusters)} clusters (similarity >= {self.near_duplicates})"""
+        report += f"""
+### MODIFIED
+- {n_same_ref_datapoints} multiple sequences with the same reference (renamed reference)
+### FILTERED OUT
+- {n_unvalid_datapoints} invalid datapoints (ex: sequence with non-regular characters)"""
+        for rule, n in zip(self.rules, n_filtered):
+            report += f"""
+- {n} {rule.description}"""
+        if self.near_duplicates is not None and self.drop_near_duplicates:
+            report += f"""
+- {n_near_duplicates_datapoints} near-duplicate sequences in {len(listofdatapoints.near_duplicate_clusters)} clusters (similarity >= {self.near_duplicates}, kept one per cluster)"""
+
+        return report
+
+
+def filter(
+    listofdatapoints: ListofDatapoints,
+    min_AUROC: int = 0.8,
+    near_duplicates: float = None,
+    drop_near_duplicates: bool = False,
+):
     """Filters out duplicate sequences.
         Only keep the first occurence of a sequence if all the other structures are the same.
 
+        If `near_duplicates` is a similarity threshold, near-identical sequences (point mutants, trimmed variants) are clustered with MinHash/LSH.
+        The clusters are stored in `listofdatapoints.near_duplicate_clusters` as {representative reference: [other references]}.
+        If `drop_near_duplicates` is True, only the first datapoint of each cluster is kept.
+
+        This is `FilterPipeline.default`, use a `FilterPipeline` for other rules.
+
         Examples:
             >>> datapoints = ListofDatapoints([ Datapoint(reference='ref1', sequence='AACCGG', structure=[[1, 2], [3, 4]], dms=[1,0,0,0,0,1]),\
                                 Datapoint(reference='ref2', sequence='AACCGG', structure=[[1, 2], [3, 4]], dms=[1,0,0,0,0,1]),\
@@ -21,138 +560,176 @@ def filter(listofdatapoints: ListofDatapoints, min_AUROC: int = 0.8):
             >>> print(filter(datapoints, min_AUROC=0))
             Over a total of 6 datapoints, there are:
             ### OUTPUT
-            - 3 valid datapoints
+            - ALL: 3 valid datapoints
+            - INCLUDED: 1 duplicate sequences with different structure / dms / shape
             ### MODIFIED
-            - 1 multiple sequences with the same reference (renamed reference)
-            - 1 duplicate sequences with different structure / dms / shape
+            - 0 multiple sequences with the same reference (renamed reference)
             ### FILTERED OUT
             - 1 invalid datapoints (ex: sequence with non-regular characters)
             - 0 datapoints with bad structures
             - 2 duplicate sequences with the same structure / dms / shape
             - 0 datapoints removed because of low AUROC (<0)
         """
+    return FilterPipeline.default(
+        min_AUROC,
+        near_duplicates=near_duplicates,
+        drop_near_duplicates=drop_near_duplicates,
+    ).apply(listofdatapoints)
 
-    # Remove None datapoints
-    n_input_datapoints = len(listofdatapoints)
-    datapoints, n_unvalid_datapoints = listofdatapoints.drop_none_dp()
-
-    # Remove bad structures
-    bad_structures_idx = []
-    for idx, datapoint in enumerate(datapoints):
-        if not datapoint._assert_structure():
-            bad_structures_idx.append(idx)
-    datapoints = [
-        datapoint
-        for idx, datapoint in enumerate(datapoints)
-        if idx not in bad_structures_idx
-    ]
-    n_bad_structures_datapoints = len(bad_structures_idx)
-
-    # Convert to pandas
-    df = listofdatapoints.to_pandas(datapoints)
-
-    # Remove duplicate or conflicting datapoints and keep track of the number of datapoints removed
-    def drop_duplicates(df: pd.DataFrame, **kwargs):
-        len_df_before = len(df)
-        df.drop_duplicates(**kwargs)
-        return len_df_before - len(df)
-
-    # If multiple sequences with the same reference, rename the reference
-    refs = dict()
-    n_same_ref_datapoints = 0
-    for idx, row in df.iterrows():
-        if row["reference"] in refs:
-            refs[row["reference"]] += 1
-            df.at[idx, "reference"] = f"{row['reference']}_{refs[row['reference']]}"
-            n_same_ref_datapoints += 1
-        else:
-            refs[row["reference"]] = 0
-
-    # Keep only one datapoint per sequence and structure
-    if "structure" in df.columns:
-        n_duplicates_datapoints = drop_duplicates(
-            df,
-            subset=["sequence", "structure"],
-            inplace=True,
-            ignore_index=True,
-            keep="first",
-        )
 
-    # Keep only one datapoint per sequence and signal
-    for signal in ["dms", "shape"]:
-        if signal in df.columns:
-            if not "structure" in df.columns:
-                n_duplicates_datapoints = 0
-            n_duplicates_datapoints += drop_duplicates(
-                df,
-                subset=["sequence", signal],
-                inplace=True,
-                ignore_index=True,
-                keep="first",
-            )
+def _as_pipeline(filter) -> FilterPipeline:
+    if isinstance(filter, FilterPipeline):
+        return filter
+    return FilterPipeline.from_config(filter)
 
-    # Count how many multiple structures / dms with the same sequence
-    n_same_seq_datapoints = 0
-    for _, group in df.groupby("sequence"):
-        if len(group) > 1:
-            n_same_seq_datapoints += len(group) - 1
-
-    ## Filter out references with low AUROC
-    mask_high_AUROC = None
-    if "structure" in df.columns and "dms" in df.columns or "shape" in df.columns:
-        signal = "dms" if "dms" in df.columns else "shape"
-
-        def calculate_auroc(row):
-            # best signal is DMS, if unavailable use SHAPE
-            signal = (
-                "dms" if "dms" in row and not type(row["dms"]) == float else "shape"
-            )
-            if (
-                (not "structure" in row)
-                or (row["structure"] is None)
-                or (type(row["structure"]) == float and np.isnan(row["structure"]))
-                or len(row["structure"]) == 0
-                or row['structure'] == [[]]
-            ):
-                return 1  #  if you can't calculate the AUROC, don't filter it out
-
-            if row[signal] is None or (type(row[signal]) == float and np.isnan(row[signal])):
-                return 1
-            sig = np.array(row[signal])
-            if signal == "dms":  # mask G/T/U bases for DMS
-                mask_UKN = np.array([s in "GTU" for s in row["sequence"].upper()])
-                sig[mask_UKN] = UKN
-
-            isUnpaired = np.ones_like(sig)
-            isUnpaired[np.array(row["structure"]).flatten()] = 0
-            if set(isUnpaired[sig != UKN]) != set([0, 1]):
-                return 0
-            return roc_auc_score(isUnpaired[sig != UKN], sig[sig != UKN])
-
-        # Create a boolean mask for rows with auroc score greater than or equal to a threshold
-        mask_high_AUROC = df.apply(
-            lambda row: calculate_auroc(row) >= min_AUROC, axis=1
+
+def refilter(
+    name: str,
+    filter,
+    path: str = "data",
+    name_out: str = None,
+    compression: str = None,
+) -> dict:
+    """Filters a converted dataset again with other thresholds or rules, from the quality scores stored by the conversion.
+
+    The mask is computed on the `QualityScores` alone. The datapoints are then streamed from data.json and from the
+    `filtered_out` file written next to it, and the dataset is rewritten like `convert` would have written it with
+    `filter`, with all the datapoints dropped by the new rules in `filtered_out`, so that it can be refiltered again. The
+    near-duplicate clusters are not computed again: the datapoints dropped by `drop_near_duplicates` stay dropped.
+
+    Args:
+        name (str): Name of the dataset, converted with a filter.
+        filter (dict or FilterPipeline): The new rules, see `FilterPipeline.from_config`.
+        path (str, optional): Path to the data folder. Defaults to 'data'.
+        name_out (str, optional): Name of the output dataset. Defaults to `name`, which is filtered in place.
+        compression (str, optional): Compression of the output, see `convert`. Defaults to the compression of the input.
+
+    Returns:
+        dict: {name_out: number of datapoints written}.
+
+    Example:
+        >>> import tempfile
+        >>> from .conversion import convert
+        >>> from .util import dump_json, load_json
+        >>> root = tempfile.mkdtemp()
+        >>> shapes = {'ref1': [0, 0, 0, 1, 1, 1, 0, 0, 0], 'ref2': [0, 0, 0.5, 1, 0, 0, 0, 0, 0], 'ref3': [1, 0, 0, 0, 0, 0, 0, 0, 1]}
+        >>> dump_json({ref: {'sequence': 'GGGAAACCC', 'structure': [[0, 8], [1, 7], [2, 6]], 'shape': shape} for ref, shape in shapes.items()}, os.path.join(root, 'input.json'))
+        >>> _ = convert('json', os.path.join(root, 'input.json'), name='my_dataset', path_out=root, filter={'min_AUROC': 0.8}, verbose=False)
+        >>> list(load_json(os.path.join(root, 'my_dataset', 'data.json')))
+        ['ref1']
+        >>> QualityScores.load(os.path.join(root, 'my_dataset', 'quality_scores.npz')).auroc.round(2).tolist()
+        [1.0, 0.61, 0.33]
+        >>> refilter('my_dataset', {'min_AUROC': 0.4}, path=root)
+        {'my_dataset': 2}
+        >>> list(load_json(os.path.join(root, 'my_dataset', 'data.json')))
+        ['ref1', 'ref2']
+        >>> refilter('my_dataset', {'min_AUROC': 0.8}, path=root, name_out='my_strict_dataset')
+        {'my_strict_dataset': 1}
+        >>> refilter('my_dataset', {'min_AUROC': 0.8}, path=root), refilter('my_dataset', {'min_AUROC': 0.0}, path=root)
+        ({'my_dataset': 1}, {'my_dataset': 3})
+        >>> {ref: attr['shape'][:3] for ref, attr in load_json(os.path.join(root, 'my_dataset', 'data.json')).items()}
+        {'ref1': [0, 0, 0], 'ref2': [0, 0, 0.5], 'ref3': [1, 0, 0]}
+
+    The datapoints dropped as near-duplicates by the conversion stay dropped:
+        >>> sequence = 'GGGAAACCCUUAGCUAGCUAGGCUAGCUAGCAUCGAUCGAUGCUAGCUAGCUAGCUAGC'
+        >>> dump_json({'ref1': {'sequence': sequence}, 'ref2': {'sequence': sequence[:-1] + 'A'}}, os.path.join(root, 'near.json'))
+        >>> _ = convert('json', os.path.join(root, 'near.json'), name='my_near_dataset', path_out=root, near_duplicates=0.8, drop_near_duplicates=True, verbose=False)
+        >>> refilter('my_near_dataset', {'deduplicate': 'structure'}, path=root)
+        {'my_near_dataset': 1}
+    """
+    source = Path(name=name, root=path)
+    out = Path(name=name_out or name, root=path)
+    scores = QualityScores.load(source.get_quality_scores())
+    pipeline = _as_pipeline(filter)
+    keep, n_filtered = pipeline.mask(scores)
+    near_duplicate = scores.arrays.get("near_duplicate", np.zeros(scores.n, dtype=bool))
+    n_near_duplicates = int(np.sum(keep & near_duplicate))
+    keep &= ~near_duplicate
+
+    data_json = source.get_data_json()
+    if compression is None:
+        compression = next(
+            (c for c, ext in DATA_JSON_EXTENSIONS.items() if ext and data_json.endswith(ext)),
+            None,
         )
-        df = df[mask_high_AUROC]
+    # all the rows are streamed in index order: the kept ones from data.json, the dropped ones from filtered_out
+    n_records = {}
 
-    # Convert back to list of datapoints
-    listofdatapoints.datapoints = listofdatapoints.from_pandas(df)
+    def indexed(file, indices):
+        n_records[file] = 0
+        # the file comes first in the zip, so that an extra record is counted
+        for record, idx in zip(iter_json(file), indices):
+            n_records[file] += 1
+            yield idx, record
 
-    # Write report
-    report = f"""Over a total of {n_input_datapoints} datapoints, there are:
-### OUTPUT
-- ALL: {len(listofdatapoints)} valid datapoints
-- INCLUDED: {n_same_seq_datapoints} duplicate sequences with different structure / dms / shape
-### MODIFIED
-- {n_same_ref_datapoints} multiple sequences with the same reference (renamed reference)
-### FILTERED OUT
-- {n_unvalid_datapoints} invalid datapoints (ex: sequence with non-regular characters)
-- {n_bad_structures_datapoints} datapoints with bad structures"""
-    if "structure" in df.columns or "dms" in df.columns or "shape" in df.columns:
+    n_dropped = int(np.sum(~scores.kept))
+    filtered_out = source.get_filtered_out()
+    assert not n_dropped or os.path.exists(
+        filtered_out
+    ), f"{name}: {n_dropped} datapoints were filtered out, but {filtered_out} doesn't exist"
+    records = heapq.merge(
+        indexed(data_json, np.flatnonzero(scores.kept)),
+        indexed(filtered_out, np.flatnonzero(~scores.kept)) if n_dropped else (),
+        key=lambda record: record[0],
+    )
+
+    # write next to the output, then move into place, so that the input can be the output
+    out.make()
+    temp = {
+        "data": out.get_data_json(compression) + ".tmp",
+        "filtered_out": out.get_filtered_out(compression) + ".tmp",
+    }
+    refs, references, sequences = dict(), [], []
+    n_written_dropped = 0
+    with JsonWriter(temp["data"]) as writer, JsonWriter(temp["filtered_out"]) as dropped:
+        for idx, (_, attr) in records:
+            reference = str(scores.reference[idx])
+            if not keep[idx]:
+                dropped.write(reference, attr)
+                n_written_dropped += 1
+                continue
+            if reference in refs:
+                refs[reference] += 1
+                reference = f"{reference}_{refs[reference]}"
+            else:
+                refs[reference] = 0
+            writer.write(reference, attr)
+            references.append(reference)
+            sequences.append(attr["sequence"])
+    assert n_records[data_json] == int(
+        np.sum(scores.kept)
+    ), f"{name}: {data_json} doesn't match its quality scores"
+    assert (
+        n_records.get(filtered_out, 0) == n_dropped
+    ), f"{name}: {filtered_out} doesn't match its quality scores"
+    assert n_written_dropped == int(np.sum(~keep))
+
+    for other in DATA_JSON_EXTENSIONS:
+        for file in [out.get_data_json(other), out.get_filtered_out(other)]:
+            if other != compression and os.path.exists(file):
+                os.remove(file)
+    os.replace(temp["data"], out.get_data_json(compression))
+    os.replace(temp["filtered_out"], out.get_filtered_out(compression))
+    QualityScores({**scores.arrays, "kept": keep}).save(out.get_quality_scores())
+    write_content_hashes(out.get_data_json(compression))
+    SequenceIndex(path).add(out.name, sequences)
+    if os.path.exists(source.get_motif_index()):
+        MotifIndex(references, sequences).save(out.get_motif_index())
+
+    report = ""
+    if os.path.exists(source.get_conversion_report()):
+        with open(source.get_conversion_report(), "r") as f:
+            report = f.read()
+    report += f"""
+
+### REFILTERED
+- ALL: {len(references)} valid datapoints, over {scores.n} scored datapoints"""
+    for rule, n in zip(pipeline.rules, n_filtered):
         report += f"""
-- {n_duplicates_datapoints} duplicate sequences with the same structure / dms / shape"""
-    if mask_high_AUROC is not None:
+- {n} {rule.description}"""
+    if near_duplicate.any():
         report += f"""
-- {np.sum(~mask_high_AUROC)} datapoints removed because of low AUROC (<{min_AUROC})"""
-
-    return report
+- {n_near_duplicates} near-duplicate sequences dropped by the conversion"""
+    with open(out.get_conversion_report(), "w") as f:
+        f.write(report)
+    return {out.name: len(references)}
@@ -0,0 +1,218 @@
+import numpy as np
+
+from .env import Env
+from .rnastructure import FoldPool, RNAstructure_singleton, PredictionClient
+
+
+class FoldingBackend:
+    """Interface of the structure prediction backends.
+
+    A backend implements `predict_structure` and `predict_pairing_probability`. `predict_structure_and_pairing_probability`
+    calls both by default, and is overridden by the backends that derive both from a single partition function. The batched variants run them over the
+    `FoldPool`, and can be overridden by backends that have a native batch mode. The backend used by the conversions is
+    selected with the `FOLDING_BACKEND` environment variable (see `Env.get_folding_backend`), among the registered backends.
+
+    Example:
+        >>> class FakeBackend(FoldingBackend):
+        ...     def predict_structure(self, sequence, dms=None, shape=None):
+        ...         return "(" + "." * (len(sequence) - 2) + ")"
+        ...     def predict_pairing_probability(self, sequence, dms=None):
+        ...         return [1.0] + [0.0] * (len(sequence) - 2) + [1.0]
+        >>> import os
+        >>> from unittest import mock
+        >>> from .datapoint import DatapointFactory
+        >>> register_backend("fake", FakeBackend)
+        >>> try:
+        ...     print(get_backend("fake").predict_structures(["GAAAC", "GGAAACC"]))
+        ...     print(get_backend("fake").predict_structure_and_pairing_probability("GAC"))
+        ...     with mock.patch.dict(os.environ, {"FOLDING_BACKEND": "fake"}):
+        ...         print(repr(DatapointFactory.from_fasta("GAAAC", "ref", predict_structure=True)))
+        ...         print(repr(DatapointFactory.from_fasta("GAAAC", "ref", predict_structure=True, predict_pairing_probability=True)))
+        ... finally:
+        ...     _ = BACKENDS.pop("fake"), _instances.pop("fake", None)
+        ['(...)', '(.....)']
+        ('(.)', [1.0, 0.0, 1.0])
+        Datapoint('ref', sequence='GAAAC', structure={(0, 4)})
+        Datapoint('ref', sequence='GAAAC', structure={(0, 4)}, pairing_probability=[1.0, 0.0, 0.0, 0.0, 1.0])
+    """
+
+    def predict_structure(self, sequence: str, dms=None, shape=None) -> str:
+        """Returns the predicted structure of a sequence in dot-bracket notation. The dms or shape signal, if given, is used as a soft constraint."""
+        raise NotImplementedError
+
+    def predict_pairing_probability(self, sequence: str, dms=None) -> list:
+        """Returns the probability of each base of a sequence to be paired."""
+        raise NotImplementedError
+
+    def predict_structure_and_pairing_probability(
+        self, sequence: str, dms=None, shape=None
+    ) -> tuple:
+        """Returns the predicted structure in dot-bracket notation and the probability of each base to be paired."""
+        return (
+            self.predict_structure(sequence, dms=dms, shape=shape),
+            self.predict_pairing_probability(
+                sequence, dms=dms if dms is not None else shape
+            ),
+        )
+
+    def predict_structures(self, sequences: list, dms=None, shape=None) -> list:
+        """Batched `predict_structure`. `dms` and `shape` are lists of signals (or None) aligned with `sequences`."""
+        dms = [None] * len(sequences) if dms is None else dms
+        shape = [None] * len(sequences) if shape is None else shape
+        return list(
+            FoldPool.map(
+                lambda args: self.predict_structure(*args), zip(sequences, dms, shape)
+            )
+        )
+
+    def predict_structures_and_pairing_probabilities(
+        self, sequences: list, dms=None, shape=None
+    ) -> list:
+        """Batched `predict_structure_and_pairing_probability`, returns a list of (dotbracket, probabilities)."""
+        dms = [None] * len(sequences) if dms is None else dms
+        shape = [None] * len(sequences) if shape is None else shape
+        return list(
+            FoldPool.map(
+                lambda args: self.predict_structure_and_pairing_probability(*args),
+                zip(sequences, dms, shape),
+            )
+        )
+
+    def predict_pairing_probabilities(self, sequences: list, dms=None) -> list:
+        """Batched `predict_pairing_probability`. `dms` is a list of signals (or None) aligned with `sequences`."""
+        dms = [None] * len(sequences) if dms is None else dms
+        return list(
+            FoldPool.map(
+                lambda args: self.predict_pairing_probability(*args),
+                zip(sequences, dms),
+            )
+        )
+
+
+class RNAstructureBackend(FoldingBackend):
+    """Runs the RNAstructure executables (`Fold`, `ct2dot`, `partition`, `ProbabilityPlot`, `MaxExpect`) in subprocesses.
+
+    `predict_structure_and_pairing_probability` runs `partition` once and returns the `MaxExpect` structure.
+    """
+
+    def predict_structure(self, sequence, dms=None, shape=None):
+        return RNAstructure_singleton.predictStructure(sequence, dms=dms, shape=shape)
+
+    def predict_structure_and_pairing_probability(self, sequence, dms=None, shape=None):
+        return RNAstructure_singleton.predictStructureAndPairingProbability(
+            sequence, dms=dms, shape=shape
+        )
+
+    def predict_pairing_probability(self, sequence, dms=None):
+        return RNAstructure_singleton.predictPairingProbability(sequence, dms=dms)
+
+
+class ViennaRNABackend(FoldingBackend):
+    """Folds in-process with the Python bindings of ViennaRNA (`pip install ViennaRNA`).
+
+    The dms and shape signals are applied as soft constraints with the pseudo-energy of Deigan et al.
+    For dms, only the A and C bases are used, like RNAstructure does.
+
+    Args:
+        slope (float, optional): Slope of the pseudo-energy, in kcal/mol. Defaults to 1.8.
+        intercept (float, optional): Intercept of the pseudo-energy, in kcal/mol. Defaults to -0.6.
+    """
+
+    def __init__(self, slope: float = 1.8, intercept: float = -0.6):
+        try:
+            import RNA
+        except ImportError:
+            raise ImportError(
+                "The viennarna folding backend needs the ViennaRNA python bindings: pip install ViennaRNA"
+            )
+        self.RNA = RNA
+        self.slope = slope
+        self.intercept = intercept
+
+    def _fold_compound(self, sequence, dms=None, shape=None):
+        fc = self.RNA.fold_compound(sequence)
+        signal = None
+        if dms is not None:
+            # G and U are not probed by dms
+            signal = [
+                float(d) if b in "AC" else -1.0 for d, b in zip(dms, sequence)
+            ]
+        elif shape is not None:
+            signal = [float(s) for s in shape]
+        if signal is not None:
+            assert len(signal) == len(
+                sequence
+            ), "The length of the sequence is not the same as the length of the signal."
+            # 1-based, negative values mean no data
+            fc.sc_add_SHAPE_deigan([-1.0] + signal, self.slope, self.intercept)
+        return fc
+
+    def predict_structure(self, sequence, dms=None, shape=None):
+        structure, _ = self._fold_compound(sequence, dms, shape).mfe()
+        return structure
+
+    def _partition(self, fc):
+        _, mfe = fc.mfe()
+        fc.exp_params_rescale(mfe)
+        fc.pf()
+        bpp = np.array(fc.bpp())[1:, 1:]
+        return np.minimum(bpp.sum(axis=0) + bpp.sum(axis=1), 1).tolist()
+
+    def predict_pairing_probability(self, sequence, dms=None):
+        return self._partition(self._fold_compound(sequence, dms))
+
+    def predict_structure_and_pairing_probability(self, sequence, dms=None, shape=None):
+        """The structure is the maximum expected accuracy structure of the partition function, like with RNAstructure."""
+        fc = self._fold_compound(sequence, dms, shape)
+        probabilities = self._partition(fc)
+        structure, _ = fc.MEA()
+        return structure, probabilities
+
+
+class ServiceBackend(FoldingBackend):
+    """Sends the predictions to the local `PredictionServer` (started with `rouskinhf serve`), whose socket is given by
+    `Env.get_prediction_socket`. The processes of a host then share its workers and its coalescing of identical requests.
+    """
+
+    def __init__(self):
+        self.client = PredictionClient()
+
+    def predict_structure(self, sequence, dms=None, shape=None):
+        return self.client.predictStructure(sequence, dms=dms, shape=shape)
+
+    def predict_pairing_probability(self, sequence, dms=None):
+        return self.client.predictPairingProbability(sequence, dms=dms)
+
+    def predict_structure_and_pairing_probability(self, sequence, dms=None, shape=None):
+        return self.client.predictStructureAndPairingProbability(
+            sequence, dms=dms, shape=shape
+        )
+
+    def predict_structures(self, sequences, dms=None, shape=None):
+        return self.client.predict_structures(sequences, dms=dms, shape=shape)
+
+
+BACKENDS = {
+    "rnastructure": RNAstructureBackend,
+    "viennarna": ViennaRNABackend,
+    "service": ServiceBackend,
+}
+_instances = {}
+
+
+def register_backend(name: str, backend_class) -> None:
+    """Register a FoldingBackend subclass under a name, to select it with `FOLDING_BACKEND=name`."""
+    BACKENDS[name] = backend_class
+    _instances.pop(name, None)
+
+
+def get_backend(name: str = None) -> FoldingBackend:
+    """Returns the backend registered under `name`, by default the one selected by `Env.get_folding_backend`."""
+    if name is None:
+        name = Env.get_folding_backend()
+    assert (
+        name in BACKENDS
+    ), f"Unknown folding backend {name}. Available backends: {list(BACKENDS)}"
+    if name not in _instances:
+        _instances[name] = BACKENDS[name]()
+    return _instances[name]
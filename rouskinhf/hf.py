@@ -1,59 +1,249 @@
-from huggingface_hub import snapshot_download
 import os
 from os.path import dirname, exists
 import json
-from huggingface_hub import HfApi
+import fcntl
+import shutil
 import datetime
+import tempfile
 import numpy as np
 import json
+from concurrent.futures import ThreadPoolExecutor, as_completed
 
 from .path import Path
 from .env import Env
+from .sequence_index import SequenceIndex
+from .record_log import RecordLog
+from .cache import DatasetCache
+from .metrics import Metrics
+from .content_hashes import write_content_hashes, load_content_hashes
+from .util import load_json, iter_json
 
 
-def get_dataset(name: str, path="data", force_download=False, tqdm=True):
+def get_dataset(
+    name: str,
+    path="data",
+    force_download=False,
+    tqdm=True,
+    download=None,
+    revision: str = None,
+):
     """Get a dataset from HuggingFace or from the local cache.
 
+    The changes appended to the local dataset with `RecordLog` are applied on top of its `data.json`.
+    Only one process per host downloads a dataset at a time, see `fetch_dataset`. A cached download is checked before
+    being used, and downloaded again if it is corrupted or at another revision than `revision`, see `DatasetCache`.
+
     Args:
         name (str): Name of the dataset.
         force_download (bool, optional): Whether to force the download or not. Defaults to False.
         tqdm (bool, optional): Whether to display a progress bar or not. Defaults to True.
+        download (callable, optional): `download(path, local_dir, revision)` writes the files of the dataset to `local_dir`. Defaults to `download_dataset`.
+        revision (str, optional): Revision (branch, tag or commit) of the dataset on the hub. Defaults to the cached copy, or to the latest revision.
     """
 
     path = Path(name=name, root=path)
+    cache = DatasetCache(path.get_data_folder())
 
-    if force_download:
-        os.system(f"rm -rf {path.get_main_folder()}")
-
-    if not exists(path.get_data_json()):
-        print("{}: Downloading dataset from HuggingFace Hub...".format(name))
-        download_dataset(path)
-        print(
-            "{}: Download complete. File saved at {}".format(name, path.get_data_json())
+    while True:
+        downloaded = (
+            force_download
+            or (not exists(path.get_data_json()) and not exists(path.get_record_log()))
+            or not cache.check(name, revision)
+        ) and fetch_dataset(
+            path, force_download=force_download, download=download, revision=revision
         )
+        Metrics.inc("cache_misses_total" if downloaded else "cache_hits_total", cache="download")
+        # read under a shared lock, so that the dataset isn't evicted by another process mid-read
+        with cache.reading(name):
+            cache.touch(name)
+            if exists(path.get_record_log()):
+                return RecordLog(name, path.get_data_folder()).read()
+            if exists(path.get_data_json()):
+                return load_json(path.get_data_json())
+        # evicted between the check and the read: fetch it again
+        assert not downloaded, f"{name}: the download didn't write {path.get_data_json()}"
+        force_download = False
+
+
+def get_datasets(
+    names: list,
+    path="data",
+    force_download=False,
+    max_workers: int = 8,
+    tqdm=True,
+    download=None,
+    revisions: dict = None,
+) -> dict:
+    """Get several datasets at once, downloading the missing ones concurrently.
+
+    Args:
+        names (list): Names of the datasets.
+        path (str, optional): Path to the data folder. Defaults to 'data'.
+        force_download (bool, optional): Whether to force the download or not. Defaults to False.
+        max_workers (int, optional): Number of datasets fetched at the same time. Defaults to 8.
+        tqdm (bool, optional): Whether to display a progress bar or not. Defaults to True.
+        download (callable, optional): See `get_dataset`. Defaults to `download_dataset`.
+        revisions (dict, optional): {name: revision} of the datasets to pin, see `get_dataset`. Defaults to None.
+
+    Returns:
+        dict: {name: datapoints}, in the order of `names`.
+
+    Example:
+        >>> import io, shutil, tempfile, threading, time
+        >>> from contextlib import redirect_stdout
+        >>> from .util import dump_json
+        >>> hub, root = tempfile.mkdtemp(), tempfile.mkdtemp()
+        >>> for name in ['ds1', 'ds2', 'ds3']:
+        ...     dump_json({f'{name}_ref': {'sequence': 'ACGU'}}, os.path.join(hub, name, 'data.json'))
+        >>> calls = []
+        >>> def download(path, local_dir, revision):  # a local stand-in for the hub
+        ...     calls.append(path.name)
+        ...     time.sleep(0.2)
+        ...     shutil.copy(os.path.join(hub, path.name, 'data.json'), local_dir)
+        >>> results = []
+        >>> def job():
+        ...     results.append(get_datasets(['ds1', 'ds2', 'ds3'], root, tqdm=False, download=download))
+        >>> threads = [threading.Thread(target=job) for _ in range(4)]  # e.g. 4 ranks starting at once
+        >>> with redirect_stdout(io.StringIO()):
+        ...     _ = [t.start() for t in threads]
+        ...     _ = [t.join() for t in threads]
+        >>> sorted(calls)
+        ['ds1', 'ds2', 'ds3']
+        >>> results[0]
+        {'ds1': {'ds1_ref': {'sequence': 'ACGU'}}, 'ds2': {'ds2_ref': {'sequence': 'ACGU'}}, 'ds3': {'ds3_ref': {'sequence': 'ACGU'}}}
+        >>> all(r == results[0] for r in results)
+        True
+        >>> sorted(SequenceIndex(root).names())
+        ['ds1', 'ds2', 'ds3']
+    """
+    names = list(dict.fromkeys(names))
+    with ThreadPoolExecutor(max_workers=max(1, min(max_workers, len(names)))) as pool:
+        futures = {
+            pool.submit(
+                get_dataset,
+                name,
+                path,
+                force_download=force_download,
+                tqdm=False,
+                download=download,
+                revision=(revisions or {}).get(name),
+            ): name
+            for name in names
+        }
+        completed = as_completed(futures)
+        if tqdm:
+            from tqdm import tqdm as tqdm_bar
 
-    return json.load(open(path.get_data_json(), "r"))
+            completed = tqdm_bar(completed, total=len(futures), desc="Datasets")
+        data = {futures[future]: future.result() for future in completed}
+    return {name: data[name] for name in names}
 
 
-def download_dataset(path: Path):
-    """Download a dataset from HuggingFace Hub. The name corresponds to the name of the dataset on HuggingFace Hub."""
+def fetch_dataset(
+    path: Path, force_download=False, download=None, revision: str = None
+) -> bool:
+    """Downloads a dataset to the local cache, if it isn't there yet. Returns whether it was downloaded by this call.
+
+    The download is single-flight: a lock file (`Path.get_download_lock`) makes the other threads and processes of the
+    host wait for the first one, then use its copy. With `force_download`, a copy completed while waiting for the lock
+    counts as fresh. The files are downloaded to a temporary folder and moved into the dataset folder, data.json last,
+    so a reader never sees a partial file. The temporary folders of an interrupted download are removed by the next one.
+    The download is recorded in the `DatasetCache`, which then evicts the least recently used datasets over its budget.
+
+    Args:
+        path (Path): Path of the dataset.
+        force_download (bool, optional): Whether to replace the local copy. Defaults to False.
+        download (callable, optional): See `get_dataset`. Defaults to `download_dataset`.
+        revision (str, optional): See `get_dataset`. Defaults to None.
+    """
+    download = download or download_dataset
+    cache = DatasetCache(path.get_data_folder())
+    name = path.name
+    os.makedirs(path.get_data_folder(), exist_ok=True)
+    with open(path.get_download_lock(), "a") as lock:
+        # the lock file is touched after each download
+        last_download = os.path.getmtime(lock.name)
+        fcntl.flock(lock, fcntl.LOCK_EX)
+        try:
+            if force_download and os.path.getmtime(lock.name) > last_download:
+                force_download = False  # downloaded by another process meanwhile
+            if not force_download and (
+                exists(path.get_data_json()) or exists(path.get_record_log())
+            ):
+                if cache.check(name, revision):
+                    return False
+                print(
+                    "{}: The cached copy is corrupted or at another revision, downloading it again.".format(name)
+                )
+                force_download = True
+            for folder in os.listdir(path.get_data_folder()):
+                if folder.startswith(f".{name}.partial."):
+                    shutil.rmtree(os.path.join(path.get_data_folder(), folder))
+
+            print("{}: Downloading dataset from HuggingFace Hub...".format(name))
+            temp = tempfile.mkdtemp(prefix=f".{name}.partial.", dir=path.get_data_folder())
+            try:
+                download(path, temp, revision)
+                files = [f for f in os.listdir(temp) if not f.startswith(".")]
+                data_files = [f for f in files if f.startswith("data.json")]
+                assert len(data_files) == 1, f"{name}: expected one data.json file, got {data_files}"
+                if "content_hashes.json" not in files:
+                    write_content_hashes(os.path.join(temp, data_files[0]))
+                    files.append("content_hashes.json")
+                if force_download:
+                    shutil.rmtree(path.get_main_folder(), ignore_errors=True)
+                path.make()
+                for f in sorted(files, key=lambda f: f in data_files):
+                    os.replace(os.path.join(temp, f), os.path.join(path.get_main_folder(), f))
+                cache.record(name, files, revision)
+            finally:
+                shutil.rmtree(temp, ignore_errors=True)
+            print(
+                "{}: Download complete. File saved at {}".format(name, path.get_data_json())
+            )
+            SequenceIndex(path.get_data_folder()).add(
+                name, [d["sequence"] for _, d in iter_json(path.get_data_json())]
+            )
+            os.utime(lock.name)
+        finally:
+            fcntl.flock(lock, fcntl.LOCK_UN)
+    cache.prune(exclude=[name])
+    return True
+
+
+def download_dataset(path: Path, local_dir: str = None, revision: str = None):
+    """Download a dataset from HuggingFace Hub. The name corresponds to the name of the dataset on HuggingFace Hub.
+
+    Args:
+        path (Path): Path of the dataset.
+        local_dir (str, optional): Folder to download the files to. Defaults to the dataset folder.
+        revision (str, optional): Revision (branch, tag or commit) to download. Defaults to the latest revision.
+    """
+    from huggingface_hub import snapshot_download
+
     snapshot_download(
         repo_id="rouskinlab/" + path.name,
         repo_type="dataset",
-        local_dir=dirname(path.get_data_json()),
+        revision=revision,
+        local_dir=local_dir or dirname(path.get_data_json()),
         token=Env.get_hf_token(),
-        allow_patterns=["data.json"],
+        allow_patterns=[
+            "data.json",
+            "data.json.gz",
+            "data.json.zst",
+            "content_hashes.json",
+        ],
     )
 
 
 def name_from_path(datapath: str):
-    if datapath.split("/")[-1] == "data.json":
+    if datapath.split("/")[-1] in ["data.json", "data.json.gz", "data.json.zst"]:
         return datapath.split("/")[-2]
     return datapath.split("/")[-1].split(".")[0]
 
 
 def clean_data(datapath: str):
-    data = json.load(open(datapath, "r"))
+    data = load_json(datapath)
     for ref, values in data.items():
         copy = values.copy()
         for k, v in values.items():
@@ -66,6 +256,8 @@ def clean_data(datapath: str):
 def upload_dataset(
     datapath: str, exist_ok=False, commit_message: str = None, add_card=True, **kwargs
 ):
+    from huggingface_hub import HfApi
+
     api = HfApi()
     name = name_from_path(datapath)
     # data = clean_data(datapath)
@@ -82,7 +274,9 @@ def upload_dataset(
 
     api.upload_file(
         path_or_fileobj=datapath,
-        path_in_repo="data.json",
+        path_in_repo=os.path.basename(datapath)
+        if os.path.basename(datapath).startswith("data.json")
+        else "data.json",
         repo_id="rouskinlab/" + name,
         repo_type="dataset",
         token=hf_token,
@@ -90,6 +284,16 @@ def upload_dataset(
         **kwargs,
     )
 
+    # the content hashes of the datapoints, to diff the next versions against this one
+    api.upload_file(
+        path_or_fileobj=json.dumps(load_content_hashes(datapath)).encode(),
+        path_in_repo="content_hashes.json",
+        repo_id="rouskinlab/" + name,
+        repo_type="dataset",
+        token=hf_token,
+        commit_message=commit_message,
+    )
+
     if add_card:
         card = write_card(datapath)
         api.upload_file(
@@ -127,7 +331,7 @@ date: {}
     )
 
     data_type_count = {}
-    data = json.load(open(datapath, "r"))
+    data = load_json(datapath)
     for dp in data.values():
         for k, v in dp.items():
             if v is None or (isinstance(v, float) and np.isnan(v)):
@@ -1,19 +1,77 @@
 import os
+import itertools
 import numpy as np
 from .datapoint import Datapoint, DatapointFactory
 from typing import List
-from .parsers import Fasta, DreemOutput
+from .parsers import Fasta, DreemOutput, iter_files
+from .rnastructure import FoldPool, FoldTimeoutError
+from .metrics import Metrics
+from contextlib import nullcontext
 
 import pandas as pd
 from tqdm import tqdm as tqdm_parser
 import json
+from .util import load_json, open_dataset, quantize_signals
+
+
+def _create_datapoints(
+    factory, records, total, desc, tqdm=True, checkpoint=None, length=None
+):
+    """Applies `factory` to each record, over the FoldPool, and returns the datapoints in input order and the references
+    of the records whose structure prediction timed out. The first element of each record must be its reference.
+
+    With `length`, a function returning the sequence length of a record, the longest records of each window of the FoldPool are dispatched first.
+    If a checkpoint is given, the records already in it are not created again, and the new datapoints are appended to it.
+    """
+
+    def create(record):
+        try:
+            return factory(record), False
+        except FoldTimeoutError:
+            return None, True
+
+    done = {} if checkpoint is None else checkpoint.load()
+    if checkpoint is not None:
+        Metrics.inc("cache_hits_total", len(done), cache="checkpoint")
+    # streamed: FoldPool reads the records by windows, so they aren't all in memory before the first prediction
+    todo = ((idx, record) for idx, record in enumerate(records) if idx not in done)
+    timeouts = []
+    with checkpoint or nullcontext():
+        for _, ((idx, record), (datapoint, timed_out)) in tqdm_parser(
+            FoldPool.imap_unordered(
+                lambda item: (item, create(item[1])),
+                todo,
+                key=None if length is None else lambda item: length(item[1]),
+            ),
+            total=total,
+            initial=len(done),
+            desc=desc,
+            disable=not tqdm,
+        ):
+            if checkpoint is not None:
+                Metrics.inc("cache_misses_total", cache="checkpoint")
+            if timed_out:
+                # not journaled, so that a resumed conversion tries again
+                timeouts.append((idx, record[0]))
+                continue
+            if checkpoint is not None:
+                checkpoint.write(idx, datapoint)
+            done[idx] = Metrics.record(datapoint)
+    return [done[idx] for idx in sorted(done)], [ref for _, ref in sorted(timeouts)]
+
+
+def _islice(records, subset=None):
+    """The records of indices in the range `subset` = (start, end), or all of them if `subset` is None."""
+    return records if subset is None else itertools.islice(records, *subset)
 
 
 class ListofDatapoints:
     """Class to store a list of datapoints."""
 
-    def __init__(self, datapoints=[], verbose=True):
+    def __init__(self, datapoints=[], verbose=True, fold_timeouts=None):
         self.datapoints = datapoints
+        # references whose structure prediction timed out
+        self.fold_timeouts = fold_timeouts if fold_timeouts is not None else []
 
     def __call__(self) -> List[Datapoint]:
         return self.datapoints
@@ -23,35 +81,48 @@ class ListofDatapoints:
 
     @classmethod
     def from_fasta(
-        cls, fasta_file, predict_structure, tqdm=True, verbose=True
+        cls,
+        fasta_file,
+        predict_structure,
+        tqdm=True,
+        verbose=True,
+        checkpoint=None,
+        subset=None,
+        predict_pairing_probability=False,
     ) -> "ListofDatapoints":
-        """Create a list of datapoint from a fasta file. The structure and dms will be predicted if predict_structure and predict_dms are True."""
-        sequences, references = Fasta.parse(fasta_file)
-        return cls(
-            [
-                DatapointFactory.from_fasta(sequence, reference, predict_structure)
-                for sequence, reference in tqdm_parser(
-                    zip(sequences, references),
-                    total=len(sequences),
-                    desc="Parsing fasta file",
-                    disable=not tqdm,
-                )
-            ],
-            verbose=verbose,
+        """Create a list of datapoint from a fasta file. The structure and dms will be predicted if predict_structure and predict_dms are True.
+        The fasta file is streamed, see `Fasta.parse`. If `subset` is a byte range (start, end), only its records are read.
+
+        The other readers take the same `subset` argument, as a range (start, end) of record indices, or for ct and bpseq
+        files also as a list of their paths (see `iter_files`).
+        With `predict_pairing_probability`, the probability of each base to be paired is predicted, from the same
+        partition function as the structure if both are predicted, see `DatapointFactory`."""
+        total = None
+        if subset is None and os.path.exists(Fasta.get_index(fasta_file)):
+            total = sum(1 for _ in open(Fasta.get_index(fasta_file)))
+        datapoints, fold_timeouts = _create_datapoints(
+            lambda args: DatapointFactory.from_fasta(
+                args[1], args[0], predict_structure, predict_pairing_probability
+            ),
+            Fasta.parse(fasta_file, *(subset or ())),
+            total=total,
+            desc="Parsing fasta file",
+            tqdm=tqdm,
+            checkpoint=checkpoint,
+            length=(lambda args: len(args[1]))
+            if predict_structure or predict_pairing_probability
+            else None,
         )
+        return cls(datapoints, verbose=verbose, fold_timeouts=fold_timeouts)
 
     @classmethod
-    def from_bpseq(cls, bpseq_folder, tqdm=True, verbose=True):
-        """Create a list of datapoint from a bpseq file. The dms will be predicted if predict_dms is True."""
-        bpseq_files = [
-            f.path for f in os.scandir(bpseq_folder) if f.path.endswith(".bpseq")
-        ]
+    def from_bpseq(cls, bpseq_folder, tqdm=True, verbose=True, subset=None):
+        """Create a list of datapoint from the bpseq files of a folder (recursively) or of a .tar, .tar.gz or .zip archive. The dms will be predicted if predict_dms is True."""
         return cls(
             [
-                DatapointFactory.from_bpseq(ct_file)
-                for ct_file in tqdm_parser(
-                    bpseq_files,
-                    total=len(bpseq_files),
+                Metrics.record(DatapointFactory.from_bpseq(bpseq_file, lines))
+                for bpseq_file, lines in tqdm_parser(
+                    iter_files(bpseq_folder, ".bpseq", subset),
                     desc="Parsing bpseq files",
                     disable=not tqdm,
                 )
@@ -60,15 +131,13 @@ class ListofDatapoints:
         )
 
     @classmethod
-    def from_ct(cls, ct_folder, tqdm=True, verbose=True):
-        """Create a list of datapoint from a list of ct files. The dms will be predicted if predict_dms is True."""
-        ct_files = [f.path for f in os.scandir(ct_folder) if f.path.endswith(".ct")]
+    def from_ct(cls, ct_folder, tqdm=True, verbose=True, subset=None):
+        """Create a list of datapoint from the ct files of a folder (recursively) or of a .tar, .tar.gz or .zip archive. The dms will be predicted if predict_dms is True."""
         return cls(
             [
-                DatapointFactory.from_ct(ct_file)
-                for ct_file in tqdm_parser(
-                    ct_files,
-                    total=len(ct_files),
+                Metrics.record(DatapointFactory.from_ct(ct_file, lines))
+                for ct_file, lines in tqdm_parser(
+                    iter_files(ct_folder, ".ct", subset),
                     desc="Parsing ct files",
                     disable=not tqdm,
                 )
@@ -78,41 +147,59 @@ class ListofDatapoints:
 
     @classmethod
     def from_dreem_output(
-        cls, dreem_output_file, predict_structure, tqdm=True, verbose=True
+        cls,
+        dreem_output_file,
+        predict_structure,
+        tqdm=True,
+        verbose=True,
+        checkpoint=None,
+        subset=None,
+        predict_pairing_probability=False,
     ):
         """Create a list of datapoint from a dreem output file. The structure and dms will be predicted if predict_structure and predict_dms are True."""
-        n_lines = len(list(DreemOutput.parse(dreem_output_file)))
-        return cls(
-            [
-                DatapointFactory.from_dreem_output(
-                    reference, sequence, mutation_rate, predict_structure
-                )
-                for reference, sequence, mutation_rate in tqdm_parser(
-                    DreemOutput.parse(dreem_output_file),
-                    total=n_lines,
-                    desc="Parsing dreem output file",
-                    disable=not tqdm,
-                )
-            ],
-            verbose=verbose,
+        records = list(_islice(DreemOutput.parse(dreem_output_file), subset))
+        datapoints, fold_timeouts = _create_datapoints(
+            lambda args: DatapointFactory.from_dreem_output(
+                *args, predict_structure, predict_pairing_probability
+            ),
+            records,
+            total=len(records),
+            desc="Parsing dreem output file",
+            tqdm=tqdm,
+            checkpoint=checkpoint,
+            length=(lambda args: len(args[1]))
+            if predict_structure or predict_pairing_probability
+            else None,
         )
+        return cls(datapoints, verbose=verbose, fold_timeouts=fold_timeouts)
 
     @classmethod
-    def from_json(cls, json_file, predict_structure=False, tqdm=True, verbose=True):
+    def from_json(
+        cls,
+        json_file,
+        predict_structure=False,
+        tqdm=True,
+        verbose=True,
+        checkpoint=None,
+        subset=None,
+        predict_pairing_probability=False,
+    ):
         """Create a list of datapoint from a json file."""
-        data = json.load(open(json_file))
-        return cls(
-            [
-                DatapointFactory.from_json_line(reference, line, predict_structure)
-                for reference, line in tqdm_parser(
-                    data.items(),
-                    total=len(data),
-                    desc="Parsing json file",
-                    disable=not tqdm,
-                )
-            ],
-            verbose=verbose,
+        data = list(_islice(load_json(json_file).items(), subset))
+        datapoints, fold_timeouts = _create_datapoints(
+            lambda args: DatapointFactory.from_json_line(
+                *args, predict_structure, predict_pairing_probability
+            ),
+            data,
+            total=len(data),
+            desc="Parsing json file",
+            tqdm=tqdm,
+            checkpoint=checkpoint,
+            length=(lambda args: len(args[1]["sequence"]))
+            if predict_structure or predict_pairing_probability
+            else None,
         )
+        return cls(datapoints, verbose=verbose, fold_timeouts=fold_timeouts)
 
     def to_dict(self) -> dict:
         """Converts the list of datapoints into a dictionary."""
@@ -120,20 +207,33 @@ class ListofDatapoints:
             datapoint.reference: datapoint.to_dict()[1] for datapoint in self.datapoints
         }
 
-    def to_json(self, path) -> None:
-        """Write a list of datapoints to a json file."""
+    def to_json(self, path, quantize=False) -> None:
+        """Write a list of datapoints to a json file. The file is compressed if its extension is `.gz` or `.zst`.
+        If `quantize` is True, the dms and shape signals are stored as uint16 fixed-point (see `util.quantize_signal`).
+        """
         if os.path.dirname(path) != "":
             os.makedirs(os.path.dirname(path), exist_ok=True)
-        with open(path, "w") as f:
+        with open_dataset(path, "w") as f:
             f.write("{\n")
             for idx, datapoint in enumerate(
                 self.datapoints
             ):  # write the datapoints one by one to avoid memory issues
-                f.write(
-                    str(datapoint) + ",\n"
-                    if idx != len(self.datapoints) - 1
-                    else str(datapoint) + "\n"
+                reference, attr = datapoint.to_dict()
+                attr = {
+                    k: v
+                    for k, v in attr.items()
+                    if not (isinstance(v, float) and np.isnan(v))
+                }
+                # json.dumps rather than str(datapoint): numpy 2 scalars are repr'd as np.float32(...), which isn't json
+                line = (
+                    json.dumps(reference)
+                    + ":"
+                    + json.dumps(
+                        quantize_signals(attr) if quantize else attr,
+                        default=lambda x: x.tolist() if hasattr(x, "tolist") else list(x),
+                    )
                 )
+                f.write(line + ",\n" if idx != len(self.datapoints) - 1 else line + "\n")
             f.write("}\n")
 
     def to_pandas(self, datapoints=None) -> pd.DataFrame:
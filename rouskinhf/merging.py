@@ -0,0 +1,225 @@
+import os
+import json
+import heapq
+import zlib
+import tempfile
+from tqdm import tqdm as tqdm_parser
+
+from .datapoint import DatapointFactory
+from .path import Path
+from .sequence_index import SequenceIndex
+from .content_hashes import write_content_hashes
+from .util import iter_json, dequantize_signals
+
+
+class _Partitions:
+    """A set of json-lines spill files, one per partition."""
+
+    def __init__(self, folder, prefix, n_partitions):
+        self.paths = [
+            os.path.join(folder, f"{prefix}_{p}.jsonl") for p in range(n_partitions)
+        ]
+        self._files = None
+
+    def __enter__(self):
+        self._files = [open(path, "w") for path in self.paths]
+        return self
+
+    def __exit__(self, *args):
+        for f in self._files:
+            f.close()
+
+    def write(self, partition, line):
+        self._files[partition].write(json.dumps(line) + "\n")
+
+    def read(self, partition):
+        with open(self.paths[partition], "r") as f:
+            for line in f:
+                yield json.loads(line)
+
+
+def _partition(string, n_partitions):
+    return zlib.crc32(string.encode()) % n_partitions
+
+
+def merge(
+    data_jsons: list,
+    name: str,
+    path_out: str = "data",
+    n_partitions: int = 64,
+    temp_dir: str = None,
+    tqdm: bool = True,
+    verbose: bool = True,
+):
+    """Merges several `data.json` files into one dataset with bounded memory.
+
+    The datapoints are streamed from the input files and spilled to disk in `n_partitions` partitions by hash of their sequence,
+    so that the duplicates of a sequence always end up in the same partition. Each partition is then deduplicated on its own,
+    and the partitions are merged back in the input order. Only one partition is held in memory at a time.
+
+    The same rules as `filter.filter` are applied:
+        - datapoints with no sequence, no reference or non-regular characters are dropped
+        - datapoints with bad structures are dropped
+        - only the first datapoint of each (sequence, structure), (sequence, dms) and (sequence, shape) is kept
+        - multiple kept datapoints with the same reference are renamed `reference_1`, `reference_2`, ...
+
+    The datapoints are not filtered by AUROC.
+
+    Args:
+        data_jsons (list): Paths to the `data.json` files to merge, in order of priority.
+        name (str): Name of the merged dataset.
+        path_out (str, optional): Path to the output folder. Defaults to 'data'.
+        n_partitions (int, optional): Number of spill partitions. Increase it if a partition doesn't fit in memory. Defaults to 64.
+        temp_dir (str, optional): Folder for the spill files. Defaults to the system temporary folder.
+        tqdm (bool, optional): Whether to display a progress bar or not. Defaults to True.
+        verbose (bool, optional): Whether to print the merge report or not. Defaults to True.
+
+    Returns:
+        str: The merge report.
+
+    Example:
+        >>> import tempfile
+        >>> from .util import dump_json
+        >>> root = tempfile.mkdtemp()
+        >>> dump_json({'ref1': {'sequence': 'AACCGG', 'structure': [[1, 2]]}, 'ref2': {'sequence': 'AUGGC'}}, os.path.join(root, 'a.json'))
+        >>> dump_json({'ref1': {'sequence': 'AUGGC'}, 'ref3': {'sequence': 'AACCGG', 'structure': [[1, 2]]}, 'ref4': {'sequence': 'AACCGG', 'structure': [[0, 5]]}, 'ref2': {'sequence': 'GGGAAA'}}, os.path.join(root, 'b.json'))
+        >>> print(merge([os.path.join(root, 'a.json'), os.path.join(root, 'b.json')], 'merged', path_out=root, tqdm=False, verbose=False))
+        Over a total of 6 datapoints, there are:
+        ### OUTPUT
+        - ALL: 4 valid datapoints
+        - INCLUDED: 1 duplicate sequences with different structure / dms / shape
+        ### MODIFIED
+        - 1 multiple sequences with the same reference (renamed reference)
+        ### FILTERED OUT
+        - 0 invalid datapoints (ex: sequence with non-regular characters)
+        - 0 datapoints with bad structures
+        - 2 duplicate sequences with the same structure / dms / shape
+        >>> list(json.load(open(os.path.join(root, 'merged', 'data.json'))).keys())
+        ['ref1', 'ref2', 'ref4', 'ref2_1']
+    """
+    path = Path(name=name, root=path_out)
+    path.make()
+
+    n_input_datapoints, n_unvalid_datapoints, n_bad_structures_datapoints = 0, 0, 0
+    n_same_ref_datapoints, n_duplicates_datapoints, n_same_seq_datapoints = 0, 0, 0
+    columns = set()
+
+    with tempfile.TemporaryDirectory(dir=temp_dir) as temp:
+        # 1. Stream the inputs and spill the valid datapoints by sequence
+        with _Partitions(temp, "records", n_partitions) as records:
+            idx = 0
+            for data_json in data_jsons:
+                for reference, line in tqdm_parser(
+                    iter_json(data_json),
+                    desc=f"Reading {data_json}",
+                    disable=not tqdm,
+                ):
+                    n_input_datapoints += 1
+                    datapoint = DatapointFactory.from_json_line(
+                        reference, dequantize_signals(line)
+                    )
+                    if datapoint is None:
+                        n_unvalid_datapoints += 1
+                        continue
+                    if not datapoint._assert_structure():
+                        n_bad_structures_datapoints += 1
+                        continue
+                    datapoint.convert_arrays_to_list()
+                    reference, record = datapoint.to_dict()
+                    columns.update(record.keys())
+                    records.write(
+                        _partition(record["sequence"], n_partitions),
+                        [idx, reference, record],
+                    )
+                    idx += 1
+
+        # 2. Deduplicate each partition, and spill the references of the kept datapoints by reference
+        subsets = [
+            ["sequence", column]
+            for column in ["structure", "dms", "shape"]
+            if column in columns
+        ]
+        with _Partitions(temp, "runs", n_partitions) as runs, _Partitions(
+            temp, "references", n_partitions
+        ) as references:
+            for p in tqdm_parser(
+                range(n_partitions), desc="Deduplicating", disable=not tqdm
+            ):
+                kept = sorted(records.read(p))
+                for subset in subsets:
+                    seen, deduplicated = set(), []
+                    for idx, reference, record in kept:
+                        key = json.dumps([record.get(column) for column in subset])
+                        if key not in seen:
+                            seen.add(key)
+                            deduplicated.append([idx, reference, record])
+                    n_duplicates_datapoints += len(kept) - len(deduplicated)
+                    kept = deduplicated
+                n_same_seq_datapoints += len(kept) - len(
+                    set([record["sequence"] for _, _, record in kept])
+                )
+                for idx, reference, record in kept:
+                    runs.write(p, [idx, reference, record])
+                    references.write(
+                        _partition(reference, n_partitions), [idx, reference, p]
+                    )
+
+        # 3. Rename the kept datapoints with the same reference, in input order, like `FilterPipeline.apply`
+        with _Partitions(temp, "renames", n_partitions) as renames:
+            for p in range(n_partitions):
+                refs = dict()
+                for idx, reference, partition in sorted(references.read(p)):
+                    if reference in refs:
+                        refs[reference] += 1
+                        renames.write(
+                            partition, [idx, f"{reference}_{refs[reference]}"]
+                        )
+                        n_same_ref_datapoints += 1
+                    else:
+                        refs[reference] = 0
+
+        with _Partitions(temp, "renamed", n_partitions) as renamed_runs:
+            for p in range(n_partitions):
+                renamed = dict(renames.read(p))
+                for idx, reference, record in runs.read(p):
+                    renamed_runs.write(p, [idx, renamed.get(idx, reference), record])
+
+        # 4. Merge the partitions back in input order
+        n_output_datapoints = 0
+        with open(path.get_data_json(), "w") as f:
+            f.write("{\n")
+            for _, reference, record in heapq.merge(
+                *[renamed_runs.read(p) for p in range(n_partitions)]
+            ):
+                if n_output_datapoints:
+                    f.write(",\n")
+                f.write(json.dumps(reference) + ":" + json.dumps(record))
+                n_output_datapoints += 1
+            f.write("\n}\n")
+
+    report = f"""Over a total of {n_input_datapoints} datapoints, there are:
+### OUTPUT
+- ALL: {n_output_datapoints} valid datapoints
+- INCLUDED: {n_same_seq_datapoints} duplicate sequences with different structure / dms / shape
+### MODIFIED
+- {n_same_ref_datapoints} multiple sequences with the same reference (renamed reference)
+### FILTERED OUT
+- {n_unvalid_datapoints} invalid datapoints (ex: sequence with non-regular characters)
+- {n_bad_structures_datapoints} datapoints with bad structures"""
+    if subsets:
+        report += f"""
+- {n_duplicates_datapoints} duplicate sequences with the same structure / dms / shape"""
+
+    if verbose:
+        print(report)
+
+    with open(path.get_conversion_report(), "w") as f:
+        f.write("# Conversion report \n\n")
+        f.write(report)
+
+    SequenceIndex(path_out).add(
+        name, (record["sequence"] for _, record in iter_json(path.get_data_json()))
+    )
+    write_content_hashes(path.get_data_json())
+
+    return report
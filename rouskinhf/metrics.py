@@ -0,0 +1,299 @@
+import os
+import time
+import threading
+from contextlib import contextmanager
+
+from .env import Env
+
+# name: (type, help) of the metrics, exported with the prefix `rouskinhf_`
+METRICS = {
+    "records_total": ("counter", "Datapoints created from the input records."),
+    "bases_total": ("counter", "Bases of the datapoints created from the input records."),
+    "folds_total": ("counter", "Structure or pairing probability predictions."),
+    "fold_seconds_total": ("counter", "Wall time spent in the predictions."),
+    "fold_timeouts_total": ("counter", "Predictions that timed out after all their retries."),
+    "cache_hits_total": ("counter", "Cache hits: records resumed from a checkpoint, predictions answered by the prediction service cache, datasets read from the download cache."),
+    "cache_misses_total": ("counter", "Cache misses, see cache_hits_total."),
+    "records_per_second": ("gauge", "Records created per second over the last export interval of the file."),
+    "bases_per_second": ("gauge", "Bases created per second over the last export interval of the file."),
+    "folds_per_second": ("gauge", "Predictions per second over the last export interval of the file."),
+    "fold_queue_depth": ("gauge", "Predictions submitted to the FoldPool and not completed yet."),
+    "work_queue_units": ("gauge", "Units of the distributed work queue in each state."),
+    "stage": ("gauge", "1 for the current stage of the process."),
+    "stage_seconds": ("gauge", "Time spent in each stage."),
+    "rss_bytes": ("gauge", "Resident memory of the process."),
+    "stage_peak_rss_bytes": ("gauge", "Highest resident memory sampled during each stage."),
+    "last_record_timestamp_seconds": ("gauge", "Unix time of the last datapoint created, to detect stalls."),
+    "start_timestamp_seconds": ("gauge", "Unix time of the start of the process metrics."),
+}
+
+
+def rss_bytes() -> int:
+    """Returns the resident memory of the process, from /proc on Linux, or its peak elsewhere."""
+    try:
+        with open("/proc/self/statm", "r") as f:
+            return int(f.read().split()[1]) * os.sysconf("SC_PAGE_SIZE")
+    except (OSError, ValueError):
+        import resource
+
+        return resource.getrusage(resource.RUSAGE_SELF).ru_maxrss * 1024
+
+
+def _format(value) -> str:
+    if isinstance(value, float) and not value.is_integer():
+        return {"inf": "+Inf", "-inf": "-Inf", "nan": "NaN"}.get(repr(value), repr(value))
+    return str(int(value))
+
+
+def _escape(value) -> str:
+    return str(value).replace("\\", "\\\\").replace("\n", "\\n").replace('"', '\\"')
+
+
+class Metrics:
+    """Progress and throughput metrics of the process, rendered in the Prometheus text format.
+
+    The metrics are class attributes, like `FoldPool`, so the parsers, the FoldPool and the folding backends update them
+    without being passed a handle. The counters only go up: the rates are `rate(rouskinhf_records_total[1m])` in
+    Prometheus, and `MetricsExporter` also computes them over its interval for the readers of the file. The resident
+    memory is sampled at each render and at the end of each stage.
+
+    Example:
+        >>> Metrics.reset()
+        >>> with Metrics.stage("read"):
+        ...     for sequence in ["ACGU", "GGAAACC"]:
+        ...         _ = Metrics.record(sequence)
+        ...     Metrics.inc("cache_hits_total", cache="checkpoint")
+        >>> Metrics.value("records_total", stage="read"), Metrics.value("bases_total", stage="read")
+        (2, 11)
+        >>> print("\\n".join(line for line in Metrics.render(job="my_dataset").splitlines() if line.startswith("rouskinhf_records")))
+        rouskinhf_records_total{job="my_dataset",stage="read"} 2
+    """
+
+    _lock = threading.Lock()
+    values = {}  # (name, ((label, value), ...)): value
+    current_stage = None
+    _stage_start = None
+    start_time = time.time()
+
+    @classmethod
+    def reset(cls) -> None:
+        with cls._lock:
+            cls.values = {}
+            cls.current_stage, cls._stage_start = None, None
+            cls.start_time = time.time()
+
+    @classmethod
+    def inc(cls, name: str, value: float = 1, **labels) -> None:
+        """Adds `value` to a counter."""
+        key = (name, tuple(sorted(labels.items())))
+        with cls._lock:
+            cls.values[key] = cls.values.get(key, 0) + value
+
+    @classmethod
+    def set(cls, name: str, value: float, **labels) -> None:
+        """Sets a gauge."""
+        with cls._lock:
+            cls.values[(name, tuple(sorted(labels.items())))] = value
+
+    @classmethod
+    def value(cls, name: str, **labels) -> float:
+        return cls.values.get((name, tuple(sorted(labels.items()))), 0)
+
+    @classmethod
+    def total(cls, name: str) -> float:
+        """Sum of a metric over its labels."""
+        with cls._lock:
+            return sum(v for (n, _), v in cls.values.items() if n == name)
+
+    @classmethod
+    def record(cls, sequence):
+        """Counts a datapoint (or its sequence) created in the current stage. Returns it, to wrap the parsers. None is not counted."""
+        if sequence is not None:
+            length = len(getattr(sequence, "sequence", sequence))
+            stage = cls.current_stage or "read"
+            key_records = ("records_total", (("stage", stage),))
+            key_bases = ("bases_total", (("stage", stage),))
+            now = time.time()
+            with cls._lock:
+                cls.values[key_records] = cls.values.get(key_records, 0) + 1
+                cls.values[key_bases] = cls.values.get(key_bases, 0) + length
+                cls.values[("last_record_timestamp_seconds", ())] = now
+        return sequence
+
+    @classmethod
+    @contextmanager
+    def stage(cls, name: str):
+        """Marks the code of the block as the stage `name`, e.g. 'read', 'filter' or 'write'. Stages can be nested."""
+        previous = cls.current_stage
+        if previous is not None:
+            cls._end_stage()
+        cls.current_stage, cls._stage_start = name, time.time()
+        cls.set("stage", 1, stage=name)
+        try:
+            yield
+        finally:
+            cls._end_stage()
+            cls.current_stage, cls._stage_start = previous, time.time() if previous else None
+            if previous is not None:
+                cls.set("stage", 1, stage=previous)
+
+    @classmethod
+    def _end_stage(cls):
+        stage = cls.current_stage
+        cls.inc("stage_seconds", time.time() - cls._stage_start, stage=stage)
+        cls._sample_rss()
+        cls.set("stage", 0, stage=stage)
+
+    @classmethod
+    def _sample_rss(cls):
+        rss = rss_bytes()
+        cls.set("rss_bytes", rss)
+        if cls.current_stage is not None:
+            peak = cls.value("stage_peak_rss_bytes", stage=cls.current_stage)
+            cls.set("stage_peak_rss_bytes", max(peak, rss), stage=cls.current_stage)
+
+    @classmethod
+    def render(cls, **labels) -> str:
+        """Returns the metrics in the Prometheus text format, with the constant `labels` (e.g. job) added to each sample."""
+        cls._sample_rss()
+        cls.set("start_timestamp_seconds", cls.start_time)
+        with cls._lock:
+            values = dict(cls.values)
+        if cls.current_stage is not None:  # the time in the current stage, so far
+            key = ("stage_seconds", (("stage", cls.current_stage),))
+            values[key] = values.get(key, 0) + time.time() - cls._stage_start
+        lines = []
+        for name, (kind, help) in METRICS.items():
+            samples = sorted((k[1], v) for k, v in values.items() if k[0] == name)
+            if not samples:
+                continue
+            lines.append(f"# HELP rouskinhf_{name} {help}")
+            lines.append(f"# TYPE rouskinhf_{name} {kind}")
+            for sample_labels, value in samples:
+                sample_labels = sorted(labels.items()) + list(sample_labels)
+                label_text = ",".join(f'{k}="{_escape(v)}"' for k, v in sample_labels)
+                lines.append(
+                    f"rouskinhf_{name}{{{label_text}}} {_format(value)}"
+                    if label_text
+                    else f"rouskinhf_{name} {_format(value)}"
+                )
+        return "\n".join(lines) + "\n"
+
+
+class MetricsExporter:
+    """Exports the `Metrics` of the process while a long job runs: to a Prometheus text file, rewritten every `interval`
+    seconds (e.g. for the textfile collector of the node exporter, or to `cat` on a batch host), and/or on a local HTTP
+    endpoint to be scraped.
+
+    The file is written to a temporary file and renamed, so a reader never sees a partial file. It is written a last time
+    when the exporter stops. If the port is already in use, e.g. by another job of the host, the endpoint is skipped with
+    a warning: the metrics never fail a job.
+
+    Args:
+        path (str, optional): Path of the metrics file. `{job}` is replaced by the job label. Defaults to no file.
+        port (int, optional): Port of the HTTP endpoint, on `host`. 0 picks a free port, see `self.port`. Defaults to no endpoint.
+        interval (float, optional): Seconds between two writes of the file. Defaults to 15.
+        host (str, optional): Address of the HTTP endpoint. Defaults to '127.0.0.1'.
+        **labels: Constant labels of the samples, e.g. job='my_dataset'.
+
+    Example:
+        >>> import tempfile, urllib.request
+        >>> path = os.path.join(tempfile.mkdtemp(), '{job}.prom')
+        >>> with MetricsExporter(path, port=0, interval=0.05, job='my_dataset') as exporter:
+        ...     _ = Metrics.record('ACGU')
+        ...     time.sleep(0.2)
+        ...     scraped = urllib.request.urlopen(f'http://127.0.0.1:{exporter.port}/metrics').read().decode()
+        >>> 'rouskinhf_records_per_second{job="my_dataset"}' in open(exporter.path).read()
+        True
+        >>> 'rouskinhf_rss_bytes{job="my_dataset"}' in scraped
+        True
+    """
+
+    def __init__(self, path: str = None, port: int = None, interval: float = 15, host: str = "127.0.0.1", **labels):
+        self.path = path.format(**labels) if path is not None else None
+        self.port = port
+        self.interval = interval
+        self.host = host
+        self.labels = labels
+        self._stop = threading.Event()
+        self._thread = None
+        self._server = None
+
+    @classmethod
+    def from_env(cls, **labels) -> "MetricsExporter":
+        """The exporter configured by `ROUSKINHF_METRICS_FILE` and `ROUSKINHF_METRICS_PORT`, see `Env`."""
+        return cls(Env.get_metrics_file(), Env.get_metrics_port(), **labels)
+
+    def write(self) -> None:
+        os.makedirs(os.path.dirname(os.path.abspath(self.path)), exist_ok=True)
+        with open(self.path + ".tmp", "w") as f:
+            f.write(Metrics.render(**self.labels))
+        os.replace(self.path + ".tmp", self.path)
+
+    def _rates(self, last, elapsed):
+        totals = {
+            name: Metrics.total(f"{name}_total") for name in ["records", "bases", "folds"]
+        }
+        if last is not None and elapsed > 0:
+            for name, total in totals.items():
+                Metrics.set(f"{name}_per_second", (total - last[name]) / elapsed)
+        return totals
+
+    def _loop(self):
+        last, last_time = self._rates(None, 0), time.time()
+        while not self._stop.wait(self.interval):
+            now = time.time()
+            last, last_time = self._rates(last, now - last_time), now
+            try:
+                self.write()
+            except OSError as e:
+                print(f"Metrics: could not write {self.path}: {e}")
+
+    def _serve(self):
+        from http.server import ThreadingHTTPServer, BaseHTTPRequestHandler
+
+        labels = self.labels
+
+        class Handler(BaseHTTPRequestHandler):
+            def do_GET(self):
+                body = Metrics.render(**labels).encode()
+                self.send_response(200)
+                self.send_header("Content-Type", "text/plain; version=0.0.4")
+                self.send_header("Content-Length", str(len(body)))
+                self.end_headers()
+                self.wfile.write(body)
+
+            def log_message(self, *args):
+                pass
+
+        try:
+            self._server = ThreadingHTTPServer((self.host, self.port), Handler)
+        except OSError as e:
+            print(f"Metrics: no HTTP endpoint on {self.host}:{self.port}: {e}")
+            return
+        self._server.daemon_threads = True
+        self.port = self._server.server_address[1]
+        threading.Thread(target=self._server.serve_forever, daemon=True).start()
+
+    def start(self) -> "MetricsExporter":
+        if self.port is not None:
+            self._serve()
+        if self.path is not None:
+            self._thread = threading.Thread(target=self._loop, daemon=True)
+            self._thread.start()
+        return self
+
+    def stop(self) -> None:
+        self._stop.set()
+        if self._thread is not None:
+            self._thread.join()
+            self.write()
+        if self._server is not None:
+            self._server.shutdown()
+            self._server.server_close()
+
+    def __enter__(self):
+        return self.start()
+
+    def __exit__(self, *args):
+        self.stop()
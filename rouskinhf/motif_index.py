@@ -0,0 +1,218 @@
+import itertools
+import numpy as np
+
+from .util import standardize_sequence
+from .near_duplicates import _BASE2CODE
+
+IUPAC = {
+    "A": "A",
+    "C": "C",
+    "G": "G",
+    "U": "U",
+    "R": "AG",
+    "Y": "CU",
+    "S": "CG",
+    "W": "AU",
+    "K": "GU",
+    "M": "AC",
+    "B": "CGU",
+    "D": "AGU",
+    "H": "ACU",
+    "V": "ACG",
+    "N": "ACGU",
+}
+
+
+class MotifIndex:
+    """k-mer inverted index over the sequences of a dataset, to find every occurence of a motif.
+
+    The sequences are concatenated into one array of base codes. For each of the 4^k k-mers, the index stores the sorted
+    list of positions where it occurs. A query looks up the rarest k-mer of the motif and only checks the remaining bases at
+    these positions, so its cost depends on the number of hits rather than on the size of the dataset.
+    Motifs can use the IUPAC nucleotide codes (e.g. `GNRA`).
+
+    Args:
+        references (list): References of the datapoints.
+        sequences (list): Standardized sequences of the datapoints.
+        k (int, optional): Length of the indexed k-mers. Defaults to 6.
+
+    Example:
+        >>> index = MotifIndex(['ref1', 'ref2'], ['UUGAAAUUGCGAUU', 'CCCGUGACCC'], k=3)
+        >>> index.search('GNRA')
+        [('ref1', 2), ('ref1', 8), ('ref2', 3)]
+        >>> index.search('CC')
+        [('ref2', 0), ('ref2', 1), ('ref2', 7), ('ref2', 8)]
+    """
+
+    def __init__(self, references=None, sequences=None, k: int = 6):
+        assert 0 < k <= 12, "k must be between 1 and 12"
+        self.k = k
+        if references is None:
+            return
+        sequences = [standardize_sequence(s) for s in sequences]
+        self.references = np.array(references, dtype=str)
+        lengths = np.array([len(s) for s in sequences], dtype=np.int64)
+        self.offsets = np.concatenate([[0], np.cumsum(lengths)])
+        self.codes = _BASE2CODE[
+            np.frombuffer("".join(sequences).encode("ascii"), dtype=np.uint8)
+        ]
+        self._build_postings()
+
+    def _build_postings(self):
+        k, codes = self.k, self.codes
+        if len(codes) < k:
+            kmers, positions = np.zeros(0, dtype=np.int64), np.zeros(0, dtype=np.int64)
+            valid = np.zeros(0, dtype=bool)
+        else:
+            kmers = np.zeros(len(codes) - k + 1, dtype=np.int64)
+            irregular = np.zeros(len(codes) - k + 1, dtype=bool)
+            for i in range(k):
+                window = codes[i : len(codes) - k + 1 + i]
+                kmers = (kmers << 2) | (window & 3)
+                irregular |= window > 3
+            # drop the k-mers that overlap two sequences or contain a non-regular base
+            valid = ~irregular
+            tails = self._tail_positions()
+            valid[tails[tails < len(kmers)]] = False
+            positions = np.where(valid)[0]
+            kmers = kmers[valid]
+        # small integer types let numpy use a radix sort
+        kmers = kmers.astype(np.uint16 if k <= 8 else np.uint32)
+        order = np.argsort(kmers, kind="stable")
+        dtype = np.uint32 if len(codes) < 2**32 else np.int64
+        self.postings = positions[order].astype(dtype)
+        # positions that start no indexed k-mer, checked by the motifs shorter than k
+        self.unindexed = np.concatenate(
+            [np.where(~valid)[0], np.arange(len(valid), len(codes))]
+        ).astype(dtype)
+        self.kmer_starts = np.concatenate(
+            [[0], np.cumsum(np.bincount(kmers, minlength=4**k))]
+        )
+
+    @classmethod
+    def from_dict(cls, data: dict, k: int = 6):
+        """Build the index of a dataset as returned by `get_dataset`."""
+        return cls(list(data.keys()), [d["sequence"] for d in data.values()], k=k)
+
+    def save(self, path: str) -> None:
+        """Save the index to a `.npz` file."""
+        with open(path, "wb") as f:
+            np.savez(
+                f,
+                k=self.k,
+                references=self.references,
+                offsets=self.offsets,
+                codes=self.codes,
+                postings=self.postings,
+                kmer_starts=self.kmer_starts,
+                unindexed=self.unindexed,
+            )
+
+    @classmethod
+    def load(cls, path: str):
+        """Load an index saved with `save`."""
+        arrays = np.load(path)
+        index = cls(k=int(arrays["k"]))
+        for attr in [
+            "references",
+            "offsets",
+            "codes",
+            "postings",
+            "kmer_starts",
+            "unindexed",
+        ]:
+            setattr(index, attr, arrays[attr])
+        return index
+
+    def _allowed(self, motif):
+        """Returns a (len(motif), 4) boolean table of the bases allowed at each position of the motif."""
+        motif = standardize_sequence(motif)
+        assert set(motif) <= set(IUPAC), f"Motif {motif} contains non-IUPAC characters."
+        allowed = np.zeros((len(motif), 4), dtype=bool)
+        for i, char in enumerate(motif):
+            for base in IUPAC[char]:
+                allowed[i, "ACGU".index(base)] = True
+        return allowed
+
+    def _window_codes(self, allowed_window):
+        """Returns the codes of all the sequences matching a window of the allowed table."""
+        codes = []
+        for combination in itertools.product(
+            *[np.where(row)[0] for row in allowed_window]
+        ):
+            code = 0
+            for base in combination:
+                code = (code << 2) | int(base)
+            codes.append(code)
+        return codes
+
+    def _kmer_positions(self, allowed_window):
+        """Returns the positions of all the k-mers matching a window of the allowed table."""
+        # a window shorter than k matches a contiguous range of k-mers
+        shift = 2 * (self.k - len(allowed_window))
+        ranges = [
+            self.postings[
+                self.kmer_starts[code << shift] : self.kmer_starts[(code + 1) << shift]
+            ]
+            for code in self._window_codes(allowed_window)
+        ]
+        return np.concatenate(ranges + [np.zeros(0, dtype=np.int64)]).astype(np.int64)
+
+    def _tail_positions(self):
+        """Returns the positions of the last k-1 bases of each sequence, which are not the start of any k-mer."""
+        ends = self.offsets[1:]
+        tail_lengths = np.minimum(np.diff(self.offsets), self.k - 1)
+        first = np.repeat(ends - tail_lengths, tail_lengths)
+        rank = np.arange(tail_lengths.sum()) - np.repeat(
+            np.cumsum(tail_lengths) - tail_lengths, tail_lengths
+        )
+        return first + rank
+
+    def find(self, motif: str):
+        """Returns every occurence of the motif as two arrays: the index of the datapoint and the offset in its sequence, sorted by position in the dataset."""
+        allowed = self._allowed(motif)
+        m = len(allowed)
+        if m == 0 or not len(self.codes):
+            return np.zeros(0, dtype=np.int64), np.zeros(0, dtype=np.int64)
+
+        if m >= self.k:
+            # anchor on the window with the fewest hits
+            windows = [allowed[w : w + self.k] for w in range(m - self.k + 1)]
+            sizes = [
+                (
+                    sum(
+                        [
+                            self.kmer_starts[code + 1] - self.kmer_starts[code]
+                            for code in self._window_codes(window)
+                        ]
+                    )
+                    if np.prod(window.sum(axis=1)) <= 256
+                    else np.inf
+                )
+                for window in windows
+            ]
+            w = int(np.argmin(sizes))
+            if sizes[w] == np.inf:  # too degenerate to use the index
+                starts = np.arange(len(self.codes), dtype=np.int64)
+            else:
+                starts = self._kmer_positions(windows[w]) - w
+        else:
+            starts = np.concatenate(
+                [self._kmer_positions(allowed), self.unindexed.astype(np.int64)]
+            )
+
+        starts = np.sort(starts)
+        starts = starts[starts >= 0]
+        record = np.searchsorted(self.offsets, starts, side="right") - 1
+        keep = starts + m <= self.offsets[record + 1]
+        starts, record = starts[keep], record[keep]
+        for j in range(m):
+            codes = self.codes[starts + j]
+            keep = (codes < 4) & allowed[j, codes & 3]
+            starts, record = starts[keep], record[keep]
+        return record, starts - self.offsets[record]
+
+    def search(self, motif: str) -> list:
+        """Returns every occurence of the motif as a list of (reference, offset in the sequence), sorted by position in the dataset."""
+        record, offsets = self.find(motif)
+        return list(zip(self.references[record].tolist(), offsets.tolist()))
@@ -0,0 +1,182 @@
+import hashlib
+import numpy as np
+
+_BASE2CODE = np.full(256, 255, dtype=np.uint8)
+for _code, _base in enumerate("ACGU"):
+    _BASE2CODE[ord(_base)] = _code
+
+
+class MinHashLSH:
+    """Cluster near-identical sequences with k-mer MinHash signatures and locality-sensitive hashing (LSH).
+
+    Each sequence is shingled into its k-mers, and the k-mers are hashed by `num_perm` universal hash functions.
+    The minimum of each hash function is the MinHash signature of the sequence. Two sequences with a k-mer
+    Jaccard similarity `s` share a signature band of `rows = num_perm // bands` values with probability `s ** rows`,
+    so grouping the sequences band by band only compares sequences that are likely to be similar. The whole
+    pipeline is sort-based and runs in O(n log n) time instead of the O(n^2) of a pairwise comparison.
+
+    Args:
+        k (int, optional): Length of the k-mers. Defaults to 8.
+        num_perm (int, optional): Number of hash functions. Defaults to 64.
+        bands (int, optional): Number of LSH bands. Must divide `num_perm`. Defaults to 16.
+        seed (int, optional): Seed of the hash functions. Defaults to 0.
+
+    Example:
+        >>> lsh = MinHashLSH(k=4)
+        >>> lsh.cluster(['ACGUACGUAAGGCCUU', 'ACGUACGUAAGGCCUA', 'GGGGCCCCAAAAUUUU', 'ACGUACGUAAGGCCUU'])
+        array([0, 0, 2, 0])
+        >>> MinHashLSH(k=12).cluster(['ACGUACGUA', 'GGGGCCCCAAAAUUUU', 'ACGUACGUA', 'ACGUACGUU'])  # shorter than k
+        array([0, 1, 0, 3])
+    """
+
+    def __init__(self, k: int = 8, num_perm: int = 64, bands: int = 16, seed: int = 0):
+        assert 0 < k <= 31, "k must be between 1 and 31"
+        assert num_perm % bands == 0, "bands must divide num_perm"
+        self.k = k
+        self.num_perm = num_perm
+        self.bands = bands
+        self.rows = num_perm // bands
+        rng = np.random.default_rng(seed)
+        # multiply-shift hashing: h(x) = (a * x + b) >> 32 with a odd, computed modulo 2^64
+        self._a = rng.integers(1, 2**63, size=num_perm, dtype=np.uint64) | np.uint64(1)
+        self._b = rng.integers(0, 2**63, size=num_perm, dtype=np.uint64)
+
+    def _kmers(self, sequences):
+        """Returns the k-mer codes of a batch of sequences and the index of the sequence of each k-mer.
+
+        Sequences shorter than k are represented by a single shingle made of the whole sequence.
+        """
+        lengths = np.array([len(s) for s in sequences], dtype=np.int64)
+        codes = _BASE2CODE[
+            np.frombuffer("".join(sequences).encode("ascii"), dtype=np.uint8)
+        ].astype(np.uint64)
+        codes[codes == 255] = 0  # non-regular characters are filtered upstream
+        starts = np.concatenate([[0], np.cumsum(lengths)[:-1]])
+        seq_idx = np.repeat(np.arange(len(sequences)), lengths)
+
+        k = self.k
+        if len(codes) >= k:
+            kmers = np.zeros(len(codes) - k + 1, dtype=np.uint64)
+            for i in range(k):
+                kmers = (kmers << np.uint64(2)) | codes[i : len(codes) - k + 1 + i]
+            kmer_seq_idx = seq_idx[: len(kmers)]
+            # drop the k-mers that overlap two sequences
+            valid = np.arange(len(kmers)) + k <= (starts + lengths)[kmer_seq_idx]
+            kmers, kmer_seq_idx = kmers[valid], kmer_seq_idx[valid]
+        else:
+            kmers = np.zeros(0, dtype=np.uint64)
+            kmer_seq_idx = np.zeros(0, dtype=np.int64)
+
+        # short sequences: one shingle per sequence, its 64-bit hash (any k-mer is below 4 ** k <= 2 ** 62)
+        short = np.where(lengths < k)[0]
+        if len(short):
+            short_kmers = np.array(
+                [
+                    int.from_bytes(
+                        hashlib.blake2b(sequences[i].encode("ascii"), digest_size=8).digest(),
+                        "little",
+                    )
+                    for i in short
+                ],
+                dtype=np.uint64,
+            )
+            kmers = np.concatenate([kmers, short_kmers])
+            kmer_seq_idx = np.concatenate([kmer_seq_idx, short])
+        return kmers, kmer_seq_idx
+
+    def signatures(self, sequences, batch_size: int = 2**16) -> np.ndarray:
+        """Returns the MinHash signatures of the sequences as an array of shape (len(sequences), num_perm).
+
+        Args:
+            sequences (list): List of standardized sequences.
+            batch_size (int, optional): Number of k-mers hashed at once. Bounds the memory usage. Defaults to 2**16.
+        """
+        sequences = list(sequences)
+        signatures = np.full(
+            (len(sequences), self.num_perm), np.iinfo(np.uint32).max, dtype=np.uint32
+        )
+        if not len(sequences):
+            return signatures
+        kmers, kmer_seq_idx = self._kmers(sequences)
+        order = np.argsort(kmer_seq_idx, kind="stable")
+        kmers, kmer_seq_idx = kmers[order], kmer_seq_idx[order]
+        for start in range(0, len(kmers), batch_size):
+            batch = kmers[start : start + batch_size]
+            batch_idx = kmer_seq_idx[start : start + batch_size]
+            hashes = (
+                (self._a[:, None] * batch[None, :] + self._b[:, None]) >> np.uint64(32)
+            ).astype(np.uint32)
+            # the k-mers are sorted by sequence, so the minimum is a segmented reduction
+            ids, segment_starts = np.unique(batch_idx, return_index=True)
+            signatures[ids] = np.minimum(
+                signatures[ids], np.minimum.reduceat(hashes, segment_starts, axis=1).T
+            )
+        return signatures
+
+    def cluster(self, sequences, threshold: float = 0.0) -> np.ndarray:
+        """Returns a cluster id per sequence. The cluster id is the index of the first sequence of the cluster.
+
+        Args:
+            sequences (list): List of standardized sequences.
+            threshold (float, optional): Minimum estimated Jaccard similarity between a sequence and the first sequence of its LSH bucket to join the cluster. Defaults to 0.0, i.e. any LSH collision joins the cluster.
+        """
+        signatures = self.signatures(sequences)
+        parents = list(range(len(signatures)))
+
+        def find(i):
+            while parents[i] != i:
+                parents[i] = parents[parents[i]]
+                i = parents[i]
+            return i
+
+        for band in range(self.bands):
+            band_signatures = np.ascontiguousarray(
+                signatures[:, band * self.rows : (band + 1) * self.rows]
+            )
+            _, first, inverse = np.unique(
+                band_signatures.view(np.dtype((np.void, 4 * self.rows))).ravel(),
+                return_index=True,
+                return_inverse=True,
+            )
+            members = np.where(first[inverse] != np.arange(len(signatures)))[0]
+            leaders = first[inverse[members]]
+            if threshold > 0:
+                similarity = np.mean(signatures[members] == signatures[leaders], axis=1)
+                keep = similarity >= threshold
+                members, leaders = members[keep], leaders[keep]
+            for member, leader in zip(members.tolist(), leaders.tolist()):
+                root_member, root_leader = find(member), find(leader)
+                if root_member != root_leader:
+                    # the smallest index is the root, so that the first occurence represents the cluster
+                    parents[max(root_member, root_leader)] = min(
+                        root_member, root_leader
+                    )
+
+        return np.array([find(i) for i in range(len(parents))], dtype=np.int64)
+
+
+def near_duplicate_clusters(
+    references, sequences, threshold: float = 0.8, **kwargs
+) -> dict:
+    """Groups near-identical sequences together.
+
+    Args:
+        references (list): References of the sequences.
+        sequences (list): Standardized sequences.
+        threshold (float, optional): Minimum estimated k-mer Jaccard similarity within a cluster. Defaults to 0.8.
+        **kwargs: Passed to `MinHashLSH`.
+
+    Returns:
+        dict: {reference of the first sequence of the cluster: [references of the other sequences of the cluster]}, for clusters of at least two sequences.
+
+    Example:
+        >>> near_duplicate_clusters(['ref1', 'ref2', 'ref3'], ['ACGUACGUAAGGCCUUAGCA', 'ACGUACGUAAGGCCUUAGCU', 'GGGGCCCCAAAAUUUUACGU'], k=4)
+        {'ref1': ['ref2']}
+    """
+    references = list(references)
+    cluster_ids = MinHashLSH(**kwargs).cluster(sequences, threshold=threshold)
+    clusters = {}
+    for idx, cluster_id in enumerate(cluster_ids):
+        if idx != cluster_id:
+            clusters.setdefault(references[cluster_id], []).append(references[idx])
+    return clusters
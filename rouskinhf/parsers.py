@@ -1,22 +1,120 @@
 import os, json
 import numpy as np
-from .rnastructure import RNAstructure
-from .util import DreemUtils
-import pandas as pd
+from .folding import get_backend
+from .util import DreemUtils, open_dataset, is_compressed
+
+
+def _read_lines(path):
+    with open(path, "r") as f:
+        return f.readlines()
+
+
+def _iter_members(file_or_folder, extension):
+    """Yields the (path, read) of the files of `iter_files`, where `read()` returns the lines of the file.
+    The contents of a tar archive can only be read before moving to the next member."""
+    if isinstance(file_or_folder, list):
+        for path in file_or_folder:
+            yield path, lambda path=path: _read_lines(path)
+        return
+
+    if os.path.isdir(file_or_folder):
+        for root, _, files in os.walk(file_or_folder):
+            for name in files:
+                if name.endswith(extension) and not name.startswith("._"):
+                    path = os.path.join(root, name)
+                    yield path, lambda path=path: _read_lines(path)
+        return
+
+    import tarfile, zipfile
+
+    if zipfile.is_zipfile(file_or_folder):
+        with zipfile.ZipFile(file_or_folder) as archive:
+            for member in archive.infolist():
+                name = os.path.basename(member.filename)
+                if name.endswith(extension) and not name.startswith("._"):
+                    yield member.filename, lambda member=member: archive.read(
+                        member
+                    ).decode().splitlines(True)
+        return
+
+    # decompress with open_dataset, which is faster than the stream reader of tarfile and supports .tar.zst
+    with open_dataset(file_or_folder, "rb") as f, tarfile.open(
+        fileobj=f, mode="r|"
+    ) as archive:
+        for member in archive:
+            name = os.path.basename(member.name)
+            if (
+                member.isfile()
+                and name.endswith(extension)
+                and not name.startswith("._")
+            ):
+                yield member.name, lambda member=member: archive.extractfile(
+                    member
+                ).read().decode().splitlines(True)
+
+
+def list_files(file_or_folder, extension):
+    """Returns the paths of the files of `iter_files`, without reading their contents."""
+    return [path for path, _ in _iter_members(file_or_folder, extension)]
+
+
+def iter_files(file_or_folder, extension, subset=None):
+    """Yields the (path, lines) of the files with this extension in a folder, recursively, or in a .tar, .tar.gz, .tar.zst or .zip archive.
+    `file_or_folder` can also be a list of files.
+
+    `subset` selects the files by the range (start, end) of their indices, or by a list of their paths (see `list_files`).
+    Only the selected files are read, and the iteration stops after the last of them.
+    Tar archives are read in a single streaming pass, without extracting them to disk.
+
+    Example:
+        >>> import tempfile, tarfile
+        >>> archive = os.path.join(tempfile.mkdtemp(), 'corpus.tar.gz')
+        >>> with tarfile.open(archive, 'w:gz') as tar:
+        ...     tar.add('data/input_files_for_testing/test_ct_files', arcname='corpus')
+        >>> sorted(path for path, _ in iter_files(archive, '.ct'))
+        ['corpus/duplicate1.ct', 'corpus/duplicate2.ct', 'corpus/this_bad_example.ct', 'corpus/this_ct_example.ct', 'corpus/this_other_ct.ct']
+        >>> paths = list_files(archive, '.ct')
+        >>> [path for path, _ in iter_files(archive, '.ct', [1, 3])] == paths[1:3]
+        True
+        >>> [path for path, _ in iter_files(archive, '.ct', paths[3:])] == paths[3:]
+        True
+    """
+    if subset is None:
+        for path, read in _iter_members(file_or_folder, extension):
+            yield path, read()
+        return
+    if len(subset) == 2 and all(isinstance(bound, int) for bound in subset):
+        start, end = subset
+        selected = lambda idx, path: start <= idx < end
+        n_selected = max(0, end - start)
+    else:
+        paths = set(subset)
+        selected = lambda idx, path: path in paths
+        n_selected = len(paths)
+    if not n_selected:
+        return
+    for idx, (path, read) in enumerate(_iter_members(file_or_folder, extension)):
+        if selected(idx, path):
+            yield path, read()
+            n_selected -= 1
+            if not n_selected:
+                return
 
 
 class Ct:
-    def parse(ct_file):
+    def parse(ct_file, lines=None):
         """Parse a ct file and return the sequence and structure
 
         Args:
             ct_file (str): path to ct file
+            lines (list, optional): lines of the ct file, if it was already read (e.g. from an archive)
 
         Returns:
             (str,str,str): (reference, sequence, structure)
         """
-        with open(ct_file, "r") as f:
-            lines = f.readlines()
+        if lines is None:
+            with open(ct_file, "r") as f:
+                lines = f.readlines()
 
         structure, sequence = [], ""
         for line in lines[1:]:
@@ -48,29 +146,58 @@ class Ct:
         """Parse a list of ct files and return the sequences and structures"""
         return [Ct.parse(ct_file) for ct_file in ct_files]
 
+    def format(reference, sequence, structure):
+        """Returns the content of the ct file of a sequence and its structure (0-indexed pairs), the inverse of `parse`.
+
+        Example:
+            >>> text = Ct.format('ref', 'GGAAACC', [[0, 6], [1, 5]])
+            >>> print(text, end='')
+                7  ref
+                1 G     0     2     7     1
+                2 G     1     3     6     2
+                3 A     2     4     0     3
+                4 A     3     5     0     4
+                5 A     4     6     0     5
+                6 C     5     7     2     6
+                7 C     6     0     1     7
+            >>> Ct.parse('ref.ct', text.splitlines(True))
+            ('ref', 'GGAAACC', [[0, 6], [1, 5]])
+        """
+        n = len(sequence)
+        partner = [0] * (n + 2)
+        for i, j in structure:
+            partner[i + 1], partner[j + 1] = j + 1, i + 1
+        lines = [f"{n:5d}  {reference}"]
+        lines += [
+            f"{i:5d} {base} {i - 1:5d} {i + 1 if i < n else 0:5d} {partner[i]:5d} {i:5d}"
+            for i, base in enumerate(sequence, 1)
+        ]
+        return "\n".join(lines) + "\n"
+
     def get_reference_from_title(ct_file):
         return '_'.join(os.path.basename(ct_file).split(".")[:-1])
 
     def predict_dms(ct_file):
         """Predict the dms of a ct file using RNAstructure"""
-        rna = RNAstructure()
-        return rna.predictPairingProbability(Ct.parse(ct_file)[1])
+        return get_backend().predict_pairing_probability(Ct.parse(ct_file)[1])
 
 
 class BPseq:
-    def parse(bpseq_file):
+    def parse(bpseq_file, lines=None):
         """Parse a bpseq file and return the sequence and structure
 
         Args:
             bpseq_file (str): path to bpseq file
+            lines (list, optional): lines of the bpseq file, if it was already read (e.g. from an archive)
 
         Returns:
             (str,str,str): (reference, sequence, structure)
 
 
         """
-        with open(bpseq_file, "r") as f:
-            lines = f.readlines()
+        if lines is None:
+            with open(bpseq_file, "r") as f:
+                lines = f.readlines()
 
         structure, sequence = [], ""
         for line in lines:
@@ -102,44 +229,193 @@ class BPseq:
         """Parse a list of ct files and return the sequences and structures"""
         return [BPseq.parse(bpseq_file) for bpseq_file in bpseq_files]
 
+    def format(reference, sequence, structure):
+        """Returns the content of the bpseq file of a sequence and its structure (0-indexed pairs), the inverse of `parse`.
+        The reference is not stored in the file, but in its name.
+
+        Example:
+            >>> text = BPseq.format('ref', 'GAAAC', [[0, 4]])
+            >>> print(text, end='')
+            1 G 5
+            2 A 0
+            3 A 0
+            4 A 0
+            5 C 1
+            >>> BPseq.parse('ref.bpseq', text.splitlines(True))
+            ('ref', 'GAAAC', [[0, 4]])
+        """
+        partner = [0] * (len(sequence) + 2)
+        for i, j in structure:
+            partner[i + 1], partner[j + 1] = j + 1, i + 1
+        return "".join(
+            f"{i} {base} {partner[i]}\n" for i, base in enumerate(sequence, 1)
+        )
+
     def get_reference_from_title(bpseq_file):
         return os.path.basename(bpseq_file).split(".")[0]
 
     def predict_dms(bpseq_file):
         """Predict the dms of a ct file using RNAstructure"""
-        rna = RNAstructure()
-        return rna.predictPairingProbability(BPseq.parse(bpseq_file)[1])
+        return get_backend().predict_pairing_probability(BPseq.parse(bpseq_file)[1])
 
 
 class Fasta:
-    def parse(fasta_file):
-        """Parse a fasta file and return the references and sequences"""
-        refs, seqs = [], []
-        with open(fasta_file, "r") as f:
-            for line in f.readlines():
-                if line[0] == ">":
-                    refs.append(line[1:].strip())
-                else:
-                    seqs.append(line.strip())
-        assert len(refs) == len(
-            seqs
-        ), "The number of references and sequences in the fasta file must be the same ({} vs {})".format(
-            len(refs), len(seqs)
-        )
-        return seqs, refs
+    """Streaming fasta reader. The records can span several lines, and the file can be compressed (see `util.open_dataset`).
+
+    An uncompressed file can be indexed in a `.fai` file (samtools format: name, length, offset, line bases, line width)
+    to fetch records at random, and split into byte ranges that start on a record, to be parsed by parallel workers.
+
+    Example:
+        >>> import tempfile
+        >>> fasta_file = os.path.join(tempfile.mkdtemp(), 'test.fasta')
+        >>> _ = open(fasta_file, 'w').write('>ref1\\nACGU\\nAC\\n>ref2\\nGGGG\\n\\n>ref3\\nUUUUCC\\n')
+        >>> list(Fasta.parse(fasta_file))
+        [('ref1', 'ACGUAC'), ('ref2', 'GGGG'), ('ref3', 'UUUUCC')]
+        >>> Fasta.build_index(fasta_file)
+        [('ref1', 6, 6, 4, 5), ('ref2', 4, 20, 4, 5), ('ref3', 6, 32, 6, 7)]
+        >>> Fasta.fetch(fasta_file, 'ref2')
+        'GGGG'
+        >>> ranges = Fasta.split(fasta_file, 2)
+        >>> ranges
+        [(0, 26), (26, 39)]
+        >>> [list(Fasta.parse(fasta_file, start, end)) for start, end in ranges]
+        [[('ref1', 'ACGUAC'), ('ref2', 'GGGG')], [('ref3', 'UUUUCC')]]
+    """
+
+    def parse(fasta_file, start=0, end=None):
+        """Yields the (reference, sequence) of the records whose header starts in the byte range [start, end).
+        `start` must be the start of a record, e.g. a bound returned by `Fasta.split`. Uses constant memory."""
+        if start or end is not None:
+            assert not is_compressed(
+                fasta_file
+            ), "Byte ranges are not supported for compressed fasta files"
+        with open_dataset(fasta_file, "rb") as f:
+            if start:
+                f.seek(start)
+            offset, reference, sequence = start, None, []
+            for line in f:
+                if line.startswith(b">"):
+                    if reference is not None:
+                        yield reference, b"".join(sequence).decode()
+                    if end is not None and offset >= end:
+                        return
+                    reference, sequence = line[1:].strip().decode(), []
+                elif reference is not None:
+                    sequence.append(line.strip())
+                offset += len(line)
+            if reference is not None:
+                yield reference, b"".join(sequence).decode()
+
+    def _index_range(fasta_file, start=0, end=None):
+        """Returns the .fai entries of the records whose header starts in the byte range [start, end)."""
+        entries = []
+        with open(fasta_file, "rb") as f:
+            f.seek(start)
+            offset = start
+            for line in f:
+                if line.startswith(b">"):
+                    if end is not None and offset >= end:
+                        break
+                    entries.append([line[1:].strip().decode(), 0, offset + len(line), 0, 0])
+                elif entries:
+                    bases = len(line.rstrip())
+                    if bases and not entries[-1][3]:
+                        entries[-1][3], entries[-1][4] = bases, len(line)
+                    entries[-1][1] += bases
+                offset += len(line)
+        return [tuple(entry) for entry in entries]
+
+    def get_index(fasta_file):
+        """Returns the path to the .fai index of a fasta file."""
+        return fasta_file + ".fai"
+
+    def build_index(fasta_file, n_workers=1):
+        """Index an uncompressed fasta file, write the index to `<fasta_file>.fai` and return its entries.
+        The file is split in `n_workers` byte ranges indexed in parallel."""
+        assert not is_compressed(fasta_file), "Compressed fasta files can't be indexed"
+        ranges = Fasta.split(fasta_file, n_workers)
+        if n_workers > 1:
+            from concurrent.futures import ProcessPoolExecutor
+
+            with ProcessPoolExecutor(max_workers=n_workers) as executor:
+                parts = list(
+                    executor.map(
+                        Fasta._index_range,
+                        [fasta_file] * len(ranges),
+                        *zip(*ranges),
+                    )
+                )
+        else:
+            parts = [Fasta._index_range(fasta_file, *bounds) for bounds in ranges]
+        entries = [entry for part in parts for entry in part]
+        with open(Fasta.get_index(fasta_file), "w") as f:
+            for entry in entries:
+                f.write("\t".join([str(field) for field in entry]) + "\n")
+        return entries
+
+    def load_index(fasta_file):
+        """Returns the .fai index of a fasta file as {reference: offset of the sequence}, building it if needed."""
+        if not os.path.exists(Fasta.get_index(fasta_file)) or os.path.getmtime(
+            Fasta.get_index(fasta_file)
+        ) < os.path.getmtime(fasta_file):
+            Fasta.build_index(fasta_file)
+        index = {}
+        with open(Fasta.get_index(fasta_file), "r") as f:
+            for line in f:
+                name, _, offset, _, _ = line.rstrip("\n").split("\t")
+                index[name] = int(offset)
+        return index
+
+    def fetch(fasta_file, reference, index=None):
+        """Returns the sequence of a record, read at its offset in the .fai index."""
+        if index is None:
+            index = Fasta.load_index(fasta_file)
+        sequence = []
+        with open(fasta_file, "rb") as f:
+            f.seek(index[reference])
+            for line in f:
+                if line.startswith(b">"):
+                    break
+                sequence.append(line.strip())
+        return b"".join(sequence).decode()
+
+    def split(fasta_file, n_parts):
+        """Returns `n_parts` (or fewer) contiguous byte ranges (start, end) of an uncompressed fasta file, each starting on a record."""
+        size = os.path.getsize(fasta_file)
+        bounds = [0]
+        with open(fasta_file, "rb") as f:
+            for i in range(1, n_parts):
+                f.seek(max(size * i // n_parts - 1, bounds[-1]))
+                position = f.tell()
+                while True:
+                    chunk = f.read(1 << 16)
+                    found = chunk.find(b"\n>")
+                    if found >= 0:
+                        bounds.append(position + found + 1)
+                        break
+                    if len(chunk) < (1 << 16):
+                        bounds.append(size)
+                        break
+                    # keep the last byte in case "\n>" spans two chunks
+                    position += len(chunk) - 1
+                    f.seek(position)
+        bounds.append(size)
+        return [(a, b) for a, b in zip(bounds[:-1], bounds[1:]) if a < b]
 
     def get_name(fasta_file):
         return os.path.basename(fasta_file).split(".")[0]
 
+    def format(reference, sequence, structure=None):
+        """Returns the fasta record of a sequence, the inverse of `parse`. The structure is not stored."""
+        return f">{reference}\n{sequence}\n"
+
     def predict_structure(sequence):
         """Predict the structure of a sequence using RNAstructure"""
-        rna = RNAstructure()
-        return rna.predictStructure(sequence)
+        return get_backend().predict_structure(sequence)
 
     def predict_dms(sequence):
         """Predict the dms of a sequence using RNAstructure"""
-        rna = RNAstructure()
-        return rna.predictPairingProbability(sequence)
+        return get_backend().predict_pairing_probability(sequence)
 
 
 class DreemOutput:
@@ -148,12 +424,13 @@ class DreemOutput:
 
         Args:
             dreem_output_file (str): path to dreem output file
-            drop_duplicates (bool): drop duplicate sequences
-            max_mut (float): drop sequences with at least one mutation > max_mut
+
+        The sequences are filtered by `convert`, e.g. `filter={'max_mutation_rate': 0.3, 'deduplicate': 'sequence'}`.
 
         Returns:
             (str,str,str): (reference, sequence, sub_rate)
         """
+        import pandas as pd
 
         df = pd.DataFrame(
             DreemUtils.flatten_json(
@@ -161,13 +438,5 @@ class DreemOutput:
             )
         )[["reference", "sequence", "sub_rate"]]
 
-        # df['max_mut'] = df.sub_rate.apply(lambda x: max(x))
-        # len_before = len(df)
-        # df = df[df.max_mut < max_mut].reset_index(drop=True)
-
-        # len_before = len(df)
-        # if drop_duplicates:
-        #     df.drop_duplicates(subset='sequence', inplace=True)
-
         for _, row in df.iterrows():
             yield row["reference"], row["sequence"], row["sub_rate"]
@@ -1,6 +1,7 @@
 from os.path import join
 import os
 from .env import Env
+from .util import DATA_JSON_EXTENSIONS
 
 
 class Path:
@@ -37,6 +38,9 @@ class Path:
         if force:
             self.clear()
         os.system(f"mkdir -p {self.get_main_folder()}")
+        # the dataset is written locally, so it isn't a download of the hub anymore, see `DatasetCache`
+        if os.path.exists(self.get_cache_entry()):
+            os.remove(self.get_cache_entry())
 
     def clear(self):
         """Clears the data folder."""
@@ -53,9 +57,17 @@ class Path:
         """Returns the path to the main folder."""
         return join(self.get_data_folder(), self.name)
 
-    def get_data_json(self) -> str:
-        """Returns the path to the data.json file."""
-        return join(self.get_main_folder(), "data.json")
+    def get_data_json(self, compression: str = None) -> str:
+        """Returns the path to the data.json file, compressed with `compression` ('gzip' or 'zstd') if given.
+        Without `compression`, returns the compressed file if it is the only one that exists."""
+        path = join(self.get_main_folder(), "data.json")
+        if compression is not None:
+            return path + DATA_JSON_EXTENSIONS[compression]
+        if not os.path.exists(path):
+            for extension in DATA_JSON_EXTENSIONS.values():
+                if os.path.exists(path + extension):
+                    return path + extension
+        return path
 
     def get_card(self) -> str:
         """Returns the path to the README.md file."""
@@ -64,3 +76,51 @@ class Path:
     def get_conversion_report(self) -> str:
         """Returns the path to the conversion report file."""
         return join(self.get_main_folder(), "conversion_report.txt")
+
+    def get_near_duplicates(self) -> str:
+        """Returns the path to the near-duplicate clusters file."""
+        return join(self.get_main_folder(), "near_duplicates.json")
+
+    def get_quality_scores(self) -> str:
+        """Returns the path to the per-datapoint quality scores of the last filtering, see `filter.QualityScores`."""
+        return join(self.get_main_folder(), "quality_scores.npz")
+
+    def get_filtered_out(self, compression: str = None) -> str:
+        """Returns the path to the datapoints filtered out of data.json, see `filter.refilter`. Like `get_data_json`, without
+        `compression`, returns the compressed file if it is the only one that exists."""
+        path = join(self.get_main_folder(), "filtered_out.json")
+        if compression is not None:
+            return path + DATA_JSON_EXTENSIONS[compression]
+        if not os.path.exists(path):
+            for extension in DATA_JSON_EXTENSIONS.values():
+                if os.path.exists(path + extension):
+                    return path + extension
+        return path
+
+    def get_motif_index(self) -> str:
+        """Returns the path to the motif search index file."""
+        return join(self.get_main_folder(), "motif_index.npz")
+
+    def get_checkpoint(self) -> str:
+        """Returns the path to the checkpoint journal of an ongoing conversion."""
+        return join(self.get_main_folder(), "checkpoint.jsonl")
+
+    def get_content_hashes(self) -> str:
+        """Returns the path to the {reference: content hash} manifest of data.json, see `content_hashes.diff_datasets`."""
+        return join(self.get_main_folder(), "content_hashes.json")
+
+    def get_work_queue(self) -> str:
+        """Returns the path to the work queue of a distributed conversion, see `WorkQueue`."""
+        return join(self.get_main_folder(), "queue")
+
+    def get_record_log(self) -> str:
+        """Returns the path to the append-only log of the changes to data.json, see `RecordLog`."""
+        return join(self.get_main_folder(), "data.log.jsonl")
+
+    def get_download_lock(self) -> str:
+        """Returns the path to the lock of the download of the dataset, next to its folder so that it survives a `clear`."""
+        return join(self.get_data_folder(), f".{self.name}.download.lock")
+
+    def get_cache_entry(self) -> str:
+        """Returns the path to the record of the download of the dataset, see `DatasetCache`."""
+        return join(self.get_main_folder(), "cache_entry.json")
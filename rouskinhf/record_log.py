@@ -0,0 +1,185 @@
+import os
+import json
+import fcntl
+import threading
+from contextlib import contextmanager
+
+import numpy as np
+
+from .path import Path
+from .sequence_index import SequenceIndex
+from .content_hashes import write_content_hashes
+from .util import load_json, dump_json, quantize_signals, dequantize_signals
+
+
+class RecordLog:
+    """Append-only log of the changes to a dataset, next to its `data.json` (the base file).
+
+    Each line of the log is one operation, applied in order on top of the base file:
+        - `["put", reference, attributes]`: add a datapoint, or replace the one with the same reference
+        - `["delete", reference]`: remove a datapoint (tombstone)
+        - `["rename", reference, new_reference]`: rename a datapoint. A renamed datapoint moves to the end of the dataset.
+
+    Appending only writes the new operations, and `get_dataset` reads the base file plus the log. `compact` folds the log
+    into the base file. A line truncated by a crash is skipped. The log is locked with `flock`, so that several processes
+    can append, read and compact the same dataset.
+
+    Args:
+        name (str): Name of the dataset.
+        path (str, optional): Path to the data folder. Defaults to 'data'.
+
+    Example:
+        >>> import tempfile
+        >>> root = tempfile.mkdtemp()
+        >>> dump_json({'ref1': {'sequence': 'AACCGG'}, 'ref2': {'sequence': 'AUGGC'}}, os.path.join(root, 'my_dataset', 'data.json'))
+        >>> log = RecordLog('my_dataset', path=root)
+        >>> log.append({'ref3': {'sequence': 'GGGAAACCC', 'dms': np.array([0.1, 0.2, 0.0, 0.5, 0.9, 1.0, 0.0, 0.0, 0.1])}})
+        >>> log.delete(['ref1'])
+        >>> log.rename('ref2', 'ref2_renamed')
+        >>> log.read()
+        {'ref3': {'sequence': 'GGGAAACCC', 'dms': [0.1, 0.2, 0.0, 0.5, 0.9, 1.0, 0.0, 0.0, 0.1]}, 'ref2_renamed': {'sequence': 'AUGGC'}}
+        >>> log.compact()
+        >>> load_json(os.path.join(root, 'my_dataset', 'data.json')) == log.read(), os.path.getsize(log.path)
+        (True, 0)
+    """
+
+    def __init__(self, name: str, path: str = "data"):
+        self.name = name
+        self.root = path
+        self._path = Path(name=name, root=path)
+        self.path = self._path.get_record_log()
+
+    @contextmanager
+    def _lock(self, operation, suffix=".lock"):
+        os.makedirs(os.path.dirname(self.path), exist_ok=True)
+        with open(self.path + suffix, "a") as lock:
+            fcntl.flock(lock, operation)
+            try:
+                yield
+            finally:
+                fcntl.flock(lock, fcntl.LOCK_UN)
+
+    def _write(self, operations) -> None:
+        lines = [json.dumps(operation) + "\n" for operation in operations]
+        with self._lock(fcntl.LOCK_EX), open(self.path, "ab+") as f:
+            f.seek(0, os.SEEK_END)
+            if f.tell():
+                f.seek(-1, os.SEEK_END)
+                if f.read(1) != b"\n":
+                    f.write(b"\n")  # isolate a line truncated by a crash
+            f.write("".join(lines).encode("utf-8"))
+            f.flush()
+            os.fsync(f.fileno())
+
+    def append(self, datapoints, quantize: bool = False) -> None:
+        """Append datapoints to the dataset. An existing datapoint with the same reference is replaced.
+
+        Args:
+            datapoints (dict or iterable): Either a `{reference: attributes}` dict, like in `data.json`, or an iterable of Datapoint.
+            quantize (bool, optional): Whether to store the dms and shape signals as uint16 fixed-point. Defaults to False.
+        """
+        if isinstance(datapoints, dict):
+            items = datapoints.items()
+        else:
+            items = (datapoint.to_dict() for datapoint in datapoints)
+        operations = []
+        for reference, attr in items:
+            attr = {
+                k: v.tolist() if isinstance(v, np.ndarray) else v
+                for k, v in attr.items()
+                if v is not None and not (type(v) == float and np.isnan(v))
+            }
+            if quantize:
+                attr = quantize_signals(attr)
+            operations.append(["put", reference, attr])
+        self._write(operations)
+
+    def delete(self, references: list) -> None:
+        """Remove datapoints from the dataset."""
+        self._write([["delete", reference] for reference in references])
+
+    def rename(self, reference: str, new_reference: str) -> None:
+        """Rename a datapoint of the dataset."""
+        self._write([["rename", reference, new_reference]])
+
+    def _read_operations(self, size=None):
+        if not os.path.exists(self.path):
+            return
+        with open(self.path, "rb") as f:
+            data = f.read() if size is None else f.read(size)
+        for line in data.split(b"\n"):
+            try:
+                yield json.loads(line)
+            except json.JSONDecodeError:
+                continue  # empty or truncated by a crash
+
+    @staticmethod
+    def apply_operations(data: dict, operations) -> dict:
+        """Apply log operations on a `{reference: attributes}` dict, in place."""
+        for operation in operations:
+            if operation[0] == "put":
+                data[operation[1]] = dequantize_signals(operation[2])
+            elif operation[0] == "delete":
+                data.pop(operation[1], None)
+            elif operation[0] == "rename" and operation[1] in data:
+                data[operation[2]] = data.pop(operation[1])
+        return data
+
+    def _read_base(self) -> dict:
+        data_json = self._path.get_data_json()
+        return load_json(data_json) if os.path.exists(data_json) else {}
+
+    def read(self) -> dict:
+        """Returns the dataset, i.e the base file with the log applied."""
+        with self._lock(fcntl.LOCK_SH):
+            return self.apply_operations(self._read_base(), self._read_operations())
+
+    def compact(self, background: bool = False, quantize: bool = False):
+        """Fold the log into the base file.
+
+        The new base file is written next to the old one and swapped atomically. Appends are not blocked while it is
+        written: the operations appended meanwhile are kept in the log.
+
+        Args:
+            background (bool, optional): Whether to compact in a thread. The thread is returned, `join` it to wait for the compaction. Defaults to False.
+            quantize (bool, optional): Whether to store the dms and shape signals of the base file as uint16 fixed-point. Defaults to False.
+        """
+        if background:
+            thread = threading.Thread(target=self._compact, args=(quantize,))
+            thread.start()
+            return thread
+        self._compact(quantize)
+
+    def _compact(self, quantize):
+        # one compaction at a time
+        with self._lock(fcntl.LOCK_EX, suffix=".compact.lock"):
+            self._compact_unlocked(quantize)
+
+    def _compact_unlocked(self, quantize):
+        if not os.path.exists(self.path) or not os.path.getsize(self.path):
+            return
+        with self._lock(fcntl.LOCK_SH):
+            size = os.path.getsize(self.path)
+            data = self.apply_operations(
+                self._read_base(), self._read_operations(size)
+            )
+        data_json = self._path.get_data_json()
+        extension = os.path.basename(data_json)[len("data.json") :]
+        temp = os.path.join(
+            os.path.dirname(data_json), f".compact_{os.getpid()}.data.json{extension}"
+        )
+        dump_json(data, temp, quantize=quantize)
+        with self._lock(fcntl.LOCK_EX):
+            with open(self.path, "rb") as f:
+                f.seek(size)
+                tail = f.read()
+            with open(self.path + ".tmp", "wb") as f:
+                f.write(tail)
+                f.flush()
+                os.fsync(f.fileno())
+            os.replace(temp, data_json)
+            os.replace(self.path + ".tmp", self.path)
+        SequenceIndex(self.root).add(
+            self.name, [attr["sequence"] for attr in data.values()]
+        )
+        write_content_hashes(data_json)
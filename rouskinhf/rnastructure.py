@@ -1,24 +1,162 @@
 import os
+import json
+import signal
+import threading
+import itertools
+from contextlib import nullcontext
 import numpy as np
-import pandas as pd
 from .env import Env
+from .metrics import Metrics
 
 
-def run_command(cmd):
+class FoldPool:
+    """Pool of threads shared by the RNAstructure predictions of a process.
+
+    RNAstructure runs in subprocesses, so threads are enough to run several predictions at once.
+    `slots` bounds the number of RNAstructure processes running at the same time. It can be shared between processes
+    (e.g. a `multiprocessing.Manager().BoundedSemaphore`) to enforce a global CPU budget over several conversions.
+    Without `configure`, the predictions run one by one in the calling thread.
+
+    Example:
+        >>> FoldPool.configure(n_threads=2)
+        >>> list(FoldPool.map(len, ['ACGU', 'GG']))
+        [4, 2]
+        >>> folders = list(FoldPool.map(lambda _: os.makedirs(_temp_folder(), exist_ok=True) or _temp_folder(), range(2)))
+        >>> FoldPool.shutdown()
+        >>> [os.path.exists(folder) for folder in folders]
+        [False, False]
+    """
+
+    executor = None
+    slots = None
+    n_threads = 1
+    _thread_ids = set()
+
+    @classmethod
+    def configure(cls, n_threads: int, slots=None):
+        from concurrent.futures import ThreadPoolExecutor
+
+        cls.shutdown()
+        cls.executor = ThreadPoolExecutor(
+            max_workers=n_threads,
+            initializer=lambda: cls._thread_ids.add(threading.get_ident()),
+        )
+        cls.slots, cls.n_threads = slots, n_threads
+
+    @classmethod
+    def shutdown(cls):
+        """Stops the threads, and removes their RNAstructure temp folders."""
+        import shutil
+
+        if cls.executor is not None:
+            cls.executor.shutdown()
+        for thread_id in cls._thread_ids:
+            shutil.rmtree(_temp_folder(thread_id), ignore_errors=True)
+        cls._thread_ids = set()
+        cls.executor, cls.slots, cls.n_threads = None, None, 1
+
+    @classmethod
+    def map(cls, func, iterable):
+        """Returns an iterator over func(item) for each item, in order."""
+        if cls.executor is None:
+            return map(func, iterable)
+        return cls.executor.map(func, iterable)
+
+    @classmethod
+    def imap_unordered(cls, func, iterable, key=None, window=1024):
+        """Yields (index of the item, func(item)) for each item, in completion order.
+
+        The items are read `window` at a time, and at most 2 per thread are in flight, so the iterable is streamed.
+        With `key`, the items of each window are dispatched in decreasing order of key. Folding time grows roughly
+        cubically with the sequence length, so dispatching the longest sequences first keeps one long sequence from
+        finishing the run alone.
+
+        Example:
+            >>> FoldPool.configure(n_threads=1)
+            >>> list(FoldPool.imap_unordered(str.lower, ['AC', 'GGGU', 'U'], key=len))
+            [(1, 'gggu'), (0, 'ac'), (2, 'u')]
+            >>> read = []
+            >>> items = (read.append(i) or i for i in range(100000))
+            >>> next(FoldPool.imap_unordered(str, items, window=8)), len(read)
+            ((0, '0'), 8)
+            >>> FoldPool.shutdown()
+        """
+        if cls.executor is None:
+            yield from enumerate(map(func, iterable))
+            return
+        from concurrent.futures import wait, FIRST_COMPLETED
+
+        def completed(pending):
+            done, _ = wait(pending, return_when=FIRST_COMPLETED)
+            for future in [f for f in pending if f in done]:  # in dispatch order
+                idx = pending.pop(future)
+                Metrics.set("fold_queue_depth", len(pending))
+                yield idx, future.result()
+
+        items = enumerate(iterable)
+        pending = {}
+        while items_window := list(itertools.islice(items, window)):
+            if key is not None:
+                items_window.sort(key=lambda item: key(item[1]), reverse=True)
+            for idx, item in items_window:
+                while len(pending) >= 2 * cls.n_threads:
+                    yield from completed(pending)
+                pending[cls.executor.submit(func, item)] = idx
+                Metrics.set("fold_queue_depth", len(pending))
+        while pending:
+            yield from completed(pending)
+
+
+def _temp_folder(thread_id=None):
+    """The RNAstructure temp folder of a thread of this process, by default the calling thread."""
+    return os.path.join(
+        Env.get_rnastructure_temp_path(),
+        f"{os.getpid()}_{thread_id or threading.get_ident()}",
+    )
+
+
+class FoldTimeoutError(Exception):
+    """Raised when an RNAstructure command doesn't finish within its time budget, after all the retries."""
+
+
+def run_command(cmd, timeout=None, retries=0):
+    """Runs a command and returns its output. If it runs longer than `timeout` seconds, it is killed and run again,
+    up to `retries` times, before raising a FoldTimeoutError."""
     import subprocess
 
-    process = subprocess.Popen(cmd.split(), stdout=subprocess.PIPE)
-    output, error = process.communicate()
-    return output.decode("utf-8")
+    for _ in range(retries + 1):
+        with FoldPool.slots or nullcontext():
+            # in its own process group, to also kill the children of the command
+            process = subprocess.Popen(
+                cmd.split(), stdout=subprocess.PIPE, start_new_session=True
+            )
+            try:
+                output, error = process.communicate(timeout=timeout)
+                return output.decode("utf-8")
+            except subprocess.TimeoutExpired:
+                os.killpg(process.pid, signal.SIGKILL)
+                process.communicate()
+    raise FoldTimeoutError(
+        f"`{cmd}` timed out {retries + 1} times (time budget: {timeout:g}s)"
+    )
+
 
+class RNAstructure(threading.local):
 
-class RNAstructure(object):
+    """RNAstructure wrapper. The temporary files are specific to each process and thread, so that predictions can run concurrently."""
 
-    """RNAstructure wrapper."""
+    # time budget of a prediction: timeout_base + timeout_per_kb3 * (length in kb)^3 seconds, retried `retries` times
+    timeout_base = 60
+    timeout_per_kb3 = 600
+    retries = 2
 
     def __init__(self) -> None:
         pass
 
+    def get_timeout(self, sequence) -> float:
+        """Returns the time budget of a prediction, which grows with the cube of the sequence length like the folding time."""
+        return self.timeout_base + self.timeout_per_kb3 * (len(sequence) / 1000) ** 3
+
     def predict_partition(self, temperature_k=None, dms=None):
         # predict the partition of rna structures
         cmd = f"{os.path.join(Env.get_rnastructure_path(), 'partition')} {self.fasta_file} {self.pfs_file}"
@@ -35,7 +173,12 @@ class RNAstructure(object):
             ], "The dms signal should be a list of floats."
             self.__write_dms_to_file(self.sequence, dms)
             cmd += " --shape " + self.dms_file
-        run_command(cmd)
+        run_command(cmd, self.get_timeout(self.sequence), self.retries)
+        return self.__read_pairing_probability()
+
+    def __read_pairing_probability(self):
+        """Sums the base pair probabilities of the partition function file into the probability of each base to be paired."""
+        import pandas as pd
 
         # sum it into pairing probability
         run_command(
@@ -93,17 +236,43 @@ class RNAstructure(object):
                 if b in "AC":
                     f.write(f"{idx+1}\t{s}\n")
 
+    def __signal_option(self, sequence, signal, option):
+        """Writes a dms or shape signal to the constraints file and returns the option of the command that uses it."""
+        assert len(sequence) == len(
+            signal
+        ), "The length of the sequence is not the same as the length of the signal."
+        assert type(signal) in [
+            list,
+            tuple,
+            np.ndarray,
+        ], f"The {option} signal should be a list of floats."
+        self.__write_dms_to_file(sequence, signal)
+        return f" --{option} " + self.dms_file
+
+    def __read_dotbracket(self):
+        """Converts the ct file to a dot-bracket structure."""
+        cmd = f"{os.path.join(Env.get_rnastructure_path(), 'ct2dot')} {self.ct_file} 0 {self.dot_file}"
+        run_command(cmd)
+        assert os.path.exists(
+            self.dot_file
+        ), 'The dot file was not created. Check RNAstructure installation. If you use a Mac, make sure to run `setup_env(RNASTRUCTURE_PATH="abs/path/to/RNAstructure/exe")`.'
+        with open(self.dot_file, "r") as f:
+            return f.readlines()[2].strip()
+
     def __make_temp_folder(self):
         """Remove content and make a new folder for temporary files."""
-        path = Env.get_rnastructure_temp_path()
+        path = self.__get_temp_folder()
         if os.path.exists(path):
             import shutil
 
             shutil.rmtree(path)
         os.makedirs(path)
 
+    def __get_temp_folder(self):
+        return _temp_folder()
+
     def __make_files(self, temp_prefix="temp"):
-        this_file = lambda x: os.path.join(Env.get_rnastructure_temp_path(), x)
+        this_file = lambda x: os.path.join(self.__get_temp_folder(), x)
         self.pfs_file = this_file(f"{temp_prefix}.pfs")
         self.ct_file = this_file(f"{temp_prefix}.ct")
         self.dms_file = this_file(f"{temp_prefix}.shape")
@@ -135,35 +304,368 @@ class RNAstructure(object):
         files = sys.path
         cmd = f"{os.path.join(Env.get_rnastructure_path(), 'Fold')} {self.fasta_file} {self.ct_file}"
         if type(dms) != type(None):
-            assert len(sequence) == len(
-                dms
-            ), "The length of the sequence is not the same as the length of the signal."
-            assert type(dms) in [
-                list,
-                tuple,
-                np.ndarray,
-            ], "The dms signal should be a list of floats."
-            self.__write_dms_to_file(sequence, dms)
-            cmd += " --dms " + self.dms_file
+            cmd += self.__signal_option(sequence, dms, "dms")
         if type(shape) != type(None):
-            assert len(sequence) == len(
-                shape
-            ), "The length of the sequence is not the same as the length of the signal."
-            assert type(shape) in [
-                list,
-                tuple,
-                np.ndarray,
-            ], "The shape signal should be a list of floats."
-            self.__write_dms_to_file(sequence, shape)
-            cmd += " --shape " + self.dms_file
-        run_command(cmd)
-        cmd = f"{os.path.join(Env.get_rnastructure_path(), 'ct2dot')} {self.ct_file} 0 {self.dot_file}"
-        run_command(cmd)
-        assert os.path.exists(
-            self.dot_file
-        ), 'The dot file was not created. Check RNAstructure installation. If you use a Mac, make sure to run `setup_env(RNASTRUCTURE_PATH="abs/path/to/RNAstructure/exe")`.'
-        with open(self.dot_file, "r") as f:
-            return f.readlines()[2].strip()
+            cmd += self.__signal_option(sequence, shape, "shape")
+        run_command(cmd, self.get_timeout(sequence), self.retries)
+        return self.__read_dotbracket()
+
+    def predictStructureAndPairingProbability(self, sequence, dms=None, shape=None):
+        """Runs the partition function once, and derives from its `.pfs` file both the pairing probability of each base
+        (`ProbabilityPlot`) and the maximum expected accuracy structure (`MaxExpect`). Returns (dotbracket, probabilities).
+
+        The structure is the MEA structure, not the minimum free energy structure of `predictStructure`.
+        """
+        self.sequence = sequence
+        self.__make_temp_folder()
+        self.__make_files()
+        self.__create_fasta_file("reference", sequence)
+        cmd = f"{os.path.join(Env.get_rnastructure_path(), 'partition')} {self.fasta_file} {self.pfs_file}"
+        if type(dms) != type(None):
+            cmd += self.__signal_option(sequence, dms, "dms")
+        if type(shape) != type(None):
+            cmd += self.__signal_option(sequence, shape, "shape")
+        run_command(cmd, self.get_timeout(sequence), self.retries)
+        probabilities = self.__read_pairing_probability()
+        run_command(
+            f"{os.path.join(Env.get_rnastructure_path(), 'MaxExpect')} {self.pfs_file} {self.ct_file}",
+            self.get_timeout(sequence),
+            self.retries,
+        )
+        return self.__read_dotbracket(), probabilities
 
 
 RNAstructure_singleton = RNAstructure()
+
+
+def _signal_to_json(signal):
+    return None if signal is None else [float(v) for v in signal]
+
+
+class PredictionServer:
+    """Local prediction service, shared by the processes of a host over a Unix socket.
+
+    The requests and responses are json lines, `{"id", "method", "sequence", "dms", "shape"}` and `{"id", "result"}` or
+    `{"id", "error"}`. A client can send many requests before reading the responses, which are streamed back as soon as
+    each prediction is done, in completion order.
+        - Identical requests in flight are coalesced: the prediction runs once and answers all of them. The last
+          `cache_size` results are also kept, so the same sequence isn't folded again.
+        - The new requests are collected for `max_wait` seconds, then dispatched to the worker threads, up to
+          `max_dispatch` at a time, longest sequences first. Each request is still a prediction of its own: the backend
+          is not called on batches of sequences.
+    The predictions run on the folding backend of the server (see `folding.get_backend`), in its own temp folders.
+
+    Args:
+        socket_path (str, optional): Path of the Unix socket. Defaults to `Env.get_prediction_socket`.
+        n_threads (int, optional): Number of predictions running at the same time. Defaults to the number of CPUs.
+        backend (str, optional): Name of the folding backend. Defaults to `Env.get_folding_backend`.
+        max_dispatch (int, optional): Maximum number of requests sorted and dispatched at once. Defaults to 64.
+        max_wait (float, optional): Seconds to wait for more requests before dispatching them. Defaults to 0.005.
+        cache_size (int, optional): Number of results kept. Defaults to 10000.
+
+    Example:
+        >>> import tempfile, threading, time
+        >>> from .folding import FoldingBackend, register_backend
+        >>> class SlowBackend(FoldingBackend):
+        ...     calls = []
+        ...     def predict_structure(self, sequence, dms=None, shape=None):
+        ...         self.calls.append(sequence)
+        ...         time.sleep(0.1)
+        ...         return "." * len(sequence)
+        >>> register_backend("slow", SlowBackend)
+        >>> server = PredictionServer(os.path.join(tempfile.mkdtemp(), "fold.sock"), n_threads=2, backend="slow").start()
+        >>> client = PredictionClient(server.socket_path)
+        >>> client.predictStructure("GGGAAACCC")
+        '.........'
+        >>> results = []
+        >>> threads = [threading.Thread(target=lambda: results.append(PredictionClient(server.socket_path).predict_structures(["AAAA", "CCCCCC", "GGGAAACCC"]))) for _ in range(3)]
+        >>> _ = [t.start() for t in threads]
+        >>> _ = [t.join() for t in threads]
+        >>> results[0]
+        ['....', '......', '.........']
+        >>> sorted(SlowBackend.calls)  # each sequence was folded once
+        ['AAAA', 'CCCCCC', 'GGGAAACCC']
+        >>> server.stats["requests"], server.stats["coalesced"] + server.stats["cache_hits"]
+        (10, 7)
+        >>> server.stop()
+    """
+
+    METHODS = {
+        "predictStructure": lambda backend, sequence, dms, shape: backend.predict_structure(
+            sequence, dms=dms, shape=shape
+        ),
+        "predictPairingProbability": lambda backend, sequence, dms, shape: backend.predict_pairing_probability(
+            sequence, dms=dms
+        ),
+        "predictStructureAndPairingProbability": lambda backend, sequence, dms, shape: backend.predict_structure_and_pairing_probability(
+            sequence, dms=dms, shape=shape
+        ),
+    }
+
+    def __init__(
+        self,
+        socket_path: str = None,
+        n_threads: int = None,
+        backend: str = None,
+        max_dispatch: int = 64,
+        max_wait: float = 0.005,
+        cache_size: int = 10000,
+    ):
+        from .folding import get_backend
+
+        self.socket_path = socket_path or Env.get_prediction_socket()
+        self.n_threads = n_threads or os.cpu_count()
+        self.backend = get_backend(backend)
+        assert not hasattr(
+            self.backend, "client"
+        ), "The prediction server can't send its predictions to a prediction server"
+        self.max_dispatch = max_dispatch
+        self.max_wait = max_wait
+        self.cache_size = cache_size
+        self.stats = {"requests": 0, "coalesced": 0, "cache_hits": 0, "predictions": 0, "dispatches": 0}
+        self._thread = None
+
+    def submit(self, method, sequence, dms=None, shape=None):
+        """Returns an asyncio future of the result of a request. Must be called from the loop of the server."""
+        assert method in self.METHODS, f"Unknown method {method}"
+        self.stats["requests"] += 1
+        key = json.dumps([method, sequence, dms, shape])
+        if key in self._cache:
+            self.stats["cache_hits"] += 1
+            Metrics.inc("cache_hits_total", cache="prediction_server")
+            self._cache.move_to_end(key)
+            future = self._loop.create_future()
+            future.set_result(self._cache[key])
+            return future
+        if key in self._in_flight:
+            self.stats["coalesced"] += 1
+            Metrics.inc("cache_hits_total", cache="prediction_server")
+            return self._in_flight[key]
+        Metrics.inc("cache_misses_total", cache="prediction_server")
+        future = self._in_flight[key] = self._loop.create_future()
+        self._pending.append((key, method, sequence, dms, shape))
+        self._wakeup.set()
+        return future
+
+    def _resolve(self, key, result, error):
+        future = self._in_flight.pop(key)
+        if error is not None:
+            future.set_exception(error)
+            return
+        self._cache[key] = result
+        if len(self._cache) > self.cache_size:
+            self._cache.popitem(last=False)
+        future.set_result(result)
+
+    def _run(self, key, method, sequence, dms, shape):
+        try:
+            result, error = self.METHODS[method](self.backend, sequence, dms, shape), None
+        except Exception as e:
+            result, error = None, e
+        self._loop.call_soon_threadsafe(self._resolve, key, result, error)
+
+    async def _dispatch(self):
+        import asyncio
+
+        while True:
+            await self._wakeup.wait()
+            await asyncio.sleep(self.max_wait)  # let more requests come in, to dispatch the longest first
+            self._wakeup.clear()
+            while self._pending:
+                requests = self._pending[: self.max_dispatch]
+                del self._pending[: self.max_dispatch]
+                self.stats["dispatches"] += 1
+                self.stats["predictions"] += len(requests)
+                for request in sorted(requests, key=lambda r: len(r[2]), reverse=True):
+                    self._executor.submit(self._run, *request)
+
+    async def _handle(self, reader, writer):
+        import asyncio
+
+        lock = asyncio.Lock()
+
+        async def respond(request):
+            try:
+                result = await self.submit(
+                    request["method"],
+                    request["sequence"],
+                    request.get("dms"),
+                    request.get("shape"),
+                )
+                response = {"id": request.get("id"), "result": result}
+            except Exception as e:
+                response = {"id": request.get("id"), "error": f"{type(e).__name__}: {e}"}
+            async with lock:
+                writer.write(json.dumps(response).encode() + b"\n")
+                await writer.drain()
+
+        self._connections.add(asyncio.current_task())
+        tasks = set()
+        try:
+            while line := await reader.readline():
+                task = asyncio.ensure_future(respond(json.loads(line)))
+                tasks.add(task)
+                task.add_done_callback(tasks.discard)
+            await asyncio.gather(*tasks)
+        except (ConnectionError, asyncio.CancelledError):
+            for task in tasks:
+                task.cancel()
+        finally:
+            self._connections.discard(asyncio.current_task())
+            writer.close()
+
+    async def serve(self, ready=None):
+        """Serves until cancelled."""
+        import asyncio
+        from collections import OrderedDict
+        from concurrent.futures import ThreadPoolExecutor
+
+        self._loop = asyncio.get_running_loop()
+        self._cache, self._in_flight, self._pending = OrderedDict(), {}, []
+        self._wakeup = asyncio.Event()
+        self._connections = set()
+        self._executor = ThreadPoolExecutor(max_workers=self.n_threads)
+        if os.path.exists(self.socket_path):
+            try:
+                await asyncio.open_unix_connection(self.socket_path)
+                raise RuntimeError(f"A prediction server is already running on {self.socket_path}")
+            except ConnectionRefusedError:
+                os.remove(self.socket_path)  # left by a server that crashed
+        server = await asyncio.start_unix_server(self._handle, path=self.socket_path)
+        dispatcher = asyncio.ensure_future(self._dispatch())
+        if ready is not None:
+            ready.set()
+        try:
+            async with server:
+                await server.serve_forever()
+        finally:
+            dispatcher.cancel()
+            for connection in list(self._connections):
+                connection.cancel()
+            await asyncio.gather(dispatcher, *self._connections, return_exceptions=True)
+            self._executor.shutdown(wait=False, cancel_futures=True)
+            if os.path.exists(self.socket_path):
+                os.remove(self.socket_path)
+
+    def serve_forever(self) -> None:
+        """Serves in the calling thread, until interrupted."""
+        import asyncio
+
+        try:
+            asyncio.run(self.serve())
+        except KeyboardInterrupt:
+            pass
+
+    def start(self) -> "PredictionServer":
+        """Serves in a background thread of this process, e.g. in a notebook. Returns the server."""
+        import asyncio
+
+        ready = threading.Event()
+
+        def run():
+            self._task_loop = asyncio.new_event_loop()
+            self._task = self._task_loop.create_task(self.serve(ready))
+            try:
+                self._task_loop.run_until_complete(self._task)
+            except asyncio.CancelledError:
+                pass
+            finally:
+                self._task_loop.close()
+                ready.set()
+
+        self._thread = threading.Thread(target=run, daemon=True)
+        self._thread.start()
+        ready.wait()
+        assert os.path.exists(self.socket_path), "The prediction server failed to start"
+        return self
+
+    def stop(self) -> None:
+        """Stops a server started with `start`."""
+        self._task_loop.call_soon_threadsafe(self._task.cancel)
+        self._thread.join()
+
+
+class PredictionClient(threading.local):
+    """Client of a `PredictionServer`, with the methods of `RNAstructure`. Each thread has its own connection.
+
+    Args:
+        socket_path (str, optional): Path of the Unix socket of the server. Defaults to `Env.get_prediction_socket`.
+    """
+
+    def __init__(self, socket_path: str = None):
+        self.socket_path = socket_path or Env.get_prediction_socket()
+        self._stream = None
+
+    def _connect(self):
+        if self._stream is None:
+            import socket
+
+            connection = socket.socket(socket.AF_UNIX, socket.SOCK_STREAM)
+            connection.connect(self.socket_path)
+            self._stream = connection.makefile("rwb")
+        return self._stream
+
+    def _call(self, method, requests) -> list:
+        """Sends all the requests, then reads their responses as they are streamed back. Returns the results in order."""
+        stream = self._connect()
+        try:
+            for idx, request in enumerate(requests):
+                request = {"id": idx, "method": method, **request}
+                stream.write(json.dumps(request).encode() + b"\n")
+            stream.flush()
+            responses = {}
+            while len(responses) < len(requests):
+                line = stream.readline()
+                if not line:
+                    raise ConnectionError("The prediction server closed the connection")
+                response = json.loads(line)
+                responses[response["id"]] = response
+        except BaseException:
+            self.close()  # the responses left in the stream would answer the next call
+            raise
+        results = []
+        for idx in range(len(requests)):
+            if "error" in responses[idx]:
+                error = responses[idx]["error"]
+                if error.startswith(FoldTimeoutError.__name__):
+                    raise FoldTimeoutError(error)
+                raise RuntimeError(f"Prediction server: {error}")
+            results.append(responses[idx]["result"])
+        return results
+
+    def close(self) -> None:
+        if self._stream is not None:
+            self._stream.close()
+            self._stream = None
+
+    def predictStructure(self, sequence, dms=None, shape=None):
+        return self._call(
+            "predictStructure",
+            [{"sequence": sequence, "dms": _signal_to_json(dms), "shape": _signal_to_json(shape)}],
+        )[0]
+
+    def predictPairingProbability(self, sequence, dms=None, reference="reference"):
+        return self._call(
+            "predictPairingProbability",
+            [{"sequence": sequence, "dms": _signal_to_json(dms)}],
+        )[0]
+
+    def predictStructureAndPairingProbability(self, sequence, dms=None, shape=None):
+        return tuple(
+            self._call(
+                "predictStructureAndPairingProbability",
+                [{"sequence": sequence, "dms": _signal_to_json(dms), "shape": _signal_to_json(shape)}],
+            )[0]
+        )
+
+    def predict_structures(self, sequences: list, dms=None, shape=None) -> list:
+        """Sends the predictions of all the sequences at once, so that the server coalesces them and dispatches them longest first. Returns them in order."""
+        dms = [None] * len(sequences) if dms is None else dms
+        shape = [None] * len(sequences) if shape is None else shape
+        return self._call(
+            "predictStructure",
+            [
+                {"sequence": s, "dms": _signal_to_json(d), "shape": _signal_to_json(sh)}
+                for s, d, sh in zip(sequences, dms, shape)
+            ],
+        )
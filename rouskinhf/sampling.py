@@ -0,0 +1,200 @@
+import bisect
+import hashlib
+import random
+from contextlib import ExitStack
+
+from .path import Path
+from .util import iter_json, JsonWriter, standardize_sequence
+
+LENGTH_BINS = [0, 100, 200, 500, 1000, 2000]
+
+
+def _write(records, name, path_out, compression):
+    path = Path(name=name, root=path_out)
+    path.make()
+    with JsonWriter(path.get_data_json(compression)) as writer:
+        for reference, attr in records:
+            writer.write(reference, attr)
+    return len(writer)
+
+
+def reservoir_sample(
+    data_json: str,
+    k: int,
+    name: str,
+    path_out: str = "data",
+    seed: int = 0,
+    compression: str = None,
+) -> dict:
+    """Writes a uniform random sample of `k` datapoints of a dataset file to a new dataset, in one pass over the file.
+
+    The sample is drawn with reservoir sampling, so only `k` datapoints are held in memory. They are written in the order of the input.
+
+    Args:
+        data_json (str): Path to the input `data.json`, compressed or not.
+        k (int): Number of datapoints to sample. All the datapoints are kept if there are fewer.
+        name (str): Name of the output dataset.
+        path_out (str, optional): Path to the output folder. Defaults to 'data'.
+        seed (int, optional): Seed of the sampling. Defaults to 0.
+        compression (str, optional): Compression of the output, see `convert`. Defaults to None.
+
+    Returns:
+        dict: {name: number of datapoints written}.
+
+    Example:
+        >>> import os, tempfile
+        >>> from .util import dump_json, load_json
+        >>> root = tempfile.mkdtemp()
+        >>> dump_json({f'ref{i}': {'sequence': 'ACGU' * (i + 1)} for i in range(100)}, os.path.join(root, 'data.json'))
+        >>> reservoir_sample(os.path.join(root, 'data.json'), 5, 'sample', path_out=root)
+        {'sample': 5}
+        >>> list(load_json(os.path.join(root, 'sample', 'data.json')))
+        ['ref1', 'ref2', 'ref34', 'ref50', 'ref63']
+    """
+    rng = random.Random(seed)
+    reservoir = []
+    for idx, record in enumerate(iter_json(data_json)):
+        if idx < k:
+            reservoir.append((idx, record))
+        else:
+            j = rng.randint(0, idx)
+            if j < k:
+                reservoir[j] = (idx, record)
+    return {
+        name: _write(
+            (record for _, record in sorted(reservoir, key=lambda x: x[0])),
+            name,
+            path_out,
+            compression,
+        )
+    }
+
+
+def stratified_sample(
+    data_json: str,
+    k: int,
+    name: str,
+    path_out: str = "data",
+    bins: list = LENGTH_BINS,
+    seed: int = 0,
+    compression: str = None,
+) -> dict:
+    """Writes a random sample of `k` datapoints per sequence length bucket to a new dataset, in one pass over the file.
+
+    Each bucket [bins[i], bins[i + 1]) is sampled with its own reservoir, the last bucket being [bins[-1], +inf).
+    The sequences shorter than bins[0] are ignored.
+
+    Args:
+        data_json (str): Path to the input `data.json`, compressed or not.
+        k (int): Number of datapoints to sample per bucket.
+        name (str): Name of the output dataset.
+        path_out (str, optional): Path to the output folder. Defaults to 'data'.
+        bins (list, optional): Sorted lower bounds of the length buckets. Defaults to [0, 100, 200, 500, 1000, 2000].
+        seed (int, optional): Seed of the sampling. Defaults to 0.
+        compression (str, optional): Compression of the output, see `convert`. Defaults to None.
+
+    Returns:
+        dict: {name: number of datapoints written}.
+
+    Example:
+        >>> import os, tempfile
+        >>> from .util import dump_json, load_json
+        >>> root = tempfile.mkdtemp()
+        >>> dump_json({f'ref{i}': {'sequence': 'A' * (i + 1)} for i in range(300)}, os.path.join(root, 'data.json'))
+        >>> stratified_sample(os.path.join(root, 'data.json'), 2, 'sample', path_out=root, bins=[10, 100, 200])
+        {'sample': 6}
+        >>> [len(attr['sequence']) for attr in load_json(os.path.join(root, 'sample', 'data.json')).values()]
+        [12, 63, 110, 147, 215, 289]
+    """
+    rng = random.Random(seed)
+    reservoirs = [[] for _ in bins]
+    seen = [0] * len(bins)
+    for idx, record in enumerate(iter_json(data_json)):
+        bucket = bisect.bisect_right(bins, len(record[1]["sequence"])) - 1
+        if bucket < 0:
+            continue
+        if seen[bucket] < k:
+            reservoirs[bucket].append((idx, record))
+        else:
+            j = rng.randint(0, seen[bucket])
+            if j < k:
+                reservoirs[bucket][j] = (idx, record)
+        seen[bucket] += 1
+    sample = sorted(
+        [item for reservoir in reservoirs for item in reservoir], key=lambda x: x[0]
+    )
+    return {name: _write((record for _, record in sample), name, path_out, compression)}
+
+
+def split_bucket(value: str, fractions: list, salt: str = "") -> int:
+    """Returns the index of the split of a reference or a sequence, from its hash: the same value always goes to the same split.
+
+    Example:
+        >>> [split_bucket(s, [0.8, 0.1, 0.1]) for s in ['ACGU', 'AAGA', 'AAGC', 'GGCC']]
+        [0, 1, 2, 0]
+    """
+    digest = hashlib.blake2b((salt + value).encode(), digest_size=8).digest()
+    u = int.from_bytes(digest, "little") / 2**64
+    total = 0.0
+    for idx, fraction in enumerate(fractions):
+        total += fraction
+        if u < total:
+            return idx
+    return len(fractions) - 1
+
+
+def split_dataset(
+    data_json: str,
+    fractions: dict,
+    name: str,
+    path_out: str = "data",
+    key: str = "sequence",
+    salt: str = "",
+    compression: str = None,
+) -> dict:
+    """Splits a dataset file into datasets `{name}_{split}` (e.g. train / valid / test), in one pass over the file.
+
+    The split of a datapoint is decided by the hash of its sequence (or reference), so the splits are deterministic and,
+    with `key='sequence'`, the copies of a sequence always end up in the same split.
+
+    Args:
+        data_json (str): Path to the input `data.json`, compressed or not.
+        fractions (dict): {split: fraction of the datapoints}, e.g. {'train': 0.8, 'valid': 0.1, 'test': 0.1}. The fractions must sum to 1.
+        name (str): Prefix of the names of the output datasets.
+        path_out (str, optional): Path to the output folder. Defaults to 'data'.
+        key (str, optional): 'sequence' or 'reference'. Defaults to 'sequence'.
+        salt (str, optional): Changes the draw of the splits. Defaults to ''.
+        compression (str, optional): Compression of the outputs, see `convert`. Defaults to None.
+
+    Returns:
+        dict: {name of the output dataset: number of datapoints written}.
+
+    Example:
+        >>> import os, tempfile
+        >>> from .util import dump_json
+        >>> root = tempfile.mkdtemp()
+        >>> sequences = [''.join('ACGU'[(i >> (2 * j)) % 4] for j in range(8)) for i in range(1000)]
+        >>> dump_json({f'ref{i}': {'sequence': s} for i, s in enumerate(sequences)}, os.path.join(root, 'data.json'))
+        >>> split_dataset(os.path.join(root, 'data.json'), {'train': 0.8, 'valid': 0.1, 'test': 0.1}, 'my_dataset', path_out=root)
+        {'my_dataset_train': 798, 'my_dataset_valid': 97, 'my_dataset_test': 105}
+    """
+    assert key in ["sequence", "reference"], "key must be 'sequence' or 'reference'"
+    assert abs(sum(fractions.values()) - 1) < 1e-9, "The fractions must sum to 1"
+    splits = list(fractions)
+    bounds = list(fractions.values())
+    with ExitStack() as stack:
+        writers = []
+        for split in splits:
+            path = Path(name=f"{name}_{split}", root=path_out)
+            path.make()
+            writers.append(
+                stack.enter_context(JsonWriter(path.get_data_json(compression)))
+            )
+        for reference, attr in iter_json(data_json):
+            value = (
+                standardize_sequence(attr["sequence"])
+                if key == "sequence"
+                else reference
+            )
+            writers[split_bucket(value, bounds, salt)].write(reference, attr)
+    return {f"{name}_{split}": len(writer) for split, writer in zip(splits, writers)}
@@ -0,0 +1,226 @@
+import os
+import json
+import fcntl
+import hashlib
+import tempfile
+import numpy as np
+from contextlib import contextmanager
+
+from .util import standardize_sequence, load_json
+
+
+class BloomFilter:
+    """Bloom filter over 64-bit sequence hashes, stored as a packed bit array.
+
+    The `n_hashes` bit positions of a hash are derived by double hashing from its two 32-bit halves.
+
+    Example:
+        >>> bloom = BloomFilter.from_hashes(SequenceIndex.hash_sequences(['ACGU', 'GGCC']))
+        >>> bloom.contains(SequenceIndex.hash_sequences(['ACGU', 'AAAA'])).tolist()
+        [True, False]
+    """
+
+    def __init__(self, bits: np.ndarray, n_bits: int, n_hashes: int):
+        self.bits = bits
+        self.n_bits = n_bits
+        self.n_hashes = n_hashes
+
+    @classmethod
+    def from_hashes(cls, hashes: np.ndarray, error_rate: float = 0.01):
+        n = max(len(hashes), 1)
+        n_bits = int(np.ceil(-n * np.log(error_rate) / np.log(2) ** 2))
+        n_bits = max(8 * int(np.ceil(n_bits / 8)), 64)
+        n_hashes = max(1, int(round(n_bits / n * np.log(2))))
+        bits = np.zeros(n_bits, dtype=bool)
+        bits[cls._positions(hashes, n_bits, n_hashes).ravel()] = True
+        return cls(np.packbits(bits), n_bits, n_hashes)
+
+    @staticmethod
+    def _positions(hashes, n_bits, n_hashes):
+        hashes = np.asarray(hashes, dtype=np.uint64)
+        h1 = hashes & np.uint64(0xFFFFFFFF)
+        h2 = hashes >> np.uint64(32)
+        i = np.arange(n_hashes, dtype=np.uint64)
+        return ((h1[:, None] + i[None, :] * h2[:, None]) % np.uint64(n_bits)).astype(
+            np.int64
+        )
+
+    def contains(self, hashes: np.ndarray) -> np.ndarray:
+        """Returns a boolean mask: False means "definitely not in the set", True means "probably in the set"."""
+        positions = self._positions(hashes, self.n_bits, self.n_hashes)
+        bits = (self.bits[positions >> 3] >> (7 - (positions & 7)).astype(np.uint8)) & 1
+        return bits.astype(bool).all(axis=1)
+
+
+class SequenceIndex:
+    """Persistent index of the sequences of every local dataset, to check train/test leakage without reloading the datasets.
+
+    For each dataset, the index stores under `<root>/.sequence_index/`:
+        - `<name>.hashes.npy`: the sorted set of the 64-bit hashes of its sequences
+        - `<name>.bloom.npy`: a Bloom filter of these hashes
+    and `index.json` lists the indexed datasets. The index is updated by `convert` and `get_dataset`.
+
+    Args:
+        root (str, optional): Path to the data folder. Defaults to 'data'.
+
+    Example:
+        >>> import tempfile
+        >>> index = SequenceIndex(tempfile.mkdtemp())
+        >>> index.add('train', ['ACGU', 'GGCCA', 'UUUU'])
+        >>> index.add('test', ['acgt', 'CCCC'])
+        >>> index.datasets_containing('ACGU')
+        ['train', 'test']
+        >>> index.overlap_matrix()
+        {'train': {'train': 3, 'test': 1}, 'test': {'train': 1, 'test': 2}}
+    """
+
+    def __init__(self, root: str = "data"):
+        self.root = root
+        self.folder = os.path.join(root, ".sequence_index")
+        self._hashes, self._blooms = {}, {}
+
+    @staticmethod
+    def hash_sequences(sequences) -> np.ndarray:
+        """Returns the 64-bit blake2b hashes of the standardized sequences."""
+        return np.array(
+            [
+                int.from_bytes(
+                    hashlib.blake2b(
+                        standardize_sequence(s).encode(), digest_size=8
+                    ).digest(),
+                    "little",
+                )
+                for s in sequences
+            ],
+            dtype=np.uint64,
+        )
+
+    def _get_manifest(self) -> str:
+        return os.path.join(self.folder, "index.json")
+
+    def _get_hashes(self, name) -> str:
+        return os.path.join(self.folder, f"{name}.hashes.npy")
+
+    def _get_bloom(self, name) -> str:
+        return os.path.join(self.folder, f"{name}.bloom.npy")
+
+    def _read_manifest(self) -> dict:
+        if not os.path.exists(self._get_manifest()):
+            return {}
+        with open(self._get_manifest(), "r") as f:
+            return json.load(f)
+
+    @contextmanager
+    def _lock(self):
+        """Serializes the writers of the index, e.g. the datasets added at once by `get_datasets`."""
+        os.makedirs(self.folder, exist_ok=True)
+        with open(self._get_manifest() + ".lock", "a") as lock:
+            fcntl.flock(lock, fcntl.LOCK_EX)
+            try:
+                yield
+            finally:
+                fcntl.flock(lock, fcntl.LOCK_UN)
+
+    def _write_manifest(self, manifest):
+        # a temp file of its own, so that concurrent writers never rename each other's partial file
+        with tempfile.NamedTemporaryFile(
+            "w", dir=self.folder, suffix=".tmp", delete=False
+        ) as f:
+            json.dump(manifest, f, indent=2)
+        os.replace(f.name, self._get_manifest())
+
+    def _save_array(self, path, array):
+        with tempfile.NamedTemporaryFile(
+            dir=self.folder, suffix=".tmp.npy", delete=False
+        ) as f:
+            np.save(f, array)
+        os.replace(f.name, path)
+
+    def names(self) -> list:
+        """Returns the names of the indexed datasets."""
+        return list(self._read_manifest().keys())
+
+    def add(self, name: str, sequences) -> None:
+        """Index the sequences of a dataset. Replaces the previous entry of this dataset if any."""
+        hashes = np.unique(self.hash_sequences(sequences))
+        bloom = BloomFilter.from_hashes(hashes)
+        with self._lock():
+            self._save_array(self._get_hashes(name), hashes)
+            self._save_array(self._get_bloom(name), bloom.bits)
+            manifest = self._read_manifest()
+            manifest[name] = {
+                "n_sequences": len(hashes),
+                "bloom_bits": bloom.n_bits,
+                "bloom_hashes": bloom.n_hashes,
+            }
+            self._write_manifest(manifest)
+        self._hashes[name], self._blooms[name] = hashes, bloom
+
+    def add_from_json(self, name: str, data_json: str) -> None:
+        """Index the sequences of a `data.json` file."""
+        data = load_json(data_json)
+        self.add(name, [d["sequence"] for d in data.values()])
+
+    def remove(self, name: str) -> None:
+        """Remove a dataset from the index."""
+        with self._lock():
+            manifest = self._read_manifest()
+            manifest.pop(name, None)
+            self._write_manifest(manifest)
+            for path in [self._get_hashes(name), self._get_bloom(name)]:
+                if os.path.exists(path):
+                    os.remove(path)
+        self._hashes.pop(name, None)
+        self._blooms.pop(name, None)
+
+    def get_hashes(self, name: str) -> np.ndarray:
+        """Returns the sorted hashes of the sequences of a dataset."""
+        if name not in self._hashes:
+            self._hashes[name] = np.load(self._get_hashes(name), mmap_mode="r")
+        return self._hashes[name]
+
+    def get_bloom(self, name: str) -> BloomFilter:
+        if name not in self._blooms:
+            entry = self._read_manifest()[name]
+            self._blooms[name] = BloomFilter(
+                np.load(self._get_bloom(name)),
+                entry["bloom_bits"],
+                entry["bloom_hashes"],
+            )
+        return self._blooms[name]
+
+    def datasets_containing(self, sequence: str) -> list:
+        """Returns the names of the datasets that contain this sequence.
+
+        The Bloom filters discard most datasets, and the exact hash sets are only read for the remaining ones.
+        """
+        hashes = self.hash_sequences([sequence])
+        out = []
+        for name in self.names():
+            if not self.get_bloom(name).contains(hashes)[0]:
+                continue
+            dataset_hashes = self.get_hashes(name)
+            idx = np.searchsorted(dataset_hashes, hashes[0])
+            if idx < len(dataset_hashes) and dataset_hashes[idx] == hashes[0]:
+                out.append(name)
+        return out
+
+    def overlap(self, name_a: str, name_b: str) -> int:
+        """Returns the number of distinct sequences shared by two datasets."""
+        return len(
+            np.intersect1d(
+                self.get_hashes(name_a), self.get_hashes(name_b), assume_unique=True
+            )
+        )
+
+    def overlap_matrix(self, names: list = None) -> dict:
+        """Returns the number of shared distinct sequences between every pair of datasets, as {name_a: {name_b: count}}.
+        The diagonal is the number of distinct sequences of each dataset."""
+        if names is None:
+            names = self.names()
+        matrix = {name: {} for name in names}
+        for i, name_a in enumerate(names):
+            for name_b in names[i:]:
+                n = self.overlap(name_a, name_b)
+                matrix[name_a][name_b] = matrix[name_b][name_a] = n
+        return {name: {other: matrix[name][other] for other in names} for name in names}
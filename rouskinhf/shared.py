@@ -0,0 +1,222 @@
+import os
+import json
+import base64
+import secrets
+import threading
+import numpy as np
+from multiprocessing import shared_memory, resource_tracker
+
+from .util import iter_json, standardize_sequence, Q16_SCALE
+
+SIGNALS = ["dms", "shape"]
+
+_register_lock = threading.Lock()
+
+
+def _signal_array(signal) -> np.ndarray:
+    """Decodes a signal, quantized or not, to a float32 array without going through a list."""
+    if isinstance(signal, dict) and "q16" in signal:
+        return (
+            np.frombuffer(base64.b64decode(signal["q16"]), dtype="<u2") / Q16_SCALE
+        ).astype(np.float32)
+    return np.asarray(signal, dtype=np.float32)
+
+
+def _open_block(name, size=None):
+    """Creates (with `size`) or attaches a shared memory block. Only the creator registers it to the resource tracker,
+    which would otherwise unlink the block when an attached worker exits."""
+    if size is not None:
+        return shared_memory.SharedMemory(name=name, create=True, size=max(size, 1))
+    try:
+        return shared_memory.SharedMemory(name=name, track=False)
+    except TypeError:  # python < 3.13
+        with _register_lock:
+            register = resource_tracker.register
+            resource_tracker.register = lambda *args: None
+            try:
+                return shared_memory.SharedMemory(name=name)
+            finally:
+                resource_tracker.register = register
+
+
+class SharedDataset:
+    """Dataset decoded once into shared memory blocks, that any process of the host can attach by name.
+
+    `publish` packs the datapoints into flat arrays, each in its own `multiprocessing.shared_memory` block:
+        - `sequences`: the concatenated sequences as ascii bytes, and `offsets` the start of each sequence
+        - `dms`, `shape`: float32 signals aligned with `sequences` (NaN where missing), and `has_dms`, `has_shape`
+        - `pairs`: the concatenated base pairs as int32 (i, j) rows, and `pair_offsets` the first pair of each datapoint
+        - `references`: the concatenated utf-8 references, and `reference_offsets`
+    The shapes and dtypes are stored in a `<name>.meta` block. `attach` maps the blocks as read-only numpy arrays, so the
+    datapoints of all the processes share one copy in memory. A `SharedDataset` is pickled as its name, so it can be
+    handed to DataLoader workers as it is, with any start method.
+
+    The publisher owns the blocks: they are unlinked by `unlink`, or when leaving its `with` block. Only the sequence,
+    structure and signals are kept.
+
+    Example:
+        >>> import subprocess, sys
+        >>> data = {'ref1': {'sequence': 'ACGUAC', 'structure': [[0, 3]], 'dms': [0.1, 0.2, 0.0, 0.5, 0.9, 1.0]}, 'ref2': {'sequence': 'GGCC', 'shape': {'q16': 'AADSBBAnAAA='}}}
+        >>> with SharedDataset.publish(data) as dataset:
+        ...     code = f"import rouskinhf.shared as s; d = s.SharedDataset.attach('{dataset.name}'); print(len(d), d[1]['shape'], d[0]['structure'].tolist())"
+        ...     print(subprocess.check_output([sys.executable, "-c", code], text=True).strip())
+        ...     dataset[0]['reference'], dataset[0]['sequence'], dataset[0]['dms'].astype(float).round(4).tolist()
+        2 [0.     0.1234 1.     0.    ] [[0, 3]]
+        ('ref1', 'ACGUAC', [0.1, 0.2, 0.0, 0.5, 0.9, 1.0])
+    """
+
+    def __init__(self, name: str, blocks: dict, arrays: dict, owner: bool = False):
+        self.name = name
+        self._blocks = blocks
+        self._arrays = arrays
+        self.owner = owner
+        self.n = len(arrays["offsets"]) - 1
+
+    @classmethod
+    def publish(cls, data, name: str = None) -> "SharedDataset":
+        """Decodes a dataset into new shared memory blocks.
+
+        Args:
+            data (dict or str): The datapoints as returned by `get_dataset`, or the path to a `data.json` file, which is streamed.
+            name (str, optional): Prefix of the names of the blocks. Defaults to a random name.
+        """
+        name = name or f"rouskinhf_{os.getpid()}_{secrets.token_hex(4)}"
+        records = iter_json(data) if isinstance(data, str) else data.items()
+
+        references, sequences, pairs = [], [], []
+        signals = {signal: [] for signal in SIGNALS}
+        for reference, attr in records:
+            sequence = standardize_sequence(attr["sequence"])
+            references.append(reference.encode())
+            sequences.append(sequence.encode("ascii"))
+            structure = attr.get("structure")
+            pairs.append(
+                np.asarray(structure, dtype=np.int32).reshape(-1, 2)
+                if structure is not None
+                else None
+            )
+            for signal in SIGNALS:
+                value = attr.get(signal)
+                signals[signal].append(
+                    _signal_array(value) if value is not None else None
+                )
+
+        lengths = np.array([len(s) for s in sequences], dtype=np.int64)
+        for signal in SIGNALS:
+            assert all(
+                v is None or len(v) == length
+                for v, length in zip(signals[signal], lengths)
+            ), f"The {signal} signals must have the length of their sequence"
+        n_pairs = np.array([len(p) if p is not None else 0 for p in pairs])
+        arrays = {
+            "references": np.frombuffer(b"".join(references), dtype=np.uint8),
+            "reference_offsets": np.concatenate(
+                [[0], np.cumsum([len(r) for r in references])]
+            ).astype(np.int64),
+            "sequences": np.frombuffer(b"".join(sequences), dtype=np.uint8),
+            "offsets": np.concatenate([[0], np.cumsum(lengths)]).astype(np.int64),
+            "pairs": np.concatenate(
+                [p for p in pairs if p is not None] + [np.zeros((0, 2), np.int32)]
+            ),
+            "pair_offsets": np.concatenate([[0], np.cumsum(n_pairs)]).astype(np.int64),
+            "has_structure": np.array([p is not None for p in pairs], dtype=bool),
+        }
+        for signal, values in signals.items():
+            arrays[signal] = np.concatenate(
+                [
+                    v if v is not None else np.full(length, np.nan, np.float32)
+                    for v, length in zip(values, lengths)
+                ]
+                + [np.zeros(0, np.float32)]
+            )
+            arrays["has_" + signal] = np.array(
+                [v is not None for v in values], dtype=bool
+            )
+        del references, sequences, pairs, signals
+
+        blocks, shared = {}, {}
+        try:
+            for key, array in arrays.items():
+                blocks[key] = _open_block(f"{name}.{key}", size=array.nbytes)
+                shared[key] = np.ndarray(array.shape, array.dtype, buffer=blocks[key].buf)
+                shared[key][...] = array
+                shared[key].flags.writeable = False
+            meta = json.dumps(
+                {key: [a.dtype.str, list(a.shape)] for key, a in arrays.items()}
+            ).encode()
+            blocks["meta"] = _open_block(f"{name}.meta", size=len(meta))
+            blocks["meta"].buf[: len(meta)] = meta
+        except BaseException:
+            shared.clear()
+            for block in blocks.values():
+                block.close()
+                block.unlink()
+            raise
+        return cls(name, blocks, shared, owner=True)
+
+    @classmethod
+    def attach(cls, name: str) -> "SharedDataset":
+        """Maps the blocks of a dataset published under `name` as read-only arrays, without copying them."""
+        blocks = {"meta": _open_block(f"{name}.meta")}
+        meta = json.loads(bytes(blocks["meta"].buf).rstrip(b"\0"))
+        arrays = {}
+        for key, (dtype, shape) in meta.items():
+            blocks[key] = _open_block(f"{name}.{key}")
+            arrays[key] = np.ndarray(shape, np.dtype(dtype), buffer=blocks[key].buf)
+            arrays[key].flags.writeable = False
+        return cls(name, blocks, arrays)
+
+    def __reduce__(self):
+        return (SharedDataset.attach, (self.name,))
+
+    def __len__(self):
+        return self.n
+
+    def __getitem__(self, idx: int) -> dict:
+        """Returns a datapoint as a dict, whose structure and signals are views of the shared arrays."""
+        if idx < 0:
+            idx += self.n
+        if not 0 <= idx < self.n:
+            raise IndexError(idx)
+        a = self._arrays
+        start, end = a["offsets"][idx], a["offsets"][idx + 1]
+        datapoint = {
+            "reference": bytes(
+                a["references"][a["reference_offsets"][idx] : a["reference_offsets"][idx + 1]]
+            ).decode(),
+            "sequence": bytes(a["sequences"][start:end]).decode("ascii"),
+        }
+        if a["has_structure"][idx]:
+            datapoint["structure"] = a["pairs"][
+                a["pair_offsets"][idx] : a["pair_offsets"][idx + 1]
+            ]
+        for signal in SIGNALS:
+            if a["has_" + signal][idx]:
+                datapoint[signal] = a[signal][start:end]
+        return datapoint
+
+    def __iter__(self):
+        for idx in range(self.n):
+            yield self[idx]
+
+    def close(self) -> None:
+        """Unmaps the blocks from this process. A block still viewed by an array is unmapped when the array is freed."""
+        self._arrays = {}
+        for block in self._blocks.values():
+            try:
+                block.close()
+            except BufferError:
+                pass
+
+    def unlink(self) -> None:
+        """Frees the blocks, for all the processes. Called by the publisher when it is done."""
+        for block in self._blocks.values():
+            block.unlink()
+
+    def __enter__(self):
+        return self
+
+    def __exit__(self, *args):
+        self.close()
+        if self.owner:
+            self.unlink()
@@ -1,4 +1,8 @@
 import os
+import io
+import json
+import gzip
+import base64
 import numpy as np
 
 # Define the one-hot encodings for the sequences and structures
@@ -67,10 +71,130 @@ def sequence_has_regular_characters(sequence):
     return not (set(sequence) - set("ACGU"))
 
 
-def dump_json(data, path):
+_GZIP_MAGIC = b"\x1f\x8b"
+_ZSTD_MAGIC = b"\x28\xb5\x2f\xfd"
+DATA_JSON_EXTENSIONS = {None: "", "gzip": ".gz", "zstd": ".zst"}
+
+
+def _zstandard():
+    try:
+        import zstandard
+    except ImportError:
+        raise ImportError(
+            "zstd compressed datasets need the zstandard package: pip install zstandard"
+        )
+    return zstandard
+
+
+def open_dataset(path, mode="r"):
+    """Opens a dataset file in text mode, with transparent gzip or zstd compression.
+
+    When writing, the compression is chosen by the extension of the file (`.gz` or `.zst`).
+    When reading, it is detected from the magic bytes of the file, whatever its extension. Use mode "rb" to read bytes.
+
+    Example:
+        >>> import tempfile
+        >>> path = os.path.join(tempfile.mkdtemp(), "data.json.gz")
+        >>> with open_dataset(path, "w") as f:
+        ...     _ = f.write('{"ref": {"sequence": "ACGU"}}')
+        >>> open(path, "rb").read(2) == _GZIP_MAGIC
+        True
+        >>> open_dataset(path).read()
+        '{"ref": {"sequence": "ACGU"}}'
+    """
+    if "w" in mode:
+        if path.endswith(DATA_JSON_EXTENSIONS["gzip"]):
+            return gzip.open(path, "wt", compresslevel=6)
+        if path.endswith(DATA_JSON_EXTENSIONS["zstd"]):
+            writer = _zstandard().ZstdCompressor(level=3).stream_writer(
+                open(path, "wb"), closefd=True
+            )
+            return io.TextIOWrapper(writer, encoding="utf-8")
+        return open(path, "w")
+
+    with open(path, "rb") as f:
+        magic = f.read(4)
+    if magic[:2] == _GZIP_MAGIC:
+        return gzip.open(path, mode if "b" in mode else "rt")
+    if magic == _ZSTD_MAGIC:
+        reader = io.BufferedReader(
+            _zstandard().ZstdDecompressor().stream_reader(open(path, "rb"), closefd=True)
+        )
+        return reader if "b" in mode else io.TextIOWrapper(reader, encoding="utf-8")
+    return open(path, mode)
+
+
+def is_compressed(path) -> bool:
+    """Whether a file is compressed with gzip or zstd, from its magic bytes."""
+    with open(path, "rb") as f:
+        magic = f.read(4)
+    return magic[:2] == _GZIP_MAGIC or magic == _ZSTD_MAGIC
+
+
+Q16_SCALE = 10000  # 4 decimals, as produced by Datapoint._format_signal
+
+
+def quantize_signal(signal):
+    """Encodes a signal rounded to 4 decimals as base64 uint16 fixed-point, if all its values are in [0, 6.5535].
+    Otherwise the signal is returned as is.
+
+    Example:
+        >>> quantize_signal([0.0, 0.1234, 1.0])
+        {'q16': 'AADSBBAn'}
+        >>> dequantize_signal({'q16': 'AADSBBAn'})
+        [0.0, 0.1234, 1.0]
+        >>> quantize_signal([-1000.0, 0.5])
+        [-1000.0, 0.5]
+    """
+    values = np.asarray(signal, dtype=np.float64)
+    fixed = np.round(values * Q16_SCALE)
+    if (
+        values.ndim != 1
+        or not np.all((fixed >= 0) & (fixed <= np.iinfo(np.uint16).max))
+        or not np.array_equal(fixed / Q16_SCALE, np.round(values, 4))
+    ):
+        return signal
+    return {"q16": base64.b64encode(fixed.astype("<u2").tobytes()).decode("ascii")}
+
+
+def dequantize_signal(signal):
+    """Decodes a signal encoded by `quantize_signal`. Other signals are returned as is."""
+    if not isinstance(signal, dict) or "q16" not in signal:
+        return signal
+    return (
+        np.frombuffer(base64.b64decode(signal["q16"]), dtype="<u2") / Q16_SCALE
+    ).tolist()
+
+
+def quantize_signals(attr: dict) -> dict:
+    """Quantize the dms and shape signals of a datapoint."""
+    return {
+        k: quantize_signal(v) if k in ["dms", "shape"] and v is not None else v
+        for k, v in attr.items()
+    }
+
+
+def dequantize_signals(attr: dict) -> dict:
+    """Decode the quantized dms and shape signals of a datapoint."""
+    return {
+        k: dequantize_signal(v) if k in ["dms", "shape"] else v
+        for k, v in attr.items()
+    }
+
+
+def load_json(path) -> dict:
+    """Loads a dataset file, compressed or not, with its quantized signals decoded."""
+    with open_dataset(path) as f:
+        data = json.load(f)
+    return {ref: dequantize_signals(attr) for ref, attr in data.items()}
+
+
+def dump_json(data, path, quantize=False):
     if os.path.dirname(path) != "":
         os.makedirs(os.path.dirname(path), exist_ok=True)
-    with open(path, "w") as f:
+    if quantize:
+        data = {ref: quantize_signals(attr) for ref, attr in data.items()}
+    with open_dataset(path, "w") as f:
         f.write("{\n")
         for idx, (ref, attr) in enumerate(
             data.items()
@@ -89,3 +213,97 @@ def dump_json(data, path):
                 del attr[k]
             f.write(str({ref: attr})[1:-1].replace("'", '"'))
             f.write(",\n" if idx != len(data) - 1 else "\n}")
+        if not len(data):
+            f.write("}")
+
+
+def iter_json(path, chunk_size=1 << 20):
+    """Iterates over the (key, value) pairs of a json object file without loading the whole file in memory.
+    The file can be compressed, see `open_dataset`.
+
+    Example:
+        >>> import tempfile
+        >>> path = os.path.join(tempfile.mkdtemp(), "data.json")
+        >>> dump_json({"ref1": {"sequence": "ACGU"}, "ref2": {"sequence": "GGCC"}}, path)
+        >>> list(iter_json(path, chunk_size=4))
+        [('ref1', {'sequence': 'ACGU'}), ('ref2', {'sequence': 'GGCC'})]
+    """
+    decoder = json.JSONDecoder()
+    with open_dataset(path) as f:
+        buffer, pos, eof = "", 0, False
+
+        def skip(chars):
+            # move to the next character that is not in `chars`, reading more data if needed
+            nonlocal buffer, pos, eof
+            while True:
+                while pos < len(buffer) and buffer[pos] in chars:
+                    pos += 1
+                if pos < len(buffer) or eof:
+                    return buffer[pos] if pos < len(buffer) else None
+                buffer, pos = f.read(chunk_size), 0
+                eof = len(buffer) == 0
+
+        def decode():
+            # decode the next json value, reading more data until it is complete
+            nonlocal buffer, pos, eof
+            skip(" \t\r\n")
+            while True:
+                try:
+                    value, end = decoder.raw_decode(buffer, pos)
+                    if end < len(buffer) or eof:
+                        pos = end
+                        return value
+                except json.JSONDecodeError:
+                    if eof:
+                        raise
+                chunk = f.read(chunk_size)
+                eof = len(chunk) == 0
+                buffer, pos = buffer[pos:] + chunk, 0
+
+        assert skip(" \t\r\n") == "{", f"{path} is not a json object"
+        pos += 1
+        while skip(" \t\r\n,") not in ["}", None]:
+            key = decode()
+            assert skip(" \t\r\n") == ":", f"{path} is not a valid json object"
+            pos += 1
+            yield key, decode()
+
+
+class JsonWriter:
+    """Writes a json object file one (key, value) pair at a time, the counterpart of `iter_json`.
+    The file is compressed if its extension is `.gz` or `.zst`, see `open_dataset`.
+
+    Example:
+        >>> import tempfile
+        >>> path = os.path.join(tempfile.mkdtemp(), "data.json")
+        >>> with JsonWriter(path) as writer:
+        ...     writer.write("ref1", {"sequence": "ACGU"})
+        ...     writer.write("ref2", {"sequence": "GGCC"})
+        >>> list(iter_json(path)) == [("ref1", {"sequence": "ACGU"}), ("ref2", {"sequence": "GGCC"})], len(writer)
+        (True, 2)
+    """
+
+    def __init__(self, path):
+        self.path = path
+        self._file = None
+        self._n = 0
+
+    def __enter__(self):
+        if os.path.dirname(self.path) != "":
+            os.makedirs(os.path.dirname(self.path), exist_ok=True)
+        self._file = open_dataset(self.path, "w")
+        self._file.write("{\n")
+        return self
+
+    def write(self, key, value):
+        if self._n:
+            self._file.write(",\n")
+        self._file.write(json.dumps(key) + ":" + json.dumps(value))
+        self._n += 1
+
+    def __len__(self):
+        return self._n
+
+    def __exit__(self, *args):
+        self._file.write("\n}\n" if self._n else "}\n")
+        self._file.close()